@@ -0,0 +1,65 @@
+"""Benchmark shelf codecs on size, encode and decode time of stash contexts.
+
+Run from the root tango-core directory:
+
+    python benchmarks/codec.py
+
+Contexts are pulled from the stash of the test sites, plus one list-heavy
+context of the kind which makes a shelf large.
+"""
+
+import sys
+import timeit
+
+sys.path.append('tests')
+
+from tango.codec import codecs
+from tango.factory.context import build_module_routes
+
+
+def stash_contexts():
+    "Contexts of test site stashes, by route, plus a large list export."
+    contexts = {}
+    for name in ('testsite.stash', 'sampletypes', 'simplest'):
+        for route in build_module_routes(name, import_stash=True):
+            contexts[route.rule] = route.context or {}
+    records = [{'id': x, 'title': u'Item {0}'.format(x), 'tags': ['a', 'b'],
+                'score': x * 0.5, 'published': x % 2 == 0}
+               for x in range(20000)]
+    contexts['<20000 records>'] = {'title': 'Records', 'records': records}
+    return contexts
+
+
+def per_call_ms(function, number):
+    "Best of three runs of function, in milliseconds per call."
+    return min(timeit.Timer(function).repeat(3, number)) / number * 1000
+
+
+def main():
+    contexts = stash_contexts()
+    print '{0:<12} {1:>10} {2:>12} {3:>12}'.format('codec', 'bytes',
+                                                   'encode ms', 'decode ms')
+    for name in sorted(codecs):
+        codec = codecs[name]
+        size = encode_ms = decode_ms = 0
+        skipped = []
+        for rule, context in sorted(contexts.items()):
+            try:
+                data = codec.encode(context)
+            except TypeError:
+                # e.g. JSON cannot encode every Python type.
+                skipped.append(rule)
+                continue
+            number = 10 if len(data) > 100000 else 1000
+            size += len(data)
+            encode_ms += per_call_ms(lambda: codec.encode(context), number)
+            decode_ms += per_call_ms(lambda: codec.decode(data), number)
+        print '{0:<12} {1:>10} {2:>12.3f} {3:>12.3f}'.format(
+            name, size, encode_ms, decode_ms),
+        if skipped:
+            print '(skipped {0})'.format(', '.join(skipped)),
+        print
+
+
+if __name__ == '__main__':
+    main()
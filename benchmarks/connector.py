@@ -0,0 +1,63 @@
+"""Benchmark per-request latency of a stashed view through the shelf connector.
+
+Run from the root tango-core directory:
+
+    python benchmarks/connector.py
+
+Compares the pooled connector bound to the app, which checks the schema once
+and reuses one sqlite connection per thread, to a connector rebuilt on every
+request, which connects and checks the schema on every request.
+"""
+
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.append('tests')
+
+from tango.factory.app import build_app
+from tango.factory.stash import shelve
+
+
+REQUESTS = 2000
+
+
+def build_shelved_app(site='testsite'):
+    "Build an app for the site, shelved to a temporary sqlite file."
+    _, filepath = tempfile.mkstemp(suffix='.db')
+    app = build_app(site, import_stash=True, use_snapshot=False)
+    app.config['SQLITE_FILEPATH'] = filepath
+    shelve(app)
+    app.close_connector()
+    return app, filepath
+
+
+def per_request_ms(function, number=REQUESTS):
+    "Best of three runs of function, in milliseconds per call."
+    timer = timeit.Timer(function)
+    return min(timer.repeat(3, number)) / number * 1000
+
+
+def main():
+    app, filepath = build_shelved_app()
+    client = app.test_client()
+
+    def pooled():
+        client.get('/route1.txt')
+
+    def unpooled():
+        client.get('/route1.txt')
+        # Discard the connector, as if it were constructed for each request.
+        app.close_connector()
+
+    try:
+        print 'unpooled: {0:.3f} ms/request'.format(per_request_ms(unpooled))
+        print 'pooled:   {0:.3f} ms/request'.format(per_request_ms(pooled))
+    finally:
+        app.close_connector()
+        os.unlink(filepath)
+
+
+if __name__ == '__main__':
+    main()
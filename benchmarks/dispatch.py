@@ -0,0 +1,68 @@
+"""Benchmark dispatch of stashed routes, by URL matching and by fast path.
+
+Run from the root tango-core directory:
+
+    python benchmarks/dispatch.py
+
+Builds an app with many parameterless routes sharing one shelved context, and
+requests the last one added through the WSGI app, with FAST_DISPATCH off and
+on.  URL matching tries rules in turn, so its cost grows with the rule count.
+Building the largest app takes minutes, as werkzeug sorts its rules on every
+rule added.
+"""
+
+import os
+import tempfile
+import timeit
+
+from werkzeug.test import create_environ
+
+from tango.app import Route, Tango
+
+
+ROUTES = (100, 1000, 10000)
+REQUESTS = 500
+
+
+def build_routes_app(count):
+    "Build an app with count shelved routes, and the path of the last one."
+    _, filepath = tempfile.mkstemp(suffix='.db')
+    app = Tango('benchmark')
+    app.config['SQLITE_FILEPATH'] = filepath
+    context = {'title': 'Benchmark', 'sequence': range(10)}
+    routes = [Route('benchmark', '/page/{0}/'.format(x), {}, context=context)
+              for x in range(count)]
+    for route in routes:
+        app.build_view(route)
+    app.connector.put_many((route.site, route.rule, route.context)
+                           for route in routes)
+    return app, filepath, routes[-1].rule
+
+
+def per_request_ms(app, path, number=REQUESTS):
+    "Best of three runs of requests to path, in milliseconds per request."
+    environ = create_environ(path)
+    start_response = lambda status, headers: None
+    def request():
+        for _ in app.wsgi_app(environ.copy(), start_response):
+            pass
+    return min(timeit.Timer(request).repeat(3, number)) / number * 1000
+
+
+def main():
+    print '{0:>8} {1:>12} {2:>12}'.format('routes', 'matched ms', 'fast ms')
+    for count in ROUTES:
+        app, filepath, path = build_routes_app(count)
+        try:
+            app.config['FAST_DISPATCH'] = False
+            matched = per_request_ms(app, path)
+            app.config['FAST_DISPATCH'] = True
+            fast = per_request_ms(app, path)
+        finally:
+            app.close_connector()
+            os.unlink(filepath)
+        print '{0:>8} {1:>12.3f} {2:>12.3f}'.format(count, matched, fast)
+
+
+if __name__ == '__main__':
+    main()
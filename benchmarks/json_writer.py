@@ -0,0 +1,85 @@
+"""Benchmark JSON responses of a large nested context, written and stored.
+
+Run from the root tango-core directory:
+
+    python benchmarks/json_writer.py
+
+Compares writing the context with JsonWriter as it was, encoding each value
+twice, with JsonWriter as it is, encoding each value once, and with serving
+the response pre-rendered at shelve time, as with SHELF_PRERENDER_JSON.
+"""
+
+import json
+import os
+import tempfile
+import timeit
+
+from tango.app import Route, Tango
+from tango.factory.stash import shelve
+from tango.writers import JsonWriter
+
+
+def large_context():
+    "A context of nested records, with an export JSON cannot encode."
+    records = [{'id': x, 'title': u'Item {0}'.format(x), 'tags': ['a', 'b'],
+                'score': x * 0.5, 'author': {'name': 'Author', 'id': x % 7}}
+               for x in range(5000)]
+    sections = dict(('section{0}'.format(x), records[x * 100:x * 100 + 100])
+                    for x in range(50))
+    return dict(sections, title='Records', records=records,
+                tags=set(['a', 'b']))
+
+
+def two_pass_write(context):
+    "JsonWriter.write as it was, encoding values to test them, then again."
+    trimmed_context = {}
+    for key, value in context.items():
+        try:
+            json.dumps({key: value})
+            trimmed_context[key] = value
+        except TypeError:
+            pass
+    return unicode(json.dumps(trimmed_context))
+
+
+def per_call_ms(function, number):
+    "Best of three runs of function, in milliseconds per call."
+    return min(timeit.Timer(function).repeat(3, number)) / number * 1000
+
+
+def main():
+    context = large_context()
+    writer = JsonWriter()
+    assert writer.write(context) == two_pass_write(context)
+
+    _, filepath = tempfile.mkstemp(suffix='.db')
+    app = Tango('benchmark')
+    app.config['SQLITE_FILEPATH'] = filepath
+    app.config['SHELF_CONDITIONAL'] = False
+    route = Route('benchmark', '/index.json', {}, writer_name='json',
+                  context=context)
+    app.routes = [route]
+    app.build_view(route)
+    client = app.test_client()
+    try:
+        app.config['SHELF_PRERENDER_JSON'] = False
+        shelve(app)
+        rendered_ms = per_call_ms(lambda: client.get('/index.json'), 10)
+        app.config['SHELF_PRERENDER_JSON'] = True
+        shelve(app)
+        stored_ms = per_call_ms(lambda: client.get('/index.json'), 10)
+    finally:
+        app.close_connector()
+        os.unlink(filepath)
+
+    print '{0} bytes of JSON'.format(len(writer.write(context)))
+    print '{0:<28} {1:>10.3f} ms'.format(
+        'write, two passes', per_call_ms(lambda: two_pass_write(context), 10))
+    print '{0:<28} {1:>10.3f} ms'.format(
+        'write, one pass', per_call_ms(lambda: writer.write(context), 10))
+    print '{0:<28} {1:>10.3f} ms'.format('request, rendered', rendered_ms)
+    print '{0:<28} {1:>10.3f} ms'.format('request, pre-rendered', stored_ms)
+
+
+if __name__ == '__main__':
+    main()
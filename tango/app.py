@@ -1,14 +1,35 @@
 "Core Tango classes for creating applications from Tango sites."
 
+from datetime import datetime
+import atexit
+import errno
+import hashlib
+import os
+import threading
+import time
+import weakref
+
 from flask import Flask, current_app, request, _request_ctx_stack
-from jinja2 import Environment, PackageLoader, TemplateNotFound
+from flask import request_finished, stream_with_context
+from flask.ctx import RequestContext
+from jinja2 import Environment, FileSystemBytecodeCache, PackageLoader
+from jinja2 import TemplateNotFound
+from jinja2.loaders import split_template_path
+from jinja2.meta import find_referenced_templates
 from werkzeug import LocalProxy as Proxy
+from werkzeug.http import is_resource_modified, quote_etag
 from werkzeug.utils import get_content_type
 
 import tango
+import tango.metrics
 from tango.errors import NoSuchWriterException
 from tango.imports import module_is_package
+from tango.shelf import CachedConnector, ChunkedList, LazyContext
+from tango.timing import Histograms, SIZE_BUCKETS
+from tango.timing import start_timer, stop_timer, timed
+from tango.tools import atomic_write
 from tango.writers import TemplateWriter, TextWriter, JsonWriter
+from tango.writers import JsonStreamWriter, NdjsonWriter
 
 
 __all__ = ['Tango', 'config', 'request', 'Proxy']
@@ -16,6 +37,10 @@ __all__ = ['Tango', 'config', 'request', 'Proxy']
 
 config = Proxy(lambda: current_app.config)
 
+# Apps with a shelf connector open, by id, closed at interpreter exit.  Held
+# weakly, so that an app and its connector can be freed before exit.
+_connected_apps = weakref.WeakValueDictionary()
+
 
 class Tango(Flask):
     "Application class for a Tango site."
@@ -29,6 +54,19 @@ class Tango(Flask):
         self.set_default_config()
         self.writers = {}
         self.register_default_writers()
+        self.url_argument_generators = {}
+        # (view, url rule) of stashed routes without arguments, by path.
+        self.fast_views = {}
+        # Histograms of phase times of stashed views, and of the sizes of
+        # contexts they read, if SHELF_TIMING or METRICS_PATH is set.
+        self.phase_timings = Histograms()
+        self.context_sizes = Histograms(SIZE_BUCKETS)
+        self.metrics_dumped = 0
+        # (version, uptodate functions) of template writers, by template.
+        self.template_versions = {}
+        self._connector = None
+        self._connector_class = None
+        self._connector_lock = threading.Lock()
 
     def set_default_config(self):
         self.config.from_object('tango.config')
@@ -39,11 +77,188 @@ class Tango(Flask):
         options = dict(self.jinja_options)
         if 'autoescape' not in options:
             options['autoescape'] = self.select_jinja_autoescape
-        return Environment(loader=TemplateLoader(self.import_name), **options)
+        if 'bytecode_cache' not in options:
+            options['bytecode_cache'] = TemplateBytecodeCache(self)
+        loader = TemplateLoader(self.import_name, config=self.config)
+        return TemplateEnvironment(loader=loader, **options)
+
+    def precompile_templates(self):
+        """Compile all of the site's templates, to fill the bytecode cache.
+
+        Templates under variant directories, e.g. default/, are also compiled
+        by the names they are found by as fallbacks, since the cache is keyed
+        by template name.
+        Returns the names of templates compiled, sorted.
+
+        Test:
+        >>> import shutil, tempfile
+        >>> app = Tango('simplesite')
+        >>> app.config['JINJA_BYTECODE_CACHE_DIR'] = tempfile.mkdtemp()
+        >>> app.precompile_templates()
+        ... # doctest:+NORMALIZE_WHITESPACE
+        ['base.html', 'default/index.html', 'index.html', 'index.txt',
+         'index.xml']
+        >>> len(os.listdir(app.config['JINJA_BYTECODE_CACHE_DIR']))
+        5
+        >>> shutil.rmtree(app.config['JINJA_BYTECODE_CACHE_DIR'])
+        >>>
+        """
+        environment = self.jinja_env
+        try:
+            names = set(environment.loader.list_templates())
+        except OSError:
+            # The site has no templates directory.
+            return []
+        prefixes = [variant + '/' for variant in environment.loader.variants
+                    if variant]
+        for name in list(names):
+            for prefix in prefixes:
+                if name.startswith(prefix):
+                    names.add(name[len(prefix):])
+        for name in names:
+            environment.get_template(name)
+        return sorted(names)
+
+    def warm_up(self, contexts=0):
+        """Do the work of first requests ahead of them, e.g. before forking.
+
+        Resolves the writer of each route, loads the templates of template
+        writers along with templates they extend, include or import, and gets
+        the contexts of the first routes, as many as given, from the shelf,
+        which fills the shelf cache if SHELF_CACHE is set.  Returns
+        [(phase, count, seconds)] of the work done.
+
+        Test:
+        >>> from tango.factory.app import build_app
+        >>> app = build_app('simplesite')
+        >>> [(phase, count) for phase, count, _ in app.warm_up(contexts=10)]
+        [('writers', 1), ('templates', 2), ('contexts', 1)]
+        >>> sorted(app.jinja_env.cache)
+        ['base.html', 'index.html']
+        >>>
+        """
+        report = []
+
+        start = time.time()
+        writers = set()
+        for route in self.routes:
+            writers.add(self.get_writer(route.writer_name))
+        report.append(('writers', len(writers), time.time() - start))
+
+        start = time.time()
+        environment = self.jinja_env
+        templates = self.referenced_templates(
+            writer.template_name for writer in writers
+            if isinstance(writer, TemplateWriter))
+        for name, _, _, _ in templates:
+            environment.get_template(name)
+        report.append(('templates', len(templates), time.time() - start))
+
+        start = time.time()
+        routes = self.routes[:contexts]
+        for route in routes:
+            self.connector.get(route.site, route.rule)
+        report.append(('contexts', len(routes), time.time() - start))
+        return report
+
+    def referenced_templates(self, names):
+        """Get the sources of templates along with those they reference.
+
+        Follows the templates which those named extend, include or import, in
+        turn.  Returns [(name, source, filename, uptodate)], of the templates
+        found; those not found are left to fail as they would on request.
+
+        Test:
+        >>> app = Tango('simplesite')
+        >>> sorted(name for name, _, _, _
+        ...        in app.referenced_templates(['index.html', 'nosuch.html']))
+        ['base.html', 'index.html']
+        >>>
+        """
+        environment = self.jinja_env
+        pending = set(names)
+        seen = set()
+        templates = []
+        while pending:
+            name = pending.pop()
+            seen.add(name)
+            try:
+                source, filename, uptodate = environment.loader.get_source(
+                    environment, name)
+            except TemplateNotFound:
+                continue
+            templates.append((name, source, filename, uptodate))
+            parsed = environment.parse(source, name)
+            for reference in find_referenced_templates(parsed):
+                # A reference is None if computed as the template renders.
+                if reference is not None and reference not in seen:
+                    pending.add(reference)
+        return templates
+
+    def template_version(self, writer):
+        """Get (checksum, mtime) of the templates a writer renders, or None.
+
+        The version covers a template writer's template and the templates it
+        references, so that a template edit changes the version of responses
+        rendered from it.  None for other writers.  It is kept until any of
+        the templates is out of date, checked at a stat per template, as
+        Jinja checks templates for reload.
+
+        Test:
+        >>> app = Tango('simplesite')
+        >>> writer = TemplateWriter('index.html')
+        >>> checksum, mtime = app.template_version(writer)
+        >>> len(checksum), mtime > 0
+        (40, True)
+        >>> app.template_version(TextWriter()) is None
+        True
+        >>>
+        """
+        if not isinstance(writer, TemplateWriter):
+            return None
+        name = writer.template_name
+        entry = self.template_versions.get(name)
+        if entry is not None and \
+           all(uptodate is not None and uptodate()
+               for uptodate in entry[1]):
+            return entry[0]
+        checksum = hashlib.sha1()
+        mtime = 0
+        uptodates = []
+        for name, source, filename, uptodate in sorted(
+                self.referenced_templates([writer.template_name])):
+            checksum.update(name.encode('utf-8') + '\0')
+            checksum.update(source.encode('utf-8') + '\0')
+            mtime = max(mtime, get_mtime(filename) or 0)
+            uptodates.append(uptodate)
+        version = checksum.hexdigest(), mtime
+        self.template_versions[writer.template_name] = version, uptodates
+        return version
+
+    def response_version(self, route):
+        """Get (etag, mtime) of the response of a stashed route, or None.
+
+        The version covers the shelved context, the writer and, for a template
+        writer, its templates, so that a change to any changes the tag.  None
+        if the context is not shelved, or the connector keeps no versions.
+        """
+        version = self.connector.get_version(route.site, route.rule)
+        if version is None:
+            return None
+        digest, shelved = version
+        template = self.template_version(self.get_writer(route.writer_name))
+        if template is not None:
+            # A template edit changes the response too.
+            checksum, mtime = template
+            digest = u'{0}\0{1}'.format(digest, checksum)
+            shelved = max(shelved, mtime)
+        return make_etag(digest, route.writer_name), shelved
 
     def register_default_writers(self):
         self.register_writer('text', TextWriter())
         self.register_writer('json', JsonWriter())
+        self.register_writer('json-stream', JsonStreamWriter())
+        self.register_writer('ndjson', NdjsonWriter())
 
     def register_writer(self, name, writer):
         self.writers[name] = writer
@@ -68,6 +283,54 @@ class Tango(Flask):
         self.register_writer(a_callable.__name__, a_callable)
         return a_callable
 
+    def writer_context(self, writer, context):
+        """Get a shelved context in the form a writer reads it.
+
+        Tango's template and JSON writers read a lazy context's exports as
+        they need them.  Any other writer gets a template context dictionary,
+        as for :meth:`writer`, with chunked lists read whole.
+
+        Test:
+        >>> app = Tango('simplesite')
+        >>> items = ChunkedList(3, 2, lambda i: range(3)[i * 2:i * 2 + 2])
+        >>> context = LazyContext(set(['items']), {}, lambda names: {
+        ...     'items': items})
+        >>> app.writer_context(JsonWriter(), context) is context
+        True
+        >>> app.writer_context(TextWriter(), context)
+        {'items': [0, 1, 2]}
+        >>>
+        """
+        if isinstance(writer, (TemplateWriter, JsonWriter,
+                               JsonStreamWriter)) or \
+           not isinstance(context, LazyContext):
+            return context
+        return dict((name, list(value) if isinstance(value, ChunkedList)
+                     else value)
+                    for name, value in context.iteritems())
+
+    def url_arguments(self, rule):
+        """Decorator to register a generator of view arguments for a rule.
+
+        The function takes no arguments and returns an iterable of dicts, the
+        view arguments of each URL of the rule, for tasks which visit every
+        URL, e.g. `tango freeze`.
+
+        Test:
+        >>> app = Tango('simplesite')
+        >>> @app.url_arguments('/argument/<argument>/')
+        ... def arguments():
+        ...     return [{'argument': 'one'}, {'argument': 'two'}]
+        ...
+        >>> app.url_argument_generators['/argument/<argument>/']()
+        [{'argument': 'one'}, {'argument': 'two'}]
+        >>>
+        """
+        def decorator(function):
+            self.url_argument_generators[rule] = function
+            return function
+        return decorator
+
     def get_writer(self, name):
         # Do not register writer for None, in case of config change.
         if name is None:
@@ -81,37 +344,239 @@ class Tango(Flask):
             writer = TemplateWriter(template_name)
             self.register_writer(name, writer)
             return writer
+        # A writer prefixed with 'stream:' streams a template as it renders.
+        if name.startswith('stream:'):
+            template_name = name.replace('stream:', '', 1)
+            writer = TemplateWriter(template_name, stream=True)
+            self.register_writer(name, writer)
+            return writer
         raise NoSuchWriterException(name)
 
     @property
     def connector(self):
-        return self.config['SHELF_CONNECTOR_CLASS'](self)
+        """Shelf connector bound to this app, per SHELF_CONNECTOR_CLASS.
+
+        The connector is built once and reused across requests, so that it can
+        pool its resources, and is wrapped in a cache if SHELF_CACHE is set.
+        Resources a request checks out of it, e.g. a sqlite connection, are
+        released at request teardown.  It is closed at interpreter exit, or
+        explicitly by :meth:`close_connector`.
+
+        Test:
+        >>> app = Tango('simplesite')
+        >>> app.connector is app.connector
+        True
+        >>> connector = app.connector
+        >>> app.close_connector()
+        >>> app.connector is connector
+        False
+        >>>
+        """
+        connector_class = self.config['SHELF_CONNECTOR_CLASS']
+        connector = self._connector
+        if connector is None or self._connector_class is not connector_class:
+            with self._connector_lock:
+                connector = self._connector
+                if (connector is None or
+                    self._connector_class is not connector_class):
+                    if connector is not None:
+                        call_connector(connector, 'close')
+                    with timed('connect'):
+                        connector = connector_class(self)
+                        if self.config['SHELF_CACHE']:
+                            connector = CachedConnector(connector)
+                    _connected_apps[id(self)] = self
+                    self._connector = connector
+                    self._connector_class = connector_class
+        return connector
+
+    def close_connector(self):
+        "Close this app's shelf connector, if any, e.g. on app shutdown."
+        with self._connector_lock:
+            connector, self._connector = self._connector, None
+        if connector is not None:
+            call_connector(connector, 'close')
+
+    def do_teardown_request(self, exc=None):
+        "Record the request's timer, and release its shelf resources."
+        try:
+            Flask.do_teardown_request(self, exc)
+        finally:
+            try:
+                self.record_timer(_request_ctx_stack.top)
+            finally:
+                connector = self._connector
+                if connector is not None:
+                    call_connector(connector, 'release')
 
     def build_view(self, route, **options):
         site = route.site
         rule = route.rule
         writer = self.get_writer(route.writer_name)
+        prerenderable = not route.has_arguments
+        writes_json = isinstance(writer, JsonWriter)
         def view(*args, **kwargs):
             ctx = _request_ctx_stack.top
+            if not (self.config['SHELF_TIMING'] or
+                    self.config['METRICS_PATH']):
+                return serve(ctx)
+            ctx.timer = start_timer()
+            ctx.timed_rule = rule
+            try:
+                return serve(ctx)
+            finally:
+                # Time until the response is processed, or the request torn
+                # down, in record_timer.
+                ctx.timer.start('response')
+        def serve(ctx):
+            connector = self.connector
+            # A query string, e.g. asking for a page, is rendered as asked.
+            prerendered = prerenderable and \
+                not request.environ.get('QUERY_STRING') and (
+                    self.config['SHELF_PRERENDER'] or
+                    writes_json and self.config['SHELF_PRERENDER_JSON'])
+            if prerendered and self.config['SHELF_GZIP']:
+                # The response is gzipped or not, as the client accepts.
+                ctx.vary_encoding = True
+            if self.config['SHELF_CONDITIONAL']:
+                with timed('fetch'):
+                    version = self.response_version(route)
+                if version is not None:
+                    ctx.etag, shelved = version
+                    ctx.last_modified = datetime.utcfromtimestamp(shelved)
+                    # Variants of one version differ in tag by encoding.
+                    for etag in (ctx.etag, ctx.etag + '-gzip'):
+                        if not_modified(request.environ, etag,
+                                        ctx.last_modified):
+                            # Answer before reading or rendering the context.
+                            ctx.etag = etag
+                            return self.response_class(status=304)
+            if prerendered:
+                # A response rendered from since edited templates is stale,
+                # and its body would not match the tag of the current ones.
+                template = self.template_version(writer)
+                checksum = template[0] if template is not None else None
+            if prerendered and self.config['SHELF_GZIP'] and \
+               request.accept_encodings['gzip']:
+                with timed('fetch'):
+                    response = connector.get_gzip_response(site, rule,
+                                                           checksum)
+                if response is not None:
+                    body, ctx.mimetype = response
+                    ctx.content_encoding = 'gzip'
+                    if hasattr(ctx, 'etag'):
+                        ctx.etag += '-gzip'
+                    return body
+            if prerendered:
+                with timed('fetch'):
+                    response = connector.get_response(site, rule, checksum)
+                if response is not None:
+                    body, ctx.mimetype = response
+                    return body
             ctx.mimetype = writer.mimetype
-            return writer.write(self.connector.get(site, rule))
+            with timed('fetch'):
+                if hasattr(ctx, 'timer'):
+                    context, ctx.context_size = connector.get_sized(site, rule)
+                else:
+                    context = connector.get(site, rule)
+                context = self.writer_context(writer, context)
+            with timed('render'):
+                written = writer.write(context)
+            if isinstance(written, basestring):
+                return written
+            # A streaming writer writes an iterable of chunks.
+            return self.response_class(stream_with_context(written))
         view.__name__ = route.rule
-        return self.route(route.rule, **options)(view)
+        view = self.route(route.rule, **options)(view)
+        if prerenderable:
+            url_rule = list(self.url_map.iter_rules(route.rule))[-1]
+            self.fast_views[route.rule.encode('utf-8')] = (view, url_rule)
+        return view
+
+    def wsgi_app(self, environ, start_response):
+        """Dispatch a request, by path alone if FAST_DISPATCH allows.
+
+        Requests to stashed routes without view arguments skip URL matching,
+        which is linear in the number of rules, along with before_request
+        functions and the request_started signal.  Otherwise they are
+        dispatched as :meth:`Flask.full_dispatch_request` does: they get a
+        request context, for writers and templates, errors raised by the view
+        go to error handlers, and after_request functions, the
+        request_finished signal and teardown_request functions follow.
+        """
+        if self.config['FAST_DISPATCH'] and \
+           environ['REQUEST_METHOD'] in ('GET', 'HEAD'):
+            fast_view = self.fast_views.get(environ.get('PATH_INFO'))
+            if fast_view is not None:
+                view, url_rule = fast_view
+                with FastRequestContext(self, environ, url_rule):
+                    try:
+                        self.try_trigger_before_first_request_functions()
+                        try:
+                            rv = view()
+                        except Exception, e:
+                            rv = self.handle_user_exception(e)
+                        response = self.make_response(rv)
+                        response = self.process_response(response)
+                        request_finished.send(self, response=response)
+                    except Exception, e:
+                        response = self.make_response(self.handle_exception(e))
+                    return response(environ, start_response)
+        return Flask.wsgi_app(self, environ, start_response)
 
     def process_response(self, response):
-        """Inject mimetype into response before it's sent to the WSGI server.
+        """Inject mimetype & headers into response before it's sent to WSGI.
 
         This is only intended for stashable view functions, created by
         :meth:`Tango.build_view`.
         """
         Flask.process_response(self, response)
         ctx = _request_ctx_stack.top
+        if hasattr(ctx, 'etag'):
+            response.set_etag(ctx.etag)
+            response.last_modified = ctx.last_modified
+        if hasattr(ctx, 'content_encoding'):
+            response.content_encoding = ctx.content_encoding
+        if getattr(ctx, 'vary_encoding', False):
+            response.vary.add('Accept-Encoding')
         if hasattr(ctx, 'mimetype'):
             mimetype, charset = (ctx.mimetype, response.charset)
             response.content_type = get_content_type(mimetype, charset)
             response.headers['Content-Type'] = response.content_type
+        timer = self.record_timer(ctx)
+        if timer is not None and self.debug:
+            response.headers['Server-Timing'] = timer.header()
         return response
 
+    def record_timer(self, ctx):
+        """Stop the timer of a timed request, if still running, and record it.
+
+        Called as the response is processed and again at request teardown,
+        which alone runs for a request whose view raised an unhandled error,
+        so that failed requests are recorded too and the thread's timer is
+        always cleared.  Returns the timer stopped, if any.
+        """
+        timer = getattr(ctx, 'timer', None)
+        if timer is None:
+            return None
+        ctx.timer = None
+        stop_timer()
+        # Phases left open, e.g. 'response', end now.
+        while timer.stack:
+            timer.stop()
+        timer.finish()
+        self.phase_timings.record(ctx.timed_rule, timer.times)
+        if hasattr(ctx, 'context_size'):
+            self.context_sizes.record(ctx.timed_rule,
+                                      {'size': ctx.context_size})
+        tango.metrics.dump_if_due(self)
+        return timer
+
+    def metrics_view(self):
+        "Serve this app's metrics in Prometheus text format, at METRICS_PATH."
+        return self.response_class(tango.metrics.metrics(self),
+                                   content_type=tango.metrics.CONTENT_TYPE)
+
     @property
     def version(self):
         """Application version information, Tango versioning by default.
@@ -127,6 +592,18 @@ class Tango(Flask):
                                  self.config['TANGO_MAINTAINER'])
 
 
+class FastRequestContext(RequestContext):
+    "Request context for a URL rule already known, without URL matching."
+
+    def __init__(self, app, environ, url_rule):
+        self.url_rule = url_rule
+        RequestContext.__init__(self, app, environ)
+
+    def match_request(self):
+        self.request.url_rule = self.url_rule
+        self.request.view_args = {}
+
+
 class Route(object):
     "Route metadata for a Tango stashable context module."
 
@@ -152,8 +629,12 @@ class Route(object):
     # modules from which this stash module was constructed
     modules = None
 
+    # paths of data files which the modules' contexts are pulled from, as
+    # declared in their headers, possibly glob patterns
+    depends = None
+
     def __init__(self, site, rule, exports, static=None, writer_name=None,
-                 context=None, modules=None):
+                 context=None, modules=None, depends=None):
         self.site = site
         self.rule = rule
         self.exports = exports
@@ -162,6 +643,12 @@ class Route(object):
 
         self.context = context
         self.modules = modules
+        self.depends = depends
+
+    @property
+    def has_arguments(self):
+        "True if the rule takes view arguments, i.e. has <variable> parts."
+        return '<' in self.rule
 
     def __repr__(self):
         pattern = u'<Route: {0}{1}>'
@@ -171,10 +658,40 @@ class Route(object):
             return pattern.format(self.rule, ', {0}'.format(self.writer_name))
 
 
+class TemplateEnvironment(Environment):
+    """Jinja environment which counts the templates it compiles.
+
+    Templates loaded from the bytecode cache are not compiled, nor counted.
+
+    Test:
+    >>> environment = TemplateEnvironment(loader=TemplateLoader('simplesite'))
+    >>> environment.get_template('index.html') # doctest:+ELLIPSIS
+    <Template 'index.html'>
+    >>> environment.compiled_count
+    1
+    >>>
+    """
+
+    def __init__(self, *args, **kwargs):
+        Environment.__init__(self, *args, **kwargs)
+        self.compiled_count = 0
+        self.compiled_lock = threading.Lock()
+
+    def compile(self, source, name=None, filename=None, raw=False,
+                defer_init=False):
+        with self.compiled_lock:
+            self.compiled_count += 1
+        return Environment.compile(self, source, name, filename, raw,
+                                   defer_init)
+
+
 class TemplateLoader(PackageLoader):
     """Template loader which looks for defaults.
 
     As Tango handles device detection, it will find templates implicitly here.
+    A template name is looked for in each variant directory of the templates
+    directory in turn, '' being the templates directory itself.  Variants are
+    read from the config given, as TEMPLATE_VARIANTS, if any.
 
     Example:
     >>> environment = Environment(loader=TemplateLoader('simplesite'))
@@ -189,11 +706,213 @@ class TemplateLoader(PackageLoader):
     >>> index.filename # doctest:+ELLIPSIS
     '.../simplesite/templates/default/index.html'
     >>>
+
+    Where a name resolves to, or that it resolves to nothing, is remembered,
+    for as long as the mtimes of the directories looked in are unchanged:
+    >>> loader = environment.loader
+    >>> loader.resolve('index.html')
+    'default/index.html'
+    >>> loader.resolve('nosuch.html') is None
+    True
+    >>> sorted(loader.resolved[('', 'default')])
+    ['base.html', 'index.html', 'nosuch.html']
+    >>>
     """
 
+    default_variants = ('', 'default')
+
+    def __init__(self, package_name, package_path='templates',
+                 encoding='utf-8', config=None):
+        PackageLoader.__init__(self, package_name, package_path, encoding)
+        self.config = config
+        # Entries of lookup by template name, by variants.
+        self.resolved = {}
+        self.directory = None
+        if self.filesystem_bound:
+            self.directory = self.provider.get_resource_filename(
+                self.manager, package_path)
+
+    @property
+    def variants(self):
+        if self.config is None:
+            return self.default_variants
+        return tuple(self.config.get('TEMPLATE_VARIANTS',
+                                     self.default_variants))
+
+    def resolve(self, template):
+        "Resolve a template name to the name of its variant, or None."
+        return self.lookup(template)[0]
+
+    def lookup(self, template):
+        """Get (name resolved or None, [(directory, mtime)]) for a template.
+
+        Mtimes of the directories looked in are checked on each call, so a
+        variant added or removed is found, at a stat per directory.
+        """
+        variants = self.variants
+        resolved = self.resolved.get(variants)
+        if resolved is None:
+            resolved = self.resolved.setdefault(variants, {})
+        entry = resolved.get(template)
+        if entry is not None and self.is_current(entry[1]):
+            return entry
+        pieces = split_template_path(template)
+        name = None
+        stamps = []
+        for variant in variants:
+            candidate = '/'.join([variant] + pieces if variant else pieces)
+            if self.directory is not None:
+                filepath = os.path.join(self.directory, variant, *pieces)
+                directory = os.path.dirname(filepath)
+                stamps.append((directory, get_mtime(directory)))
+            path = '/'.join((self.package_path, candidate))
+            if self.provider.has_resource(path):
+                name = candidate
+                break
+        entry = resolved[template] = (name, stamps)
+        return entry
+
+    def is_current(self, stamps):
+        for directory, mtime in stamps:
+            if get_mtime(directory) != mtime:
+                return False
+        return True
+
     def get_source(self, environment, template):
+        name, stamps = self.lookup(template)
+        if name is None:
+            raise TemplateNotFound(template)
+        source, filename, uptodate = PackageLoader.get_source(
+            self, environment, name)
+        if uptodate is None:
+            return source, filename, uptodate
+        # Reload also if another variant now takes precedence.
+        return (source, filename,
+                lambda: uptodate() and self.is_current(stamps))
+
+
+def call_connector(connector, name):
+    """Call a shelf connector's method by name, if it has one.
+
+    A SHELF_CONNECTOR_CLASS need only provide get and put; one not derived
+    from :class:`BaseConnector` may lack e.g. release and close.
+
+    >>> class Connector(object):
+    ...     def close(self):
+    ...         print 'Closed.'
+    ...
+    >>> call_connector(Connector(), 'close')
+    Closed.
+    >>> call_connector(Connector(), 'release')
+    >>>
+    """
+    method = getattr(connector, name, None)
+    if method is not None:
+        method()
+
+
+@atexit.register
+def close_connectors():
+    "Close the shelf connectors of all apps still alive."
+    for app in _connected_apps.values():
+        app.close_connector()
+
+
+def get_mtime(filepath):
+    "Get the mtime of a file or directory, or None if it does not exist."
+    try:
+        return os.stat(filepath).st_mtime
+    except OSError:
+        return None
+
+
+class TemplateBytecodeCache(FileSystemBytecodeCache):
+    """Cache of compiled templates in an app's JINJA_BYTECODE_CACHE_DIR.
+
+    The directory is read from the app's config as templates load, so that
+    it applies even if configured after the Jinja environment is created.
+    Nothing is cached while it is None.
+
+    Test:
+    >>> import shutil, tempfile
+    >>> app = Tango('simplesite')
+    >>> environment = app.jinja_env
+    >>> app.config['JINJA_BYTECODE_CACHE_DIR'] = tempfile.mkdtemp()
+    >>> environment.get_template('base.html')
+    <Template 'base.html'>
+    >>> len(os.listdir(app.config['JINJA_BYTECODE_CACHE_DIR']))
+    1
+    >>> shutil.rmtree(app.config['JINJA_BYTECODE_CACHE_DIR'])
+    >>>
+    """
+
+    pattern = '__jinja2_%s.cache'
+
+    def __init__(self, app):
+        # Do not call FileSystemBytecodeCache.__init__, which sets directory.
+        self.app = app
+
+    @property
+    def directory(self):
+        return self.app.config['JINJA_BYTECODE_CACHE_DIR']
+
+    def load_bytecode(self, bucket):
+        "Read a cache file, if any; one this process may not read is a miss."
+        if self.directory is None:
+            return
         try:
-            return PackageLoader.get_source(self, environment, template)
-        except TemplateNotFound:
-            template = 'default/' + template
-            return PackageLoader.get_source(self, environment, template)
+            FileSystemBytecodeCache.load_bytecode(self, bucket)
+        except IOError, e:
+            if e.errno not in (errno.EACCES, errno.EPERM):
+                raise
+            bucket.reset()
+
+    def dump_bytecode(self, bucket):
+        "Write a cache file aside, then rename it, as workers may share it."
+        if self.directory is None:
+            return
+        # Readable by workers, which may run as another user than precompile.
+        with atomic_write(self._get_cache_filename(bucket),
+                          mode=0644) as fileobj:
+            bucket.write_bytecode(fileobj)
+
+
+def make_etag(digest, writer_name):
+    """Make the entity tag of a stashed view, unquoted.
+
+    A response depends on the shelved context and on how it is written, so
+    the tag changes with either; a stashed view gives a digest which covers
+    the templates of a template writer along with the context.
+
+    >>> make_etag('0123abcd', 'index.html') == make_etag('0123abcd', None)
+    False
+    >>> len(make_etag('0123abcd', 'index.html'))
+    40
+    >>>
+    """
+    tag = u'{0}\0{1}'.format(digest, writer_name or '')
+    return hashlib.sha1(tag.encode('utf-8')).hexdigest()
+
+
+def not_modified(environ, etag, last_modified):
+    """True if the client's copy is current, for a 304 Not Modified response.
+
+    Only GET and HEAD requests are conditional.
+
+    >>> from werkzeug.test import create_environ
+    >>> last_modified = datetime(2012, 1, 1)
+    >>> environ = create_environ(headers={'If-None-Match': '"spam"'})
+    >>> not_modified(environ, 'spam', last_modified)
+    True
+    >>> not_modified(environ, 'eggs', last_modified)
+    False
+    >>> environ = create_environ(method='POST',
+    ...                          headers={'If-None-Match': '"spam"'})
+    >>> not_modified(environ, 'spam', last_modified)
+    False
+    >>>
+    """
+    if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+        return False
+    return not is_resource_modified(environ, etag=quote_etag(etag),
+                                    last_modified=last_modified)
@@ -0,0 +1,128 @@
+"Codecs which serialize stashed contexts into byte strings for the shelf."
+
+import cPickle as pickle
+import json
+import pickletools
+import zlib
+from cPickle import HIGHEST_PROTOCOL
+
+from tango.errors import NoSuchCodecException
+
+
+codecs = {}
+
+
+def register(codec):
+    "Register a codec instance by its name, for use in SHELF_CODEC."
+    codecs[codec.name] = codec
+    return codec
+
+
+def get_codec(name):
+    """Get a registered codec by name.
+
+    >>> get_codec('zlib+json') # doctest:+ELLIPSIS
+    <tango.codec.ZlibCodec object at 0x...>
+    >>> get_codec('yaml')
+    Traceback (most recent call last):
+      ...
+    NoSuchCodecException: yaml
+    >>>
+    """
+    codec = codecs.get(name)
+    if codec is None:
+        raise NoSuchCodecException(name)
+    return codec
+
+
+class BaseCodec(object):
+    """A codec, which encodes a value to a byte string and decodes it back.
+
+    A codec's name is recorded with each value shelved, so that a shelf which
+    mixes codecs can still be read.  Do not rename a codec once it's in use.
+    """
+
+    # name to register the codec under, and to record in the shelf
+    name = None
+
+    def encode(self, value):
+        raise NotImplementedError("Where is this codec's encode method?")
+
+    def decode(self, data):
+        raise NotImplementedError("Where is this codec's decode method?")
+
+
+class PickleCodec(BaseCodec):
+    """Pickle values, which supports any picklable Python type.
+
+    Only read pickles from a shelf which you trust; unpickling runs code.
+
+    Test:
+    >>> codec = PickleCodec()
+    >>> codec.decode(codec.encode({'tuple': (1, 2), 'long': 1L}))
+    {'long': 1L, 'tuple': (1, 2)}
+    >>>
+    """
+
+    name = 'pickle'
+
+    def encode(self, value):
+        # Optimize pickle size, at some cost to shelving time.
+        return pickletools.optimize(pickle.dumps(value, HIGHEST_PROTOCOL))
+
+    def decode(self, data):
+        return pickle.loads(data)
+
+
+class JsonCodec(BaseCodec):
+    """Encode values as JSON, which is safe to decode from any source.
+
+    Only JSON types survive: tuples decode as lists, strings as unicode, and
+    dict keys as unicode strings.  Encoding other types raises TypeError.
+
+    Test:
+    >>> codec = JsonCodec()
+    >>> codec.encode({'count': ['one', 'two'], 'answer': 42})
+    '{"count":["one","two"],"answer":42}'
+    >>> codec.decode(codec.encode({'tuple': (1, 2)}))
+    {u'tuple': [1, 2]}
+    >>>
+    """
+
+    name = 'json'
+
+    def encode(self, value):
+        return json.dumps(value, separators=(',', ':'))
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class ZlibCodec(BaseCodec):
+    """Compress the output of another codec with zlib.
+
+    Test:
+    >>> codec = ZlibCodec(PickleCodec())
+    >>> codec.name
+    'zlib+pickle'
+    >>> codec.decode(codec.encode({'sequence': range(3)}))
+    {'sequence': [0, 1, 2]}
+    >>>
+    """
+
+    def __init__(self, codec, level=6):
+        self.codec = codec
+        self.level = level
+        self.name = 'zlib+' + codec.name
+
+    def encode(self, value):
+        return zlib.compress(self.codec.encode(value), self.level)
+
+    def decode(self, data):
+        return self.codec.decode(zlib.decompress(data))
+
+
+register(PickleCodec())
+register(JsonCodec())
+register(ZlibCodec(PickleCodec()))
+register(ZlibCodec(JsonCodec()))
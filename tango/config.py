@@ -4,9 +4,87 @@ from tango.shelf import SqliteConnector
 from tango.writers import TextWriter
 
 
-# Default stash shelf configuration.
+# Default stash shelf configuration.  A connector class is called with the
+# app, and its objects need only get and put contexts; release and close are
+# called if defined.  SHELF_CACHE, SHELF_TIMING, prerendering and conditional
+# responses need the rest of tango.shelf.BaseConnector, which subclasses get.
 SHELF_CONNECTOR_CLASS = SqliteConnector
 SQLITE_FILEPATH = '/tmp/tango.db'
+# Idle sqlite connections kept open for reuse by the next request, in any
+# thread; a request checks out one and returns it at teardown.
+SQLITE_POOL_SIZE = 8
+
+# Codec to encode contexts with when shelving, by name as in tango.codec,
+# e.g. 'pickle', 'json', 'zlib+pickle' or 'zlib+json'.  Each shelved context
+# records its codec, so changing this does not require reshelving.
+SHELF_CODEC = 'pickle'
+
+# Read-only shelf file, as served by MmapConnector and built by `tango pack`.
+SHELF_FILEPATH = '/tmp/tango.shelf'
+
+# In-memory cache of unpickled contexts in front of the shelf connector,
+# bounded by number of contexts and by total size of their shelved form.
+SHELF_CACHE = False
+SHELF_CACHE_ENTRIES = 1024
+SHELF_CACHE_BYTES = 64 * 1024 * 1024
+
+# List exports longer than this are shelved in chunks of this many items, so
+# that a page of items reads only its chunks; None to shelve them whole.
+SHELF_CHUNK_ITEMS = 1000
+
+# Number of routes to put to the shelf at a time, when shelving.
+SHELF_BATCH_SIZE = 500
+
+# Whether to render routes without view arguments when shelving, and serve the
+# stored response bodies instead of rendering contexts on each request.
+SHELF_PRERENDER = False
+
+# Whether to pre-render routes without view arguments whose writer is JSON,
+# even if SHELF_PRERENDER is off, e.g. for /index.json to serve stored bytes.
+SHELF_PRERENDER_JSON = False
+
+# Whether to also shelve a gzip variant of each pre-rendered response, served
+# as is to clients which accept gzip, instead of compressing per request.
+SHELF_GZIP = True
+
+# Whether stashed views send ETag & Last-Modified headers from the shelved
+# version of their context and the templates which render it, and answer
+# conditional requests with 304.
+SHELF_CONDITIONAL = False
+
+# Whether to dispatch requests for stashed routes without view arguments by a
+# dict lookup on the request path, skipping URL matching and before_request
+# functions; other requests go through Flask as usual.
+FAST_DISPATCH = False
+
+# Directories under a site's templates directory to look for a template in,
+# in order, '' being the templates directory itself, e.g. ['mobile', '',
+# 'default'] to prefer templates under mobile/.
+TEMPLATE_VARIANTS = ['', 'default']
+
+# Whether to time the phases of requests to stashed views: connect, fetch,
+# decode, render and response.  Times are kept in histograms per route, in
+# app.phase_timings, and sent in a Server-Timing header in debug mode.
+SHELF_TIMING = False
+
+# Path at which to serve metrics in Prometheus text format, e.g. '/metrics',
+# or None.  Serving metrics also times stashed views, as SHELF_TIMING does.
+METRICS_PATH = None
+
+# Directory shared by the worker processes of a pre-forking server, to which
+# each dumps its metrics every few seconds, so that a scrape of any worker
+# serves the metrics of all.  If None, a scrape serves its worker's alone.
+METRICS_DIR = None
+
+# Directory in which to cache compiled templates across processes, or None.
+# Run `tango precompile` to fill it before workers serve their first requests.
+JINJA_BYTECODE_CACHE_DIR = None
+
+# Whether to warm up an app as it is built, resolving writers and loading
+# templates, so that its first requests are as fast as any; also gets this
+# many of its routes' contexts from the shelf, in stash order.
+WARM_UP = False
+WARM_UP_CONTEXTS = 0
 
 # Response defaults.
 # It might be tempting to use a default writer class and not instance.
@@ -19,3 +97,9 @@ DEFAULT_WRITER = TextWriter()
 # http://docs.python.org/library/datetime.html#strftime-and-strptime-behavior
 DEFAULT_DATETIME_FORMAT = None
 DEFAULT_DATE_FORMAT = None
+
+# Pagination.
+# Items in a page of the paginate filter, unless the request or template asks
+# for another limit, and the most items the request can ask for.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
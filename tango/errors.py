@@ -13,10 +13,18 @@ class NoSuchWriterException(TangoException):
     "Error when getting a response writer by a name that is not registered."
 
 
+class NoSuchCodecException(TangoException):
+    "Error when getting a shelf codec by a name that is not registered."
+
+
 class HeaderException(TangoException):
     "Error in parsing a module's metadata docstring."
 
 
+class StaleContextError(TangoException):
+    "Error when lazily reading a shelved context since replaced."
+
+
 class ConfigurationError(TangoException):
     "Error in app.config, either a missing or wrongly set value."
 
@@ -1,5 +1,7 @@
 "Package to instantiate a Tango object from a Tango stash module."
 
+import sys
+
 from flask import request
 from werkzeug import create_environ
 
@@ -66,7 +68,7 @@ def get_app(import_name, **options):
 
 
 def build_app(import_name, import_stash=False, use_snapshot=True,
-              logfile=None):
+              logfile=None, jobs=None):
     """Create a Tango application object from a Python import name.
 
     This function accepts three kinds of import names:
@@ -170,11 +172,9 @@ def build_app(import_name, import_stash=False, use_snapshot=True,
         if routes is None:
             build_options = {'import_stash': import_stash}
             build_options['logfile'] = logfile
-            if module_exists(import_name + '.stash'):
-                module = __import__(import_name, fromlist=['stash']).stash
-                routes = build_module_routes(module, **build_options)
-            else:
-                routes = build_module_routes(import_name, **build_options)
+            build_options['jobs'] = jobs
+            routes = build_module_routes(get_stash_name(import_name),
+                                         **build_options)
         else:
             print 'Using snapshot with stashed routes.'
         app.routes = routes
@@ -183,5 +183,48 @@ def build_app(import_name, import_stash=False, use_snapshot=True,
         for route in app.routes:
             app.build_view(route)
 
+        if app.config['METRICS_PATH'] is not None:
+            app.add_url_rule(app.config['METRICS_PATH'], 'metrics',
+                             app.metrics_view)
+
+        if app.config['WARM_UP']:
+            report = app.warm_up(contexts=app.config['WARM_UP_CONTEXTS'])
+            (logfile or sys.stdout).write(warm_up_report(report))
+
     app.context_processor(lambda: request.view_args)
     return app
+
+
+def get_stash_name(import_name):
+    """Get the import name of the stash of a site, given by import name.
+
+    A package's stash is its stash submodule, if it has one; otherwise, the
+    module is itself a stash.
+
+    >>> get_stash_name('testsite')
+    'testsite.stash'
+    >>> get_stash_name('simplest.py')
+    'simplest'
+    >>> get_stash_name('testsite.stash.index')
+    'testsite.stash.index'
+    >>>
+    """
+    import_name = fix_import_name_if_pyfile(import_name)
+    if module_exists(import_name + '.stash'):
+        return import_name + '.stash'
+    return import_name
+
+
+def warm_up_report(report):
+    """Format the report of :meth:`Tango.warm_up` for a log.
+
+    >>> print warm_up_report([('writers', 2, 0.0001), ('templates', 3, 0.25)]),
+    Warmed up 2 writers in 0.1 ms.
+    Warmed up 3 templates in 250.0 ms.
+    >>>
+    """
+    lines = []
+    for phase, count, seconds in report:
+        lines.append('Warmed up {0} {1} in {2:.1f} ms.\n'.format(
+            count, phase, seconds * 1000))
+    return ''.join(lines)
@@ -1,5 +1,7 @@
 "Marshal template contexts exported declaratively by Tango stash modules."
 
+from multiprocessing import Pool
+import os
 import warnings
 
 import yaml
@@ -12,7 +14,8 @@ from tango.imports import discover_modules, get_module
 from tango.imports import get_module_filepath, get_module_docstring
 
 
-def build_module_routes(module_or_name, import_stash=False, logfile=None):
+def build_module_routes(module_or_name, import_stash=False, logfile=None,
+                        jobs=None, pull=None):
     """Discover modules & parse headers from a Tango stash import name.
 
     Returns list of Route objects with attributes via structured docstrings.
@@ -28,27 +31,46 @@ def build_module_routes(module_or_name, import_stash=False, logfile=None):
      <Route: /route2.txt>]
     >>>
 
+    With import_stash and jobs more than 1, stash modules are imported and
+    their contexts pulled in that many worker processes; see
+    :func:`pull_contexts`.  The routes are the same either way:
+    >>> routes = build_module_routes('testsite.stash', import_stash=True,
+    ...                              jobs=2)
+    >>> routes[0].context
+    {'title': 'Tango'}
+    >>>
+
+    With import_stash and a set of module names to pull, only the routes of
+    those modules have their contexts pulled:
+    >>> routes = build_module_routes('testsite.stash', import_stash=True,
+    ...                              pull=set(['testsite.stash.multiple']))
+    >>> routes[0].context, routes[-1].context['sequence']
+    (None, [4, 5, 6])
+    >>>
+
     :param import_name: Tango site stash import name
     :type import_name: str
     :param context: flag whether to pull template contexts into route objects
+    :param jobs: number of processes to pull template contexts with
+    :param pull: names of the modules whose contexts to pull, None for all
     """
     route_collection = []
 
+    module_routes = []
     for name in discover_modules(module_or_name):
-        module_routes = parse_header(name)
-        if not module_routes:
-            continue
-        if import_stash:
-            if logfile is not None:
-                logfile.write('Loading {0} ... '.format(name))
-                # Flush log file to keep user posted on what is processing;
-                # otherwise no guarantee that anything is displayed in the
-                # log file until an implicit flush.
-                logfile.flush()
-            module_routes = pull_context(module_routes)
-            if logfile is not None:
-                logfile.write('done.\n')
-        route_collection += module_routes
+        routes = parse_header(name)
+        if routes:
+            module_routes.append((name, routes))
+    if import_stash:
+        pulled = dict(pull_contexts([(name, module_route_list)
+                                     for name, module_route_list
+                                     in module_routes
+                                     if pull is None or name in pull],
+                                    jobs=jobs, logfile=logfile))
+        module_routes = [(name, pulled.get(name, module_route_list))
+                         for name, module_route_list in module_routes]
+    for _, module_route_list in module_routes:
+        route_collection += module_route_list
 
     route_table = {}
     for route in route_collection:
@@ -69,6 +91,7 @@ def build_module_routes(module_or_name, import_stash=False, logfile=None):
             route_context.update(new_route_context)
             route.context = route_context
             route.modules += route_table[route.rule].modules
+            route.depends = route.depends + route_table[route.rule].depends
 
         route_table[route.rule] = route
     return sorted(route_table.values(), key=lambda route: route.rule)
@@ -127,6 +150,52 @@ def pull_context(route_objs):
     return route_objs
 
 
+def pull_contexts(module_routes, jobs=None, logfile=None):
+    """Pull the contexts of each stash module's routes, in the order given.
+
+    Takes and returns (module name, routes) pairs, routes as parsed by
+    :func:`parse_header`.  With jobs more than 1, modules are imported and
+    their contexts pulled in a pool of that many worker processes, which ship
+    the routes back pickled; contexts must then be picklable.  Otherwise,
+    modules are pulled in this process, one after the other.
+
+    >>> names = ['testsite.stash.index', 'testsite.stash.multiple']
+    >>> pulled = pull_contexts([(name, parse_header(name)) for name in names],
+    ...                        jobs=2)
+    >>> [name for name, routes in pulled] == names
+    True
+    >>> pulled[0][1][0].context, pulled[1][1][1].context['sequence']
+    ({'title': 'Tango'}, [4, 5, 6])
+    >>>
+    """
+    if jobs is not None and jobs > 1 and len(module_routes) > 1:
+        pool = Pool(min(jobs, len(module_routes)))
+        # One module at a time, so that slow modules do not hold up others.
+        results = pool.imap(pull_context,
+                            [routes for name, routes in module_routes], 1)
+    else:
+        pool = None
+        results = (pull_context(routes) for name, routes in module_routes)
+    pulled = []
+    try:
+        for name, _ in module_routes:
+            if logfile is not None:
+                logfile.write('Loading {0} ... '.format(name))
+                # Flush log file to keep user posted on what is processing;
+                # otherwise no guarantee that anything is displayed in the
+                # log file until an implicit flush.
+                logfile.flush()
+            pulled.append((name, next(results)))
+            if logfile is not None:
+                logfile.write('done.\n')
+    finally:
+        if pool is not None:
+            # Stop workers still pulling, e.g. when another module failed.
+            pool.terminate()
+            pool.join()
+    return pulled
+
+
 def parse_header(import_name):
     """Parse docstring of module matching import name, for stash metadata.
 
@@ -136,6 +205,11 @@ def parse_header(import_name):
     * routes
     * exports
 
+    They may also declare the data files which their contexts are pulled
+    from, as paths or glob patterns relative to the module, in this field:
+
+    * depends
+
     Return None if module has no docstring or does not appear to be metadata.
     Raise KeyError if any of these fields are missing.
     Raise HeaderException if header is yaml but not pure yaml.
@@ -152,6 +226,8 @@ def parse_header(import_name):
     >>> route.site
     'test'
     >>> route.context
+    >>> route.depends
+    []
     >>>
 
     >>> routes = parse_header('testsite.stash.package.module')
@@ -234,6 +310,7 @@ def parse_header(import_name):
     exports = {}
     rawexports = header['exports']
     static = []
+    rawdepends = header.get('depends')
 
     # Ensure an iterable on raw values.
     if rawroutes is None:
@@ -253,6 +330,14 @@ def parse_header(import_name):
     else:
         rawexports = list(rawexports)
 
+    # Coerce dependencies into a list of paths from the module's directory.
+    if rawdepends is None:
+        rawdepends = []
+    elif isinstance(rawdepends, basestring):
+        rawdepends = [rawdepends]
+    depends = [os.path.join(os.path.dirname(filepath), path)
+               for path in rawdepends]
+
     # Collect export names and static values.
     export_items = []
     export_static_names = set()
@@ -306,6 +391,7 @@ def parse_header(import_name):
             warnings.warn(msg, DuplicateRouteWarning)
         route_obj = Route(site, route, exports, static, template)
         route_obj.modules = [import_name]
+        route_obj.depends = list(depends)
         route_table[route] = route_obj
 
     return sorted(route_table.values(), key=lambda route: route.rule)
@@ -0,0 +1,218 @@
+"Freeze a Tango site into static files, for a web server to serve directly."
+
+from multiprocessing import Pool, cpu_count
+import errno
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+
+from tango.app import Tango
+from tango.factory.app import get_app
+from tango.tools import atomic_write
+
+
+# Extensions to give frozen files by mimetype, where the mimetypes module's
+# first guess is not the common one, e.g. .ksh for text/plain.
+extensions = {
+    'text/html': '.html',
+    'text/plain': '.txt',
+    'application/json': '.json',
+    'application/xml': '.xml',
+}
+
+# Name of the file in a frozen directory recording what was frozen.
+MANIFEST = '.tango-freeze.json'
+
+# App of the freeze in progress, inherited by forked worker processes.
+_app = None
+
+
+def freeze(app_or_name, directory, processes=None, force=False, logfile=None):
+    """Render every URL of an app's routes into files under a directory.
+
+    Each route without view arguments has one URL.  A route with arguments has
+    a URL for each dict of arguments given by the generator registered for its
+    rule with :meth:`Tango.url_arguments`, and none without one.  Responses
+    are rendered as for a request, from the shelf, so shelve the site first.
+
+    Files are named after URL paths, with an index file for a path ending in
+    '/', and an extension for the response mimetype if the path lacks it.
+
+    URLs are rendered by a pool of processes, by default one per CPU, or in
+    this process if processes is 1.  A URL whose response version, of its
+    shelved context and templates, is the same as when last frozen is not
+    rendered again, unless forced; a file whose content is unchanged is not
+    rewritten, so its mtime stays put.  Files frozen for URLs the app no
+    longer has are removed, along with their manifest entries.
+
+    Returns counts of URLs by outcome: written, unchanged, skipped and failed,
+    and of URLs removed.
+
+    >>> import tempfile
+    >>> from tango.factory.stash import shelve
+    >>> directory = tempfile.mkdtemp()
+    >>> shelve('simplest')
+    >>> freeze('simplest', directory, processes=1)['written']
+    1
+    >>> sorted(os.listdir(directory))
+    ['.tango-freeze.json', 'index.txt']
+    >>> freeze('simplest', directory, processes=1)['skipped']
+    1
+    >>> freeze('simplest', directory, processes=1, force=True)['unchanged']
+    1
+    >>> import shutil; shutil.rmtree(directory)
+    >>>
+    """
+    global _app
+    if isinstance(app_or_name, Tango):
+        app = app_or_name
+    else:
+        app = get_app(app_or_name)
+    manifest_path = os.path.join(directory, MANIFEST)
+    try:
+        with open(manifest_path) as fd:
+            manifest = json.load(fd)
+    except (IOError, ValueError):
+        manifest = {}
+
+    tasks = []
+    for url, route in iter_urls(app):
+        version = app.response_version(route)
+        etag = None
+        if version is not None:
+            etag = version[0]
+        tasks.append((url, etag, manifest.get(url)))
+
+    counts = {'written': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0,
+              'removed': 0}
+    _app = app
+    pool = None
+    try:
+        if processes is None:
+            processes = cpu_count()
+        if processes > 1:
+            # Forked workers open their own shelf connections.
+            pool = Pool(processes)
+            results = pool.imap(freeze_url, [(directory, force) + task
+                                             for task in tasks], 16)
+        else:
+            results = (freeze_url((directory, force) + task)
+                       for task in tasks)
+        for url, outcome, entry in results:
+            counts[outcome] += 1
+            if entry is not None:
+                manifest[url] = entry
+            if logfile is not None:
+                logfile.write('Freezing {0} ... {1}.\n'.format(url, outcome))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        _app = None
+
+    urls = set(url for url, _, _ in tasks)
+    paths = set(entry['path'] for url, entry in manifest.items()
+                if url in urls)
+    for url, entry in sorted(manifest.items()):
+        if url in urls:
+            continue
+        del manifest[url]
+        counts['removed'] += 1
+        if entry['path'] not in paths:
+            # The path may since be another URL's.
+            remove_file(os.path.join(directory, entry['path']))
+        if logfile is not None:
+            logfile.write('Freezing {0} ... removed.\n'.format(url))
+
+    with atomic_write(manifest_path, mode=0644) as fileobj:
+        json.dump(manifest, fileobj, indent=1, sort_keys=True)
+    return counts
+
+
+def iter_urls(app):
+    "Generate (url, route) for each URL of an app's routes."
+    adapter = app.url_map.bind('localhost')
+    for route in app.routes:
+        if not route.has_arguments:
+            yield route.rule, route
+            continue
+        generator = app.url_argument_generators.get(route.rule)
+        if generator is None:
+            continue
+        for arguments in generator():
+            yield adapter.build(route.rule, arguments), route
+
+
+def freeze_url(task):
+    """Render one URL into its file, in a worker process.
+
+    Takes (directory, force, url, etag, entry), entry being the URL's entry in
+    the manifest, if any.  Returns (url, outcome, entry) with the new entry.
+    """
+    directory, force, url, etag, entry = task
+    if not force and etag is not None and entry is not None and \
+       entry['etag'] == etag and \
+       os.path.exists(os.path.join(directory, entry['path'])):
+        return url, 'skipped', entry
+    response = _app.test_client().get(url)
+    if response.status_code != 200:
+        return url, 'failed', None
+    path = url_to_path(url, response.mimetype)
+    digest = hashlib.sha1(response.data).hexdigest()
+    filepath = os.path.join(directory, path)
+    # Keep paths in the manifest as unicode, as JSON reads them back.
+    path = path.decode('utf-8')
+    if entry is not None and entry['path'] == path and \
+       entry['sha1'] == digest and os.path.exists(filepath):
+        outcome = 'unchanged'
+    else:
+        with atomic_write(filepath, mode=0644) as fileobj:
+            fileobj.write(response.data)
+        outcome = 'written'
+    return url, outcome, {'path': path, 'sha1': digest, 'etag': etag}
+
+
+def remove_file(filepath):
+    "Remove a file, if it exists."
+    try:
+        os.remove(filepath)
+    except OSError, exc:
+        if exc.errno != errno.ENOENT:
+            raise
+
+
+def url_to_path(url, mimetype):
+    """Map a URL path to a relative file path, by the response mimetype.
+
+    >>> url_to_path('/', 'text/html')
+    'index.html'
+    >>> url_to_path('/about/', 'text/html')
+    'about/index.html'
+    >>> url_to_path('/index.json', 'application/json')
+    'index.json'
+    >>> url_to_path('/route1.txt', 'text/plain')
+    'route1.txt'
+    >>> url_to_path('/feed', 'application/xml')
+    'feed.xml'
+    >>> url_to_path(u'/caf\\xe9/', 'text/plain')
+    'caf\\xc3\\xa9/index.txt'
+
+    Paths stay inside the frozen directory:
+    >>> url_to_path('/../etc/passwd', 'text/plain')
+    'etc/passwd.txt'
+    >>>
+    """
+    # Normalizing an absolute path drops any '..' above its root.
+    path = posixpath.normpath(url)
+    if url.endswith('/'):
+        path = posixpath.join(path, 'index')
+    path = path.lstrip('/')
+    extension = extensions.get(mimetype) or \
+                mimetypes.guess_extension(mimetype) or ''
+    if mimetypes.guess_type(path)[0] != mimetype:
+        path += extension
+    if isinstance(path, unicode):
+        path = path.encode('utf-8')
+    return path
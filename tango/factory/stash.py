@@ -1,25 +1,320 @@
 "Shelve an application's stash."
 
+from itertools import islice
+import glob
+import hashlib
+import os
+
+from werkzeug import create_environ
+
 from tango.app import Tango
-from tango.factory.app import build_app
+from tango.factory.app import build_app, get_stash_name
+from tango.factory.context import build_module_routes
+from tango.imports import get_module_filepath
+from tango.shelf import MmapConnector, SqliteConnector
+from tango.writers import JsonWriter
 
 
-def shelve(app_or_name, logfile=None):
+def shelve(app_or_name, logfile=None, batch_size=None, prerender=None,
+           prune=False, jobs=None, force=False):
     """Shelve the route contexts of an app, given by object or import name.
 
+    Routes are put to the shelf in batches of batch_size routes, by default the
+    app's SHELF_BATCH_SIZE, each batch with one call to the connector.
+
+    With prerender, by default the app's SHELF_PRERENDER, routes without view
+    arguments are also rendered by their writers and their responses shelved.
+    Without it, so are those with a JSON writer if SHELF_PRERENDER_JSON is set.
+
+    With prune, routes no longer in the stash are then pruned from the shelf,
+    and the shelf compacted; see :func:`compact`.
+
+    A read-only connector, e.g. MmapConnector, is built whole from all routes.
+
+    With jobs more than 1, an app given by name has its stash modules imported
+    and their contexts pulled in that many worker processes.
+
+    Shelving an app given by name is incremental: only the stash modules whose
+    inputs changed since they were last shelved are imported, and their routes
+    put; see :func:`stale_modules`.  Unless forced, the others are skipped,
+    though their routes' responses are still rendered from the shelf if
+    prerendering.  An app given by object is shelved whole, as are its
+    modules the next time they are shelved by name.
+
     Does not return anything, and inherently has side-effects:
     >>> shelve('simplest')
     >>> shelve(build_app('simplest'))
+    >>> shelve('testsite', batch_size=2)
+    >>> shelve('testsite', prerender=True)
+    >>> shelve('testsite', prune=True)
+    >>> shelve('testsite', jobs=2)
+    >>> shelve('testsite', force=True)
     """
     if isinstance(app_or_name, Tango):
         app = app_or_name
+        modules = None
+        pull = None
     else:
-        app = build_app(app_or_name, import_stash=True, use_snapshot=False,
-                        logfile=logfile)
-    for route in app.routes:
-        site, rule, context = route.site, route.rule, route.context
+        # Parse headers only, to tell which modules to pull.
+        app = build_app(app_or_name, use_snapshot=False)
+        modules = get_modules(app)
+        if force or app.connector.read_only:
+            pull = None
+        else:
+            pull = stale_modules(app, modules)
+        with app.request_context(create_environ()):
+            app.routes = build_module_routes(get_stash_name(app_or_name),
+                                             import_stash=True,
+                                             logfile=logfile, jobs=jobs,
+                                             pull=pull)
+    if app.connector.read_only:
+        app.connector.build((route.site, route.rule, route.context)
+                            for route in app.routes)
+        if logfile is not None:
+            for route in app.routes:
+                logfile.write('Stashing {0} {1} ... done.\n'
+                              .format(route.site, route.rule))
+        return
+    if batch_size is None:
+        batch_size = app.config['SHELF_BATCH_SIZE']
+    if prerender is None:
+        prerender = app.config['SHELF_PRERENDER']
+    for batch in batches(app.routes, batch_size):
+        pulled = [route for route in batch
+                  if pull is None or pull.intersection(route.modules)]
+        app.connector.put_many((route.site, route.rule, route.context)
+                               for route in pulled)
+        if prerender:
+            rendered = batch
+        elif app.config['SHELF_PRERENDER_JSON']:
+            rendered = [route for route in batch
+                        if isinstance(app.get_writer(route.writer_name),
+                                      JsonWriter)]
+        else:
+            rendered = []
+        if rendered:
+            for route in rendered:
+                if pull is not None and not pull.intersection(route.modules):
+                    # Templates may have changed since, if not the context.
+                    route.context = app.connector.get(route.site, route.rule)
+            app.connector.put_responses(render_responses(app, rendered))
+        # A response of a route not rendered may be stale, e.g. by template.
+        rendered = set(rendered)
+        app.connector.delete_responses((route.site, route.rule)
+                                       for route in batch
+                                       if route not in rendered)
+        if logfile is not None:
+            for route in pulled:
+                logfile.write('Stashing {0} {1} ... done.\n'
+                              .format(route.site, route.rule))
+    if modules is None:
+        # Contexts of an app object need not be those its stash would pull.
+        names = set()
+        for route in app.routes:
+            names.update(route.modules or ())
+        app.connector.put_manifest((name, None, None) for name in names)
+    else:
+        app.connector.put_manifest((name, digest, rules)
+                                   for name, (digest, rules)
+                                   in modules.items()
+                                   if pull is None or name in pull)
         if logfile is not None:
-            logfile.write('Stashing {0} {1} ... '.format(site, rule))
-        app.connector.put(site, rule, context)
+            rebuilt = len(modules) if pull is None else len(pull)
+            logfile.write(shelve_report(rebuilt, len(modules) - rebuilt))
+    if prune:
+        pruned, reclaimed = compact(app)
         if logfile is not None:
-            logfile.write('done.\n')
+            logfile.write(compact_report(pruned, reclaimed))
+
+
+def get_modules(app):
+    """Get the digest of the inputs and the rules of each of an app's modules.
+
+    Returns {module: (digest, rules)}, for the stash modules of the app's
+    routes, as recorded in the shelf's manifest; see :func:`module_digest`.
+
+    >>> get_modules(build_app('simplest'))['simplest'][1]
+    ['/']
+    >>>
+    """
+    inputs = {}
+    for route in app.routes:
+        for name in route.modules or ():
+            depends, rules = inputs.setdefault(name, (set(), set()))
+            depends.update(route.depends or ())
+            rules.add(route.rule)
+    return dict((name, (module_digest(name, depends), sorted(rules)))
+                for name, (depends, rules) in inputs.items())
+
+
+def module_digest(name, depends=()):
+    """Digest the inputs of a stash module: its source and its data files.
+
+    Data files are given as paths or glob patterns, as a module declares them
+    in its header's depends; a file matching a pattern or going missing
+    changes the digest, as does a change to any file's content.
+
+    >>> module_digest('simplest') == module_digest('simplest')
+    True
+    >>> module_digest('simplest') == module_digest('simplest', ['*.txt'])
+    False
+    >>>
+    """
+    digest = hashlib.sha1()
+    filepaths = [get_module_filepath(name)]
+    for pattern in sorted(depends):
+        digest.update(pattern.encode('utf-8') + '\0')
+        filepaths += sorted(glob.glob(pattern))
+    for filepath in filepaths:
+        digest.update(filepath.encode('utf-8') + '\0')
+        if os.path.isfile(filepath):
+            with open(filepath, 'rb') as fd:
+                digest.update(hashlib.sha1(fd.read()).digest())
+    return digest.hexdigest()
+
+
+def stale_modules(app, modules):
+    """Get the names of an app's modules to pull, as their inputs changed.
+
+    Takes the modules of the app, as from :func:`get_modules`.  A module is
+    stale if it is not in the shelf's manifest, if its digest or rules differ
+    from those recorded, or if any of its routes is missing from the shelf.
+    A route pulled from many modules has all of them pulled to merge its
+    context, if any of them is stale.
+    """
+    manifest = app.connector.get_manifest()
+    versions = dict(((route.site, route.rule),
+                     app.connector.get_version(route.site, route.rule))
+                    for route in app.routes)
+    stale = set()
+    for name, (digest, rules) in modules.items():
+        if manifest.get(name) != (digest, rules):
+            stale.add(name)
+    for route in app.routes:
+        if versions[(route.site, route.rule)] is None:
+            stale.update(route.modules)
+    merged = True
+    while merged:
+        merged = False
+        for route in app.routes:
+            if stale.intersection(route.modules) and \
+               not stale.issuperset(route.modules):
+                stale.update(route.modules)
+                merged = True
+    return stale
+
+
+def shelve_report(rebuilt, skipped):
+    """Describe the modules shelved by :func:`shelve`, as a line of text.
+
+    >>> shelve_report(1, 6)
+    'Rebuilt 1 modules, skipped 6 unchanged.\\n'
+    """
+    return 'Rebuilt {0} modules, skipped {1} unchanged.\n'.format(rebuilt,
+                                                                 skipped)
+
+
+def compact(app_or_name):
+    """Prune routes no longer in an app's stash from its shelf, and compact it.
+
+    Rows are deleted for each site's routes whose rules the app's stash
+    headers no longer produce, then the shelf reclaims the space they left.
+    Sites which the app does not have are left alone.  Returns the number of
+    routes pruned and the number of bytes reclaimed.
+
+    A read-only shelf is built whole from current routes, and has nothing to
+    compact.
+
+    >>> shelve('simplest')
+    >>> compact('simplest')[0]
+    0
+    """
+    if isinstance(app_or_name, Tango):
+        app = app_or_name
+    else:
+        app = build_app(app_or_name)
+    if app.connector.read_only:
+        return 0, 0
+    rules = {}
+    for route in app.routes:
+        rules.setdefault(route.site, set()).add(route.rule)
+    pruned = 0
+    for site, site_rules in rules.items():
+        pruned += app.connector.prune(site, site_rules)
+    return pruned, app.connector.compact()
+
+
+def compact_report(pruned, reclaimed):
+    """Describe the result of :func:`compact`, as a line of text.
+
+    >>> compact_report(2, 40960)
+    'Pruned 2 routes, reclaimed 40960 bytes.\\n'
+    """
+    return 'Pruned {0} routes, reclaimed {1} bytes.\n'.format(pruned,
+                                                              reclaimed)
+
+
+def pack(app_or_name):
+    """Build an app's read-only shelf file from its sqlite shelf.
+
+    Contexts are read from SQLITE_FILEPATH, for the app's routes, and written
+    to SHELF_FILEPATH for serving with MmapConnector.  Returns the number of
+    routes packed.
+
+    >>> shelve('simplest')
+    >>> pack('simplest')
+    1
+    """
+    if isinstance(app_or_name, Tango):
+        app = app_or_name
+    else:
+        app = build_app(app_or_name)
+    source = SqliteConnector(app)
+    try:
+        MmapConnector(app).build((route.site, route.rule,
+                                  source.get(route.site, route.rule))
+                                 for route in app.routes)
+    finally:
+        source.close()
+    return len(app.routes)
+
+
+def render_responses(app, routes):
+    """Render routes without view arguments, for pre-rendered responses.
+
+    Yields (site, rule, body, mimetype, version) for each route, body as
+    encoded bytes, and version the checksum of the templates rendered, if any.
+    """
+    charset = app.response_class.charset
+    for route in routes:
+        if route.has_arguments:
+            continue
+        writer = app.get_writer(route.writer_name)
+        with app.test_request_context(route.rule):
+            body = writer(app.writer_context(writer, route.context or {}))
+            if not isinstance(body, basestring):
+                # A streaming writer's chunks, joined for the shelf.
+                body = u''.join(body)
+        mimetype = getattr(writer, 'mimetype', None)
+        if mimetype is None:
+            mimetype = app.response_class.default_mimetype
+        template = app.template_version(writer)
+        version = template[0] if template is not None else None
+        yield route.site, route.rule, body.encode(charset), mimetype, version
+
+
+def batches(iterable, size):
+    """Split an iterable into lists of given size, the last possibly shorter.
+
+    >>> list(batches(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    >>> list(batches([], 2))
+    []
+    >>>
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
@@ -1,7 +1,7 @@
 from time import mktime
 from datetime import datetime as dt
 
-from flask import current_app
+from flask import current_app, has_request_context, request
 
 
 UNSET = object()
@@ -61,3 +61,75 @@ def struct_time(a_struct_time, format=UNSET):
     if format is UNSET:
         format = get_default('DEFAULT_DATETIME_FORMAT')
     return datetime(a_date, format=format)
+
+
+class Page(object):
+    """A page of a sequence's items, by offset and limit.
+
+    Slicing reads only the items of the page, e.g. from a list shelved in
+    chunks, only their chunks.
+
+    Test:
+    >>> page = Page(range(95), 40, 20)
+    >>> page.items[0], len(page.items), page.number, page.pages
+    (40, 20, 3, 5)
+    >>> page.has_previous, page.has_next
+    (True, True)
+    >>> Page([], 0, 20).pages
+    1
+    >>>
+    """
+
+    def __init__(self, sequence, offset, limit):
+        self.total = len(sequence)
+        self.offset = offset
+        self.limit = limit
+        self.items = sequence[offset:offset + limit]
+        self.number = offset // limit + 1
+        self.pages = max(1, (self.total + limit - 1) // limit)
+        self.has_previous = offset > 0
+        self.has_next = offset + limit < self.total
+
+
+def get_argument(name):
+    """Get a non-negative integer argument of the current request, or None.
+
+    Arguments are read from the query string, then from the route arguments.
+    >>> get_argument('page') is None
+    True
+    >>>
+    """
+    if not has_request_context():
+        return None
+    value = request.args.get(name)
+    if value is None and request.view_args:
+        value = request.view_args.get(name)
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+@register
+def paginate(sequence, limit=UNSET):
+    """Filter which gets the page of a sequence asked for by the request.
+
+    The page is asked for by ?page=, counting from 1, or by ?offset= and
+    ?limit=, in the query string or as route arguments.  The limit defaults
+    to DEFAULT_PAGE_SIZE and is at most MAX_PAGE_SIZE, unless given here.
+
+    Test:
+    >>> page = paginate(range(95), limit=20)
+    >>> page.number, page.items[-1]
+    (1, 19)
+    >>>
+    """
+    if limit is UNSET:
+        limit = get_argument('limit') or get_default('DEFAULT_PAGE_SIZE')
+        maximum = get_default('MAX_PAGE_SIZE')
+        if maximum is not None:
+            limit = min(limit, maximum)
+    offset = get_argument('offset')
+    if offset is None:
+        offset = ((get_argument('page') or 1) - 1) * limit
+    return Page(sequence, offset, limit)
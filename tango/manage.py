@@ -14,6 +14,7 @@ from tango.factory.app import get_app
 from tango.factory.snapshot import build_snapshot
 from tango.imports import module_exists, fix_import_name_if_pyfile
 import tango
+import tango.factory.freeze
 import tango.factory.stash
 
 commands = []
@@ -67,11 +68,41 @@ def snapshot(site):
 
 
 @command
-def shelve(site):
-    "Shelve an application's stash, as a worker process."
+def pack(site):
+    "Pack a site's sqlite shelf into a read-only shelf file, for serving."
     with no_pyc():
         site = validate_site(site)
-        tango.factory.stash.shelve(site, logfile=sys.stdout)
+        app = get_app(site)
+        count = tango.factory.stash.pack(app)
+        print 'Packed {0} routes into {1}'.format(count,
+                                                  app.config['SHELF_FILEPATH'])
+
+
+@command
+def precompile(site):
+    "Compile a site's templates into its JINJA_BYTECODE_CACHE_DIR."
+    with no_pyc():
+        site = validate_site(site)
+        app = get_app(site)
+        cache_dir = app.config['JINJA_BYTECODE_CACHE_DIR']
+        if cache_dir is None:
+            print 'Set JINJA_BYTECODE_CACHE_DIR to precompile templates.'
+            # /usr/include/sysexits.h defines EX_CONFIG 78 as: config error
+            sys.exit(78)
+        else:
+            names = app.precompile_templates()
+            print 'Compiled {0} templates into {1}'.format(len(names),
+                                                           cache_dir)
+
+
+@command
+def compact(site):
+    "Prune routes no longer in a site's stash from its shelf, and compact it."
+    with no_pyc():
+        site = validate_site(site)
+        app = get_app(site)
+        pruned, reclaimed = tango.factory.stash.compact(app)
+        sys.stdout.write(tango.factory.stash.compact_report(pruned, reclaimed))
 
 
 class Manager(BaseManager):
@@ -95,6 +126,63 @@ class Server(BaseServer):
                 **self.server_options)
 
 
+class Shelve(Command):
+    description = "Shelve an application's stash, as a worker process."
+
+    def get_options(self):
+        return (Option('site'),
+                Option('--batch-size', dest='batch_size', type=int,
+                       help='number of routes to put to the shelf at a time'),
+                Option('--prerender', dest='prerender', action='store_const',
+                       const=True,
+                       help='also shelve responses of routes without '
+                            'view arguments, rendered'),
+                Option('--prune', dest='prune', action='store_true',
+                       default=False,
+                       help='then prune routes no longer in the stash, '
+                            'and compact the shelf'),
+                Option('--jobs', dest='jobs', type=int,
+                       help='number of processes to import stash modules '
+                            'and pull their contexts with'),
+                Option('--force', dest='force', action='store_true',
+                       default=False,
+                       help='shelve stash modules even if unchanged since '
+                            'shelved'))
+
+    def handle(self, _, site, batch_size, prerender, prune, jobs, force):
+        with no_pyc():
+            site = validate_site(site)
+            tango.factory.stash.shelve(site, logfile=sys.stdout,
+                                       batch_size=batch_size,
+                                       prerender=prerender, prune=prune,
+                                       jobs=jobs, force=force)
+
+
+class Freeze(Command):
+    description = "Render a site's routes into static files, for serving."
+
+    def get_options(self):
+        return (Option('site'),
+                Option('directory'),
+                Option('--processes', dest='processes', type=int,
+                       help='number of processes to render with, '
+                            'by default one per CPU'),
+                Option('--force', dest='force', action='store_true',
+                       default=False,
+                       help='render routes even if unchanged since frozen'))
+
+    def handle(self, _, site, directory, processes, force):
+        with no_pyc():
+            site = validate_site(site)
+            counts = tango.factory.freeze.freeze(site, directory,
+                                                 processes=processes,
+                                                 force=force,
+                                                 logfile=sys.stdout)
+            print ('Froze {written} written, {unchanged} unchanged, '
+                   '{skipped} skipped, {failed} failed, '
+                   '{removed} removed.'.format(**counts))
+
+
 class Shell(BaseShell):
     description = 'Runs a Python shell inside Tango application context.'
 
@@ -115,6 +203,8 @@ def run():
 
     manager.add_command('serve', Server())
     manager.add_command('shell', Shell())
+    manager.add_command('shelve', Shelve())
+    manager.add_command('freeze', Freeze())
     for cmd in commands:
         manager.command(cmd)
     manager.run()
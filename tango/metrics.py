@@ -0,0 +1,280 @@
+"""Metrics of a Tango app in Prometheus text format, across its processes.
+
+Each process collects its own metrics in memory.  Under a pre-forking server,
+set METRICS_DIR to a directory shared by the workers: each worker dumps its
+metrics there every few seconds, and a scrape of any worker merges those of
+all live workers.
+"""
+
+import errno
+import json
+import os
+import time
+
+from tango.timing import BUCKETS, SIZE_BUCKETS
+from tango.tools import atomic_write
+
+
+# Seconds between dumps of a process's metrics to METRICS_DIR.
+DUMP_INTERVAL = 5
+
+# Prometheus text exposition format.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Help text by metric name, ordering the metrics in what is served.
+HELP = [
+    ('tango_request_seconds', 'histogram',
+     'Time to serve requests to stashed views, by route.'),
+    ('tango_phase_seconds', 'histogram',
+     'Time spent in each phase of requests to stashed views, by route.'),
+    ('tango_context_bytes', 'histogram',
+     'Size of shelved contexts read by stashed views, by route.'),
+    ('tango_templates_compiled_total', 'counter',
+     'Templates compiled, rather than loaded from the bytecode cache.'),
+    ('tango_shelf_cache_hits_total', 'counter',
+     'Contexts read from the shelf cache.'),
+    ('tango_shelf_cache_misses_total', 'counter',
+     'Contexts read through the shelf cache from the shelf.'),
+    ('tango_shelf_cache_evictions_total', 'counter',
+     'Contexts evicted from the shelf cache to make room.'),
+    ('tango_shelf_cache_entries', 'gauge',
+     'Contexts in the shelf cache.'),
+    ('tango_shelf_cache_bytes', 'gauge',
+     'Size of the contexts in the shelf cache, as shelved.'),
+]
+
+
+def collect(app):
+    """Collect the metrics of an app in this process, as a JSON-able dict.
+
+    Test:
+    >>> from tango.app import Tango
+    >>> sorted(collect(Tango('simplesite')))
+    ['counters', 'gauges', 'phases', 'pid', 'sizes']
+    >>>
+    """
+    counters = {'tango_templates_compiled_total':
+                app.jinja_env.compiled_count}
+    gauges = {}
+    stats = getattr(app.connector, 'stats', None)
+    if stats is not None:
+        stats = stats()
+        for name in ('hits', 'misses', 'evictions'):
+            counters['tango_shelf_cache_{0}_total'.format(name)] = stats[name]
+        for name in ('entries', 'bytes'):
+            gauges['tango_shelf_cache_{0}'.format(name)] = stats[name]
+    return {'pid': os.getpid(),
+            'phases': app.phase_timings.snapshot(),
+            'sizes': app.context_sizes.snapshot(),
+            'counters': counters,
+            'gauges': gauges}
+
+
+def merge(snapshots):
+    """Sum the metrics of processes into one snapshot.
+
+    Test:
+    >>> one = {'phases': {'/': {'total': [[1, 0], 1, 0.5]}},
+    ...        'sizes': {}, 'counters': {'c': 1}, 'gauges': {'g': 2}}
+    >>> two = {'phases': {'/': {'total': [[0, 2], 2, 3.0]}},
+    ...        'sizes': {}, 'counters': {'c': 2}, 'gauges': {}}
+    >>> merged = merge([one, two])
+    >>> merged['phases'], merged['counters'], merged['gauges']
+    ({'/': {'total': [[1, 2], 3, 3.5]}}, {'c': 3}, {'g': 2})
+    >>>
+    """
+    merged = {'phases': {}, 'sizes': {}, 'counters': {}, 'gauges': {}}
+    for snapshot in snapshots:
+        for kind in ('phases', 'sizes'):
+            routes = merged[kind]
+            for rule, histograms in snapshot[kind].iteritems():
+                phases = routes.setdefault(rule, {})
+                for phase, (counts, count, total) in histograms.iteritems():
+                    histogram = phases.get(phase)
+                    if histogram is None:
+                        phases[phase] = [list(counts), count, total]
+                        continue
+                    for index, bucket_count in enumerate(counts):
+                        histogram[0][index] += bucket_count
+                    histogram[1] += count
+                    histogram[2] += total
+        for kind in ('counters', 'gauges'):
+            for name, value in snapshot[kind].iteritems():
+                merged[kind][name] = merged[kind].get(name, 0) + value
+    return merged
+
+
+def dump(app, directory):
+    "Write this process's metrics to a file of its own in a directory."
+    data = json.dumps(collect(app))
+    filepath = os.path.join(directory, '{0}.json'.format(os.getpid()))
+    with atomic_write(filepath) as fileobj:
+        fileobj.write(data)
+    app.metrics_dumped = time.time()
+
+
+def dump_if_due(app):
+    "Dump this process's metrics to METRICS_DIR, if set and due."
+    directory = app.config['METRICS_DIR']
+    if directory is not None and \
+       time.time() - app.metrics_dumped > DUMP_INTERVAL:
+        dump(app, directory)
+
+
+def load(directory):
+    """Read the metrics dumped by live processes in a directory.
+
+    Files of processes which have exited are removed.
+    """
+    snapshots = []
+    for filename in os.listdir(directory):
+        if not filename.endswith('.json'):
+            continue
+        filepath = os.path.join(directory, filename)
+        try:
+            pid = int(filename[:-len('.json')])
+        except ValueError:
+            continue
+        if not is_alive(pid):
+            try:
+                os.unlink(filepath)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(filepath) as fd:
+                snapshots.append(json.load(fd))
+        except (IOError, ValueError):
+            # Removed or replaced as it was read; its process dumps again.
+            continue
+    return snapshots
+
+
+def is_alive(pid):
+    "Whether a process exists."
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def metrics(app):
+    """Get the metrics of an app, of all its processes if they are dumped.
+
+    Test:
+    >>> from tango.factory.app import build_app
+    >>> app = build_app('simplesite')
+    >>> print metrics(app), # doctest:+ELLIPSIS
+    # HELP tango_templates_compiled_total Templates compiled, rather than ...
+    # TYPE tango_templates_compiled_total counter
+    tango_templates_compiled_total 0
+    >>>
+    """
+    directory = app.config['METRICS_DIR']
+    if directory is None:
+        snapshot = collect(app)
+    else:
+        dump(app, directory)
+        snapshot = merge(load(directory))
+    return render(snapshot)
+
+
+def render(snapshot):
+    """Format a snapshot of metrics in Prometheus text format.
+
+    Test:
+    >>> snapshot = {'phases': {'/': {'total': [[1] + [0] * 14, 1, 0.00005],
+    ...                              'fetch': [[1] + [0] * 14, 1, 0.00001]}},
+    ...             'sizes': {}, 'counters': {}, 'gauges': {}}
+    >>> print render(snapshot) # doctest:+ELLIPSIS
+    # HELP tango_request_seconds Time to serve requests to stashed views, ...
+    # TYPE tango_request_seconds histogram
+    tango_request_seconds_bucket{route="/",le="0.0001"} 1
+    ...
+    tango_request_seconds_bucket{route="/",le="+Inf"} 1
+    tango_request_seconds_sum{route="/"} 5e-05
+    tango_request_seconds_count{route="/"} 1
+    # HELP tango_phase_seconds Time spent in each phase of requests ...
+    # TYPE tango_phase_seconds histogram
+    tango_phase_seconds_bucket{route="/",phase="fetch",le="0.0001"} 1
+    ...
+    tango_phase_seconds_count{route="/",phase="fetch"} 1
+    <BLANKLINE>
+    >>>
+    """
+    samples = {}
+    for rule, phases in snapshot['phases'].iteritems():
+        for phase, histogram in phases.iteritems():
+            if phase == 'total':
+                add_histogram(samples, 'tango_request_seconds',
+                              [('route', rule)], BUCKETS, histogram)
+            else:
+                add_histogram(samples, 'tango_phase_seconds',
+                              [('route', rule), ('phase', phase)], BUCKETS,
+                              histogram)
+    for rule, histograms in snapshot['sizes'].iteritems():
+        for histogram in histograms.itervalues():
+            add_histogram(samples, 'tango_context_bytes', [('route', rule)],
+                          SIZE_BUCKETS, histogram)
+    for kind in ('counters', 'gauges'):
+        for name, value in snapshot[kind].iteritems():
+            samples.setdefault(name, []).append(
+                ('', ['{0} {1}'.format(name, format_value(value))]))
+
+    lines = []
+    for name, kind, help_text in HELP:
+        if name not in samples:
+            continue
+        lines.append('# HELP {0} {1}'.format(name, help_text))
+        lines.append('# TYPE {0} {1}'.format(name, kind))
+        for _, series in sorted(samples[name]):
+            lines.extend(series)
+    return '\n'.join(lines) + '\n'
+
+
+def add_histogram(samples, name, labels, buckets, histogram):
+    "Add the lines of a histogram's series, with cumulative buckets."
+    counts, count, total = histogram
+    lines = []
+    cumulative = 0
+    for bound, bucket_count in zip(buckets, counts):
+        cumulative += bucket_count
+        lines.append('{0}_bucket{1} {2}'.format(
+            name, format_labels(labels + [('le', format_value(bound))]),
+            cumulative))
+    lines.append('{0}_sum{1} {2}'.format(name, format_labels(labels),
+                                         format_value(total)))
+    lines.append('{0}_count{1} {2}'.format(name, format_labels(labels),
+                                           count))
+    samples.setdefault(name, []).append((format_labels(labels), lines))
+
+
+def format_labels(labels):
+    """Format labels, escaped, as Prometheus expects.
+
+    >>> print format_labels([('route', u'/caf\\xe9/"q"')])
+    {route="/caf\xc3\xa9/\\"q\\""}
+    >>>
+    """
+    pairs = []
+    for name, value in labels:
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        value = value.replace('\\', '\\\\').replace('\n', '\\n')
+        pairs.append('{0}="{1}"'.format(name, value.replace('"', '\\"')))
+    return '{' + ','.join(pairs) + '}'
+
+
+def format_value(value):
+    """Format a number as Prometheus expects.
+
+    >>> format_value(float('inf')), format_value(0.5), format_value(3)
+    ('+Inf', '0.5', '3')
+    >>>
+    """
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
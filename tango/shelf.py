@@ -1,14 +1,30 @@
 "Shelf connectors for persisting stashed template context variables."
 
 import cPickle as pickle
-import pickletools
-from contextlib import closing
+import hashlib
+from collections import Mapping, Sequence
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import weakref
+import zlib
 from cPickle import HIGHEST_PROTOCOL
 from sqlite3 import Binary as blobify
 from sqlite3 import dbapi2 as sqlite3
 
+from tango.codec import get_codec
+from tango.errors import StaleContextError
+from tango.timing import timed
+from tango.tools import atomic_write
+
 
 class BaseConnector(object):
+    # Whether the connector can only be built as a whole, and never be put to.
+    read_only = False
+
     def __init__(self, app):
         self.app = app
 
@@ -18,56 +34,1360 @@ class BaseConnector(object):
     def put(self, site, rule, context):
         raise NotImplementedError('A shelf connector must implement put.')
 
+    def put_many(self, items):
+        """Put many contexts, given an iterable of (site, rule, context).
+
+        Connectors which can write in bulk should override this loop.
+        """
+        for site, rule, context in items:
+            self.put(site, rule, context)
+
+    def get_response(self, site, rule, version=None):
+        """Get a pre-rendered response as (body, mimetype), or None if none.
+
+        Given a version, a response rendered from templates of another version
+        counts as none.  Connectors which do not store pre-rendered responses
+        return None, and views fall back to rendering the context.
+        """
+        return None
+
+    def get_gzip_response(self, site, rule, version=None):
+        """Get a pre-rendered response gzip-compressed, as (body, mimetype).
+
+        Returns None if there is no gzip variant of the response, e.g. if
+        compression would not make it smaller, or if the connector does not
+        store one; views then fall back to the uncompressed response.
+        """
+        return None
+
+    def put_responses(self, items):
+        """Put pre-rendered (site, rule, body, mimetype, version) responses.
+
+        The body is a byte string, as it is to be sent to the client.  The
+        version is the checksum of the templates it was rendered from, or None
+        if not rendered from templates.  Connectors which store gzip variants
+        compress bodies here, once.
+        """
+        raise NotImplementedError('This shelf connector cannot store '
+                                  'pre-rendered responses.')
+
+    def delete_responses(self, items):
+        """Delete pre-rendered responses, given (site, rule) items, if any.
+
+        Connectors which do not store pre-rendered responses have none.
+        """
+        pass
+
+    def get_version(self, site, rule):
+        """Get the version of a shelved context, without reading the context.
+
+        Returns (digest, shelved), the digest of the context's content and the
+        time it was shelved, in seconds since the epoch; or None if the route
+        is not shelved, or if the connector does not track versions.
+        """
+        return None
+
+    def prune(self, site, rules):
+        """Delete a site's routes, with their responses, except given rules.
+
+        Returns the number of routes deleted.
+        """
+        raise NotImplementedError('This shelf connector cannot prune routes.')
+
+    def compact(self):
+        """Reclaim space left by deleted rows, and return the bytes reclaimed.
+
+        Connectors with nothing to reclaim, e.g. those built whole, return 0.
+        """
+        return 0
+
+    def get_manifest(self):
+        """Get what was last shelved of each stash module, by module name.
+
+        Returns {module: (digest, rules)}, the digest of the module's inputs
+        and the list of rules of its routes.  Connectors which keep no
+        manifest return an empty dict, so that every module is shelved.
+        """
+        return {}
+
+    def put_manifest(self, items):
+        """Record shelved stash modules, as (module, digest, rules) items.
+
+        A digest of None forgets a module, e.g. one shelved from an app whose
+        contexts need not match its stash.  Connectors which keep no manifest
+        ignore this.
+        """
+        pass
+
+    def get_sized(self, site, rule):
+        """Get a context along with the size of its shelved form, in bytes.
+
+        Connectors which know the size of what they read should override this.
+        """
+        context = self.get(site, rule)
+        return context, len(pickle.dumps(context, HIGHEST_PROTOCOL))
+
+    def generation(self):
+        """Token which changes whenever shelved contexts change.
+
+        Returns None if the connector cannot tell, in which case caches only
+        see changes made through themselves.
+        """
+        return None
+
+    def release(self):
+        """Return resources checked out by this thread, e.g. at request end.
+
+        Connectors which hold resources per thread should override this.
+        """
+        pass
+
+    def close(self):
+        "Release any resources held by this connector, e.g. at app shutdown."
+        pass
+
 
 class SqliteConnector(BaseConnector):
-    def initialize(self):
+    """Shelf connector storing encoded contexts in a sqlite database file.
+
+    Each export of a context is stored separately, and get returns a
+    :class:`LazyContext`, so that a request only reads and decodes the large
+    exports it uses.  Contexts are stored once per distinct content, by a
+    digest of their encoded exports, and routes point at them; routes from
+    one stash module, which share a context, share its rows.
+
+    A list export longer than SHELF_CHUNK_ITEMS is stored in chunks of that
+    many items, and read as a :class:`ChunkedList`, which reads only the
+    chunks of the items accessed, e.g. a page of them.
+
+    A manifest of the stash modules shelved, by digest of their inputs, lets
+    shelving skip those unchanged since.
+
+    A thread checks out a connection from the pool on first use and keeps it
+    across calls to get and put until :meth:`release`, which the app calls at
+    the end of each request; up to SQLITE_POOL_SIZE idle connections are kept
+    open for the next thread, and the rest closed.  The schema check runs once
+    per connector; :attr:`Tango.connector` keeps one connector per app, so
+    this is once per process.  A forked child process starts its own pool
+    rather than sharing its parent's connections.
+    """
+
+    def __init__(self, app):
+        BaseConnector.__init__(self, app)
+        self.filepath = app.config['SQLITE_FILEPATH']
+        self.codec = get_codec(app.config['SHELF_CODEC'])
+        self.pool_size = app.config['SQLITE_POOL_SIZE']
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        "Forget pooled connections and schema check, without closing them."
+        self.pid = os.getpid()
+        self.local = threading.local()
+        # All open connections, and those of them not checked out.
+        self.connections = []
+        self.idle = []
+        self.initialized = False
+
+    # Schema version of a new shelf, kept in sqlite's user_version pragma.
+    # An older shelf is upgraded in place by migrate_to_<version> methods.
+    schema_version = 11
+
+    # Exports up to this size are read along with their context; larger ones
+    # are read when first accessed.
+    eager_bytes = 4096
+
+    # Compression level of gzip variants of responses, compressed only once.
+    gzip_level = 9
+
+    # Codec recorded for a chunked export, whose value is a JSON header of
+    # [codec name, item count, items per chunk, total size of chunks].
+    chunked_codec = 'chunked'
+
+    def initialize(self, db):
         """ -- schema:
         CREATE TABLE contexts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            digest TEXT NOT NULL
+        );
+        CREATE UNIQUE INDEX contexts_digest ON contexts (digest);
+        CREATE TABLE routes (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             site TEXT NOT NULL,
             rule TEXT NOT NULL,
-            context BLOB NOT NULL
+            context INTEGER REFERENCES contexts (id),
+            -- When the route's context last changed, in seconds since epoch.
+            shelved REAL
+        );
+        CREATE UNIQUE INDEX routes_site_rule ON routes (site, rule);
+        CREATE INDEX routes_context ON routes (context);
+        -- Export names have no type affinity, so that e.g. integer names keep
+        -- their type.  Text names are read back as UTF-8 encoded str.
+        CREATE TABLE exports (
+            context INTEGER NOT NULL REFERENCES contexts (id),
+            name NOT NULL,
+            codec TEXT NOT NULL,
+            value BLOB NOT NULL
+        );
+        CREATE UNIQUE INDEX exports_context_name ON exports (context, name);
+        -- Chunks of list exports, each a list of items in the export's codec.
+        CREATE TABLE chunks (
+            context INTEGER NOT NULL REFERENCES contexts (id),
+            name NOT NULL,
+            chunk INTEGER NOT NULL,
+            value BLOB NOT NULL
+        );
+        CREATE UNIQUE INDEX chunks_context_name_chunk
+            ON chunks (context, name, chunk);
+        CREATE TABLE meta (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        INSERT INTO meta (name, value) VALUES ('generation', 0);
+        CREATE TABLE responses (
+            site TEXT NOT NULL,
+            rule TEXT NOT NULL,
+            mimetype TEXT NOT NULL,
+            body BLOB NOT NULL,
+            -- gzip variant of body, if shelved and smaller.
+            gzip BLOB,
+            -- Checksum of the templates body was rendered from, if any.
+            version TEXT
+        );
+        CREATE UNIQUE INDEX responses_site_rule ON responses (site, rule);
+        -- Stash modules as last shelved, with a JSON list of their rules.
+        CREATE TABLE modules (
+            name TEXT PRIMARY KEY,
+            digest TEXT NOT NULL,
+            rules TEXT NOT NULL
         );
         """
-        with self.connect(initialize=False) as db:
-            cursor = db.execute("SELECT name FROM sqlite_master "
-                                "WHERE type='table' AND name='contexts';")
-            if cursor.fetchone() is None:
-                db.cursor().executescript(self.initialize.func_doc)
+        with self.lock:
+            if self.initialized:
+                return
+            version = db.execute('PRAGMA user_version;').fetchone()[0]
+            if version < self.schema_version:
+                self.upgrade(db)
+            self.initialized = True
+
+    def upgrade(self, db):
+        "Create or migrate the schema, in one transaction."
+        # Manage the transaction explicitly, since sqlite3 commits before DDL.
+        isolation_level = db.isolation_level
+        db.isolation_level = None
+        try:
+            db.execute('BEGIN IMMEDIATE;')
+            try:
+                # Check again, now that no other process can be upgrading.
+                version = db.execute('PRAGMA user_version;').fetchone()[0]
+                if version == 0:
+                    cursor = db.execute("SELECT name FROM sqlite_master "
+                                        "WHERE type='table' AND "
+                                        "name='contexts';")
+                    if cursor.fetchone() is None:
+                        self.execute_script(db, self.initialize.func_doc)
+                        version = self.schema_version
+                    else:
+                        # Shelves from before schema versioning are version 1.
+                        version = 1
+                while version < self.schema_version:
+                    version += 1
+                    getattr(self, 'migrate_to_{0}'.format(version))(db)
+                db.execute('PRAGMA user_version = {0};'.format(version))
+                db.execute('COMMIT;')
+            except:
+                db.execute('ROLLBACK;')
+                raise
+        finally:
+            db.isolation_level = isolation_level
 
-    def connect(self, initialize=True):
-        if initialize:
-            self.initialize()
-        return sqlite3.connect(self.app.config['SQLITE_FILEPATH'])
+    def execute_script(self, db, script):
+        "Execute statements one by one, unlike executescript which commits."
+        for statement in script.split(';'):
+            if statement.strip():
+                db.execute(statement)
 
-    def connection(self):
-        return closing(self.connect())
+    def migrate_to_2(self, db):
+        "Collapse duplicate rows to the latest, then index (site, rule)."
+        db.execute('DELETE FROM contexts WHERE id NOT IN '
+                   '(SELECT MAX(id) FROM contexts GROUP BY site, rule);')
+        db.execute('CREATE UNIQUE INDEX contexts_site_rule '
+                   'ON contexts (site, rule);')
+        db.execute('CREATE TABLE IF NOT EXISTS meta ('
+                   'name TEXT PRIMARY KEY, value INTEGER NOT NULL);')
+        db.execute("INSERT OR IGNORE INTO meta (name, value) "
+                   "VALUES ('generation', 0);")
+
+    def migrate_to_3(self, db):
+        "Add pre-rendered responses."
+        db.execute('CREATE TABLE responses ('
+                   'site TEXT NOT NULL, rule TEXT NOT NULL, '
+                   'mimetype TEXT NOT NULL, body BLOB NOT NULL);')
+        db.execute('CREATE UNIQUE INDEX responses_site_rule '
+                   'ON responses (site, rule);')
+
+    def migrate_to_4(self, db):
+        "Record the codec of each context; all contexts so far are pickled."
+        db.execute("ALTER TABLE contexts "
+                   "ADD COLUMN codec TEXT NOT NULL DEFAULT 'pickle';")
+
+    def migrate_to_5(self, db):
+        "Store each export of a context separately, in its context's codec."
+        db.execute('CREATE TABLE routes ('
+                   'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                   'site TEXT NOT NULL, rule TEXT NOT NULL);')
+        db.execute('CREATE UNIQUE INDEX routes_site_rule '
+                   'ON routes (site, rule);')
+        db.execute('CREATE TABLE exports ('
+                   'route INTEGER NOT NULL REFERENCES routes (id), '
+                   'name NOT NULL, codec TEXT NOT NULL, value BLOB NOT NULL);')
+        db.execute('CREATE UNIQUE INDEX exports_route_name '
+                   'ON exports (route, name);')
+        cursor = db.execute('SELECT id, site, rule, context, codec '
+                            'FROM contexts;')
+        for route, site, rule, context, codec_name in cursor.fetchall():
+            codec = get_codec(codec_name)
+            db.execute('INSERT INTO routes (id, site, rule) VALUES (?, ?, ?);',
+                       (route, site, rule))
+            db.executemany('INSERT INTO exports (route, name, codec, value) '
+                           'VALUES (?, ?, ?, ?);',
+                           [(route, name, codec_name,
+                             blobify(codec.encode(value)))
+                            for name, value in
+                            codec.decode(str(context)).items()])
+        db.execute('DROP TABLE contexts;')
+
+    def migrate_to_6(self, db):
+        "Store each distinct context once, by digest, for routes to share."
+        db.execute('CREATE TABLE contexts ('
+                   'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                   'digest TEXT NOT NULL);')
+        db.execute('CREATE UNIQUE INDEX contexts_digest ON contexts (digest);')
+        db.execute('ALTER TABLE routes '
+                   'ADD COLUMN context INTEGER REFERENCES contexts (id);')
+        db.execute('CREATE INDEX routes_context ON routes (context);')
+        db.execute('ALTER TABLE exports RENAME TO route_exports;')
+        db.execute('DROP INDEX exports_route_name;')
+        db.execute('CREATE TABLE exports ('
+                   'context INTEGER NOT NULL REFERENCES contexts (id), '
+                   'name NOT NULL, codec TEXT NOT NULL, value BLOB NOT NULL);')
+        db.execute('CREATE UNIQUE INDEX exports_context_name '
+                   'ON exports (context, name);')
+        for (route,) in db.execute('SELECT id FROM routes;').fetchall():
+            exports = db.execute('SELECT name, codec, value '
+                                 'FROM route_exports WHERE route = ?;',
+                                 (route,)).fetchall()
+            digest = digest_exports(exports)
+            context = self.insert_context(db, digest, exports)
+            db.execute('UPDATE routes SET context = ? WHERE id = ?;',
+                       (context, route))
+        db.execute('DROP TABLE route_exports;')
+
+    def migrate_to_7(self, db):
+        "Record when each route's context was shelved, now for existing ones."
+        db.execute('ALTER TABLE routes ADD COLUMN shelved REAL;')
+        db.execute('UPDATE routes SET shelved = ?;', (time.time(),))
+
+    def migrate_to_8(self, db):
+        "Add gzip variants of responses, shelved from now on."
+        db.execute('ALTER TABLE responses ADD COLUMN gzip BLOB;')
+
+    def migrate_to_9(self, db):
+        "Add chunks of long list exports, chunked from now on."
+        db.execute('CREATE TABLE chunks ('
+                   'context INTEGER NOT NULL REFERENCES contexts (id), '
+                   'name NOT NULL, chunk INTEGER NOT NULL, '
+                   'value BLOB NOT NULL);')
+        db.execute('CREATE UNIQUE INDEX chunks_context_name_chunk '
+                   'ON chunks (context, name, chunk);')
+
+    def migrate_to_10(self, db):
+        "Add the manifest of shelved stash modules, recorded from now on."
+        db.execute('CREATE TABLE modules ('
+                   'name TEXT PRIMARY KEY, digest TEXT NOT NULL, '
+                   'rules TEXT NOT NULL);')
+
+    def migrate_to_11(self, db):
+        "Record the templates of responses, rendered live until reshelved."
+        db.execute('ALTER TABLE responses ADD COLUMN version TEXT;')
+
+    def connect(self):
+        "Get this thread's connection, checking one out of the pool if none."
+        if self.pid != os.getpid():
+            # Connections must not cross a fork; start a fresh pool instead.
+            self.reset()
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            with self.lock:
+                if self.idle:
+                    db = self.idle.pop()
+            if db is None:
+                with timed('connect'):
+                    # A connection is used by one thread at a time, but may
+                    # be checked out by another thread after release.
+                    db = sqlite3.connect(self.filepath,
+                                         check_same_thread=False)
+                    self.initialize(db)
+                    with self.lock:
+                        self.connections.append(db)
+            self.local.db = db
+        return db
+
+    def release(self):
+        "Check this thread's connection back into the pool, if it has one."
+        db = getattr(self.local, 'db', None)
+        if db is None or self.pid != os.getpid():
+            return
+        self.local.db = None
+        with self.lock:
+            if db not in self.connections:
+                # Closed, along with the whole pool, while checked out.
+                return
+            if len(self.idle) < self.pool_size:
+                self.idle.append(db)
+                return
+            self.connections.remove(db)
+        db.close()
+
+    def close(self):
+        "Close all pooled connections; the connector reconnects on next use."
+        with self.lock:
+            connections = self.connections
+            self.connections = []
+            self.idle = []
+        if self.pid == os.getpid():
+            for db in connections:
+                db.close()
+        self.reset()
 
     def get(self, site, rule):
-        with self.connection() as db:
-            cursor = db.execute('SELECT context FROM contexts '
-                                'WHERE site = ? AND rule = ? '
-                                'ORDER BY id DESC;', (site, rule))
-            result = cursor.fetchone()
-            if result is None:
-                return {}
-            return pickle.loads(str(result[0]))
+        return self.get_sized(site, rule)[0]
+
+    def get_sized(self, site, rule):
+        """Get a lazy context, reading only its small exports up front.
+
+        The size is the total size of all its exports, read or not.
+        """
+        db = self.connect()
+        rows = db.execute('SELECT contexts.id, contexts.digest, '
+                          'exports.name, exports.codec, '
+                          'CASE WHEN length(exports.value) <= ? '
+                          'THEN exports.value END, length(exports.value) '
+                          'FROM routes JOIN contexts '
+                          'ON contexts.id = routes.context '
+                          'LEFT JOIN exports ON exports.context = contexts.id '
+                          'WHERE routes.site = ? AND routes.rule = ?;',
+                          (self.eager_bytes, site, rule)).fetchall()
+        if not rows:
+            return {}, 0
+        context, digest = rows[0][:2]
+        names = set()
+        loaded = {}
+        size = 0
+        with timed('decode'):
+            for _, _, name, codec, value, length in rows:
+                if name is None:
+                    # The context has no exports.
+                    continue
+                if isinstance(name, unicode):
+                    name = name.encode('utf-8')
+                names.add(name)
+                if codec == self.chunked_codec and value is not None:
+                    # Read when accessed, as its header says how to read it.
+                    size += json.loads(str(value))[3]
+                    continue
+                size += length
+                if value is not None:
+                    loaded[name] = get_codec(codec).decode(str(value))
+        load = lambda names: self.get_exports(context, names)
+        return LazyContext(names, loaded, load, digest), size
+
+    def get_exports(self, context, names):
+        "Read the named exports of a context by id, as a dict."
+        db = self.connect()
+        exports = {}
+        names = list(names)
+        # Stay well within sqlite's limit on the number of query parameters.
+        for start in range(0, len(names), 500):
+            batch = names[start:start + 500]
+            with timed('fetch'):
+                rows = db.execute('SELECT name, codec, value FROM exports '
+                                  'WHERE context = ? AND name IN ({0});'
+                                  .format(', '.join('?' * len(batch))),
+                                  [context] + batch).fetchall()
+            with timed('decode'):
+                for name, codec, value in rows:
+                    if isinstance(name, unicode):
+                        name = name.encode('utf-8')
+                    exports[name] = self.decode_export(context, name, codec,
+                                                       value)
+        if len(exports) < len(names):
+            raise StaleContextError('Context {0} was replaced while its '
+                                    'exports were read.'.format(context))
+        return exports
+
+    def decode_export(self, context, name, codec, value):
+        "Decode an export of a context by id, a chunked one as ChunkedList."
+        if codec != self.chunked_codec:
+            return get_codec(codec).decode(str(value))
+        codec, length, chunk_items, _ = json.loads(str(value))
+        load = lambda index: self.get_chunk(context, name, codec, index)
+        return ChunkedList(length, chunk_items, load)
+
+    def get_chunk(self, context, name, codec, index):
+        "Read a chunk of an export of a context by id, as a list."
+        db = self.connect()
+        with timed('fetch'):
+            row = db.execute('SELECT value FROM chunks WHERE context = ? '
+                             'AND name = ? AND chunk = ?;',
+                             (context, name, index)).fetchone()
+        if row is None:
+            raise StaleContextError('Context {0} was replaced while its '
+                                    'export {1!r} was read.'
+                                    .format(context, name))
+        with timed('decode'):
+            return get_codec(codec).decode(str(row[0]))
+
+    def get_version(self, site, rule):
+        db = self.connect()
+        return db.execute('SELECT contexts.digest, routes.shelved '
+                          'FROM routes JOIN contexts '
+                          'ON contexts.id = routes.context '
+                          'WHERE routes.site = ? AND routes.rule = ?;',
+                          (site, rule)).fetchone()
+
+    def generation(self):
+        db = self.connect()
+        return db.execute("SELECT value FROM meta "
+                          "WHERE name = 'generation';").fetchone()[0]
 
     def put(self, site, rule, context):
-        with self.connection() as db:
-            # Check to see if the context is already shelved.
-            cursor = db.execute('SELECT id FROM contexts '
-                                'WHERE site = ? AND rule = ?;', (site, rule))
-            serialized = pickle.dumps(context, HIGHEST_PROTOCOL)
-            # Optimize pickle size, and conform it to sqlite's BLOB type.
-            serialized = blobify(pickletools.optimize(serialized))
-            if cursor.fetchone() is None:
-                db.execute('INSERT INTO contexts '
-                           '(site, rule, context) VALUES (?, ?, ?);',
-                           (site, rule, serialized))
-            else:
-                db.execute('UPDATE contexts '
-                           'SET context = ? '
+        self.put_many([(site, rule, context)])
+
+    def put_many(self, items):
+        """Put many contexts in one transaction, each distinct context once.
+
+        A route whose context is unchanged since it was last put keeps its
+        rows as they are, and does not count as a change to the shelf.
+        """
+        # Encode before the transaction, to hold the write lock briefly.
+        # Routes of one stash module share a context object; encode it once.
+        encoded = {}
+        contexts = {}
+        rows = []
+        for site, rule, context in items:
+            if id(context) not in encoded:
+                exports, chunks = self.encode_exports(context)
+                # Chunks are part of the content, as exports of their own.
+                digest = digest_exports(
+                    exports + [(name, 'chunk {0}'.format(index), value)
+                               for name, index, value in chunks])
+                contexts[digest] = (exports, chunks)
+                # Keep the context referenced, so that its id is not reused.
+                encoded[id(context)] = (context, digest)
+            rows.append((site, rule, encoded[id(context)][1]))
+        db = self.connect()
+        shelved = time.time()
+        with db:
+            ids = {}
+            for digest, (exports, chunks) in contexts.items():
+                ids[digest] = self.insert_context(db, digest, exports, chunks)
+            changed = False
+            replaced = set()
+            for site, rule, digest in rows:
+                db.execute('INSERT OR IGNORE INTO routes (site, rule) '
+                           'VALUES (?, ?);', (site, rule))
+                previous = db.execute('SELECT context FROM routes '
+                                      'WHERE site = ? AND rule = ?;',
+                                      (site, rule)).fetchone()[0]
+                if previous == ids[digest]:
+                    continue
+                # A response rendered from the previous context is stale;
+                # shelve renders a new one if prerendering.
+                db.execute('DELETE FROM responses '
+                           'WHERE site = ? AND rule = ?;', (site, rule))
+                db.execute('UPDATE routes SET context = ?, shelved = ? '
                            'WHERE site = ? AND rule = ?;',
-                           (serialized, site, rule))
-            db.commit()
+                           (ids[digest], shelved, site, rule))
+                replaced.add(previous)
+                changed = True
+            self.delete_orphans(db, replaced)
+            if changed:
+                db.execute("UPDATE meta SET value = value + 1 "
+                           "WHERE name = 'generation';")
+
+    def encode_exports(self, context):
+        """Encode a context's exports, chunking long lists.
+
+        Returns (name, codec, value) exports, and (name, index, value) chunks.
+        """
+        codec = self.codec
+        chunk_items = self.app.config['SHELF_CHUNK_ITEMS']
+        exports = []
+        chunks = []
+        for name, value in (context or {}).items():
+            if not chunk_items or \
+               not isinstance(value, (list, ChunkedList)) or \
+               len(value) <= chunk_items:
+                exports.append((name, codec.name,
+                                blobify(codec.encode(value))))
+                continue
+            size = 0
+            for index, start in enumerate(xrange(0, len(value),
+                                                 chunk_items)):
+                encoded = codec.encode(value[start:start + chunk_items])
+                size += len(encoded)
+                chunks.append((name, index, blobify(encoded)))
+            header = json.dumps([codec.name, len(value), chunk_items, size])
+            exports.append((name, self.chunked_codec, blobify(header)))
+        return exports, chunks
+
+    def insert_context(self, db, digest, exports, chunks=()):
+        "Store encoded exports under their digest, unless stored; return id."
+        cursor = db.execute('INSERT OR IGNORE INTO contexts (digest) '
+                            'VALUES (?);', (digest,))
+        if cursor.rowcount == 0:
+            return db.execute('SELECT id FROM contexts WHERE digest = ?;',
+                              (digest,)).fetchone()[0]
+        context = cursor.lastrowid
+        db.executemany('INSERT INTO exports (context, name, codec, value) '
+                       'VALUES (?, ?, ?, ?);',
+                       [(context,) + tuple(export) for export in exports])
+        if chunks:
+            db.executemany('INSERT INTO chunks (context, name, chunk, value) '
+                           'VALUES (?, ?, ?, ?);',
+                           [(context,) + tuple(chunk) for chunk in chunks])
+        return context
+
+    def delete_orphans(self, db, contexts):
+        "Delete those of the given contexts, by id, which no route points at."
+        for context in contexts:
+            if context is None:
+                continue
+            cursor = db.execute('SELECT 1 FROM routes WHERE context = ?;',
+                                (context,))
+            if cursor.fetchone() is None:
+                db.execute('DELETE FROM exports WHERE context = ?;',
+                           (context,))
+                db.execute('DELETE FROM chunks WHERE context = ?;',
+                           (context,))
+                db.execute('DELETE FROM contexts WHERE id = ?;', (context,))
+
+    def get_response(self, site, rule, version=None):
+        db = self.connect()
+        result = db.execute('SELECT body, mimetype FROM responses '
+                            'WHERE site = ? AND rule = ? '
+                            'AND (? IS NULL OR version = ?);',
+                            (site, rule, version, version)).fetchone()
+        if result is None:
+            return None
+        return str(result[0]), result[1]
+
+    def get_gzip_response(self, site, rule, version=None):
+        db = self.connect()
+        result = db.execute('SELECT gzip, mimetype FROM responses '
+                            'WHERE site = ? AND rule = ? '
+                            'AND (? IS NULL OR version = ?) '
+                            'AND gzip IS NOT NULL;',
+                            (site, rule, version, version)).fetchone()
+        if result is None:
+            return None
+        return str(result[0]), result[1]
+
+    def put_responses(self, items):
+        """Put responses, each with a gzip variant if SHELF_GZIP and smaller.
+
+        A response whose body, mimetype and version are identical to those
+        shelved keeps its row, and does not count as a change to the shelf.
+        """
+        use_gzip = self.app.config['SHELF_GZIP']
+        db = self.connect()
+        rows = []
+        for site, rule, body, mimetype, version in items:
+            previous = db.execute('SELECT mimetype, body, gzip IS NOT NULL, '
+                                  'version FROM responses '
+                                  'WHERE site = ? AND rule = ?;',
+                                  (site, rule)).fetchone()
+            unchanged = previous is not None and \
+                previous[0] == mimetype and str(previous[1]) == body and \
+                previous[3] == version
+            if unchanged and bool(previous[2]) == use_gzip:
+                # Equal bodies compress alike, so the gzip variant is current.
+                continue
+            compressed = None
+            if use_gzip:
+                compressed = gzip_body(body, self.gzip_level)
+                if len(compressed) >= len(body):
+                    compressed = None
+            if unchanged and compressed is None and not previous[2]:
+                # Still not smaller compressed.
+                continue
+            if compressed is not None:
+                compressed = blobify(compressed)
+            rows.append((site, rule, mimetype, blobify(body), compressed,
+                         version))
+        if not rows:
+            return
+        with db:
+            db.executemany('INSERT OR REPLACE INTO responses '
+                           '(site, rule, mimetype, body, gzip, version) '
+                           'VALUES (?, ?, ?, ?, ?, ?);', rows)
+            db.execute("UPDATE meta SET value = value + 1 "
+                       "WHERE name = 'generation';")
+
+    def delete_responses(self, items):
+        db = self.connect()
+        with db:
+            cursor = db.executemany('DELETE FROM responses '
+                                    'WHERE site = ? AND rule = ?;',
+                                    list(items))
+            if cursor.rowcount > 0:
+                db.execute("UPDATE meta SET value = value + 1 "
+                           "WHERE name = 'generation';")
+
+    def get_manifest(self):
+        db = self.connect()
+        cursor = db.execute('SELECT name, digest, rules FROM modules;')
+        return dict((name, (digest, json.loads(rules)))
+                    for name, digest, rules in cursor.fetchall())
+
+    def put_manifest(self, items):
+        db = self.connect()
+        with db:
+            for name, digest, rules in items:
+                if digest is None:
+                    db.execute('DELETE FROM modules WHERE name = ?;', (name,))
+                else:
+                    db.execute('INSERT OR REPLACE INTO modules '
+                               '(name, digest, rules) VALUES (?, ?, ?);',
+                               (name, digest, json.dumps(list(rules))))
+
+    def prune(self, site, rules):
+        "Delete a site's routes except those of given rules, in a transaction."
+        rules = set(rules)
+        db = self.connect()
+        with db:
+            cursor = db.execute('SELECT id, rule, context FROM routes '
+                                'WHERE site = ?;', (site,))
+            pruned = [(route, context) for route, rule, context
+                      in cursor.fetchall() if rule not in rules]
+            for route, _ in pruned:
+                db.execute('DELETE FROM routes WHERE id = ?;', (route,))
+            self.delete_orphans(db, set(context for _, context in pruned))
+            cursor = db.execute('DELETE FROM responses WHERE site = ? AND '
+                                'NOT EXISTS (SELECT 1 FROM routes WHERE '
+                                'routes.site = responses.site AND '
+                                'routes.rule = responses.rule);', (site,))
+            if pruned or cursor.rowcount > 0:
+                db.execute("UPDATE meta SET value = value + 1 "
+                           "WHERE name = 'generation';")
+        return len(pruned)
+
+    def compact(self):
+        """Delete contexts which no route points at, then VACUUM the file.
+
+        Puts and prunes already delete what they leave unreferenced; this also
+        covers shelves written otherwise, e.g. by an interrupted migration.
+        The unique index on (site, rule) keeps routes from being duplicated.
+        """
+        db = self.connect()
+        before = os.path.getsize(self.filepath)
+        with db:
+            db.execute('DELETE FROM exports WHERE context NOT IN '
+                       '(SELECT context FROM routes '
+                       'WHERE context IS NOT NULL);')
+            db.execute('DELETE FROM chunks WHERE context NOT IN '
+                       '(SELECT context FROM routes '
+                       'WHERE context IS NOT NULL);')
+            db.execute('DELETE FROM contexts WHERE id NOT IN '
+                       '(SELECT context FROM routes '
+                       'WHERE context IS NOT NULL);')
+        # VACUUM rewrites the file without free pages; it needs no open
+        # transaction, and a moment of exclusive access to the shelf.
+        db.execute('VACUUM;')
+        return before - os.path.getsize(self.filepath)
+
+
+class LazyContext(Mapping):
+    """Context mapping which reads each export from the shelf when accessed.
+
+    The names of all exports are known up front, so membership tests and
+    iteration over names do not read anything.  Writers which need the whole
+    context should call :meth:`load`, or items or values, which read all
+    remaining exports in one batch.
+
+    Test:
+    >>> reads = []
+    >>> def load(names):
+    ...     reads.append(sorted(names))
+    ...     return dict((name, name.upper()) for name in names)
+    ...
+    >>> context = LazyContext(set(['title', 'body', 'footer']),
+    ...                       {'title': 'Title'}, load)
+    >>> 'body' in context, 'missing' in context
+    (True, False)
+    >>> context['title'], context['body']
+    ('Title', 'BODY')
+    >>> sorted(context.items())
+    [('body', 'BODY'), ('footer', 'FOOTER'), ('title', 'Title')]
+    >>> reads
+    [['body'], ['footer']]
+    >>>
+    """
+
+    def __init__(self, names, loaded, load, digest=None):
+        self.names = names
+        self.loaded = loaded
+        self.load_exports = load
+        # Digest of the context's content, if known, shared by equal contexts.
+        self.digest = digest
+
+    def __getitem__(self, name):
+        try:
+            return self.loaded[name]
+        except KeyError:
+            if name not in self.names:
+                raise
+        self.loaded.update(self.load_exports([name]))
+        return self.loaded[name]
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return repr(self.load())
+
+    def load(self):
+        "Read all remaining exports in one batch, and return a plain dict."
+        missing = [name for name in self.names if name not in self.loaded]
+        if missing:
+            self.loaded.update(self.load_exports(missing))
+        return dict(self.loaded)
+
+    def items(self):
+        return self.load().items()
+
+    def values(self):
+        return self.load().values()
+
+    def iteritems(self):
+        return self.load().iteritems()
+
+    def itervalues(self):
+        return self.load().itervalues()
+
+
+class ChunkedList(Sequence):
+    """Read-only list of an export shelved in chunks, each read when needed.
+
+    Indexing or slicing reads only the chunks of the items wanted, e.g. the
+    items of a page; chunks read are kept, for as long as the list is.  It
+    equals a list of the same items, and pickles as one.
+
+    Test:
+    >>> reads = []
+    >>> def load(index):
+    ...     reads.append(index)
+    ...     return range(index * 10, min(index * 10 + 10, 25))
+    ...
+    >>> items = ChunkedList(25, 10, load)
+    >>> len(items), items[12], items[-1], items[8:12]
+    (25, 12, 24, [8, 9, 10, 11])
+    >>> reads
+    [1, 2, 0]
+    >>> items == range(25), items[::-10]
+    (True, [24, 14, 4])
+    >>> pickle.loads(pickle.dumps(items)) == range(25)
+    True
+    >>>
+    """
+
+    def __init__(self, length, chunk_items, load):
+        self.length = length
+        self.chunk_items = chunk_items
+        self.load_chunk = load
+        self.chunks = {}
+
+    def chunk(self, index):
+        chunk = self.chunks.get(index)
+        if chunk is None:
+            chunk = self.chunks[index] = self.load_chunk(index)
+        return chunk
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            if step != 1:
+                return [self[i] for i in xrange(start, stop, step)]
+            items = []
+            while start < stop:
+                chunk_index, offset = divmod(start, self.chunk_items)
+                taken = self.chunk(chunk_index)[offset:offset + stop - start]
+                if not taken:
+                    break
+                items.extend(taken)
+                start += len(taken)
+            return items
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('list index out of range')
+        chunk_index, offset = divmod(index, self.chunk_items)
+        return self.chunk(chunk_index)[offset]
+
+    def __iter__(self):
+        for chunk_index in xrange(0, (self.length + self.chunk_items - 1) //
+                                  self.chunk_items):
+            for item in self.chunk(chunk_index):
+                yield item
+
+    def __eq__(self, other):
+        if isinstance(other, (list, ChunkedList)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+def unchunk(value):
+    "Get a value as a plain list if it is a ChunkedList, e.g. to encode it."
+    if isinstance(value, ChunkedList):
+        return list(value)
+    return value
+
+
+class MmapConnector(BaseConnector):
+    """Read-only shelf connector serving one immutable file through mmap.
+
+    The file at SHELF_FILEPATH is built whole, by shelve or from a sqlite shelf
+    with ``tango pack``, and is never written to while served.  It holds an
+    open-addressing hash table of (site, rule) keys followed by the records it
+    points to, so a lookup touches a slot or two and one record in the mapping,
+    and nothing is copied out of the page cache until a context is decoded.
+    Contexts are encoded with SHELF_CODEC, recorded per context, and each
+    distinct encoded context is written once, for all routes which share it.
+    Since the page cache backs every mapping of the file, pre-forked workers
+    share one copy of the shelf in memory.
+
+    To serve a rebuilt file, which replaces the old one atomically, restart the
+    workers or close the connector.
+
+    Test:
+    >>> import tempfile
+    >>> from tango.app import Tango
+    >>> app = Tango('simplesite')
+    >>> app.config['SHELF_FILEPATH'] = tempfile.mktemp(suffix='.shelf')
+    >>> connector = MmapConnector(app)
+    >>> connector.build([('site', '/', {'title': 'Tango'}),
+    ...                  ('site', '/about/', {'title': 'About'})])
+    >>> connector.get('site', '/')
+    {'title': 'Tango'}
+    >>> connector.get('site', '/missing/')
+    {}
+    >>> connector.close()
+    >>> os.unlink(app.config['SHELF_FILEPATH'])
+    >>>
+    """
+
+    read_only = True
+
+    # File layout, little-endian: a header, slot_count slots, then records.
+    # A slot is (key hash, record offset), with offset 0 for an empty slot.
+    # A record is (key length, codec length, value length, value offset),
+    # then the key and the codec name.  Records of equal values point at
+    # the same encoded value, written before the first record to use it.
+    magic = 'TANGOSHF'
+    header = struct.Struct('<8sII')
+    slot = struct.Struct('<QQ')
+    record = struct.Struct('<IIIQ')
+    file_version = 3
+
+    def __init__(self, app):
+        BaseConnector.__init__(self, app)
+        self.filepath = app.config['SHELF_FILEPATH']
+        self.codec = get_codec(app.config['SHELF_CODEC'])
+        self.lock = threading.Lock()
+        self.map = None
+
+    def open(self):
+        "Map the shelf file into memory, once."
+        with self.lock:
+            if self.map is not None:
+                return self.map
+            with open(self.filepath, 'rb') as fd:
+                shelf = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, slot_count = self.header.unpack_from(shelf, 0)
+            if magic != self.magic or version != self.file_version:
+                shelf.close()
+                raise ValueError('{0} is not a version {1} Tango shelf file.'
+                                 .format(self.filepath, self.file_version))
+            self.slot_count = slot_count
+            self.map = shelf
+            return shelf
+
+    def close(self):
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+
+    def get(self, site, rule):
+        return self.get_sized(site, rule)[0]
+
+    def get_sized(self, site, rule):
+        shelf = self.map
+        if shelf is None:
+            with timed('connect'):
+                shelf = self.open()
+        key = make_key(site, rule)
+        key_hash = hash_key(key)
+        mask = self.slot_count - 1
+        index = key_hash & mask
+        while True:
+            slot_offset = self.header.size + index * self.slot.size
+            slot_hash, offset = self.slot.unpack_from(shelf, slot_offset)
+            if offset == 0:
+                return {}, 0
+            if slot_hash == key_hash:
+                key_length, codec_length, value_length, value_offset = \
+                    self.record.unpack_from(shelf, offset)
+                start = offset + self.record.size
+                if shelf[start:start + key_length] == key:
+                    start += key_length
+                    codec = get_codec(shelf[start:start + codec_length])
+                    value = shelf[value_offset:value_offset + value_length]
+                    with timed('decode'):
+                        return codec.decode(value), value_length
+            index = (index + 1) & mask
+
+    def put(self, site, rule, context):
+        raise NotImplementedError('A shelf file is read-only; build it whole.')
+
+    def build(self, items):
+        """Write the shelf file from an iterable of (site, rule, context).
+
+        The file is written aside, then renamed into place, so that processes
+        which have the previous file mapped keep reading it consistently.
+        """
+        # Last one wins, as for puts of the same route.
+        keys = []
+        contexts = {}
+        for site, rule, context in items:
+            key = make_key(site, rule)
+            if key not in contexts:
+                keys.append(key)
+            contexts[key] = context
+        # Keep the table at most half full, with a power-of-two size.
+        slot_count = 1
+        while slot_count < 2 * len(keys):
+            slot_count *= 2
+        slots = [(0, 0)] * slot_count
+        offset = self.header.size + slot_count * self.slot.size
+        # Readable by workers, which may run as another user than the packer.
+        with atomic_write(self.filepath, mode=0644) as shelf:
+            shelf.seek(offset)
+            codec_name = self.codec.name
+            # (offset, length) of values written, by context object id
+            # and by digest of the encoded value.
+            by_id = {}
+            by_digest = {}
+            for key in keys:
+                context = contexts[key]
+                if id(context) not in by_id:
+                    if context is not None and \
+                       not isinstance(context, dict):
+                        # e.g. a lazy context read from another shelf.
+                        value = self.codec.encode(dict(
+                            (name, unchunk(value))
+                            for name, value in context.items()))
+                    else:
+                        value = self.codec.encode(context)
+                    digest = hashlib.sha1(value).digest()
+                    if digest not in by_digest:
+                        shelf.write(value)
+                        by_digest[digest] = (offset, len(value))
+                        offset += len(value)
+                    by_id[id(context)] = by_digest[digest]
+                value_offset, value_length = by_id[id(context)]
+                key_hash = hash_key(key)
+                index = key_hash & (slot_count - 1)
+                while slots[index][1] != 0:
+                    index = (index + 1) & (slot_count - 1)
+                slots[index] = (key_hash, offset)
+                shelf.write(self.record.pack(len(key), len(codec_name),
+                                             value_length, value_offset))
+                shelf.write(key)
+                shelf.write(codec_name)
+                offset += self.record.size + len(key) + len(codec_name)
+            shelf.seek(0)
+            shelf.write(self.header.pack(self.magic, self.file_version,
+                                         slot_count))
+            for slot in slots:
+                shelf.write(self.slot.pack(*slot))
+
+
+class ContextCache(object):
+    """Least-recently-used cache, bounded by entry count and by total bytes.
+
+    Sizes are given by the caller, e.g. the size of a context's shelved form.
+
+    Test:
+    >>> cache = ContextCache(max_entries=2, max_bytes=100)
+    >>> cache.put('a', 'A', 10)
+    >>> cache.put('b', 'B', 10)
+    >>> cache.get('a')
+    'A'
+    >>> cache.put('c', 'C', 10)
+    >>> cache.get('b') is None
+    True
+    >>> cache.put('d', 'D', 95)
+    >>> sorted(cache.stats().items())
+    ... # doctest:+NORMALIZE_WHITESPACE
+    [('bytes', 95), ('entries', 1), ('evictions', 3), ('hits', 1),
+     ('invalidations', 0), ('misses', 1)]
+    >>>
+    """
+
+    # Fields of a linked list entry.
+    PREV, NEXT, KEY, VALUE, SIZE = range(5)
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+        self.clear()
+
+    def clear(self):
+        "Drop all entries, without counting them as evictions."
+        self.table = {}
+        self.bytes = 0
+        # Circular doubly linked list, most recently used first.
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None, 0]
+
+    def invalidate(self):
+        "Drop all entries, e.g. when the shelf has changed."
+        with self.lock:
+            if self.table:
+                self.invalidations += 1
+            self.clear()
+
+    def get(self, key):
+        "Get a cached value, or None on a miss."
+        with self.lock:
+            entry = self.table.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._unlink(entry)
+            self._link(entry)
+            return entry[self.VALUE]
+
+    def put(self, key, value, size):
+        "Cache a value, evicting least recently used entries to make room."
+        with self.lock:
+            self._discard(key)
+            if size > self.max_bytes or self.max_entries < 1:
+                return
+            while (len(self.table) >= self.max_entries or
+                   self.bytes + size > self.max_bytes):
+                self._discard(self.root[self.PREV][self.KEY])
+                self.evictions += 1
+            entry = [None, None, key, value, size]
+            self._link(entry)
+            self.table[key] = entry
+            self.bytes += size
+
+    def discard(self, key):
+        "Drop a cached value, if any."
+        with self.lock:
+            self._discard(key)
+
+    def stats(self):
+        "Counters for sizing the cache, as a dict."
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self.table), 'bytes': self.bytes}
+
+    def _discard(self, key):
+        entry = self.table.pop(key, None)
+        if entry is not None:
+            self._unlink(entry)
+            self.bytes -= entry[self.SIZE]
+
+    def _link(self, entry):
+        first = self.root[self.NEXT]
+        entry[self.PREV], entry[self.NEXT] = self.root, first
+        first[self.PREV] = self.root[self.NEXT] = entry
+
+    def _unlink(self, entry):
+        prev, next = entry[self.PREV], entry[self.NEXT]
+        prev[self.NEXT], next[self.PREV] = next, prev
+
+
+class CachedConnector(BaseConnector):
+    """Connector wrapper caching unpickled contexts in memory.
+
+    Contexts are cached by (site, rule) in a :class:`ContextCache` sized by
+    SHELF_CACHE_ENTRIES and SHELF_CACHE_BYTES.  The cache is dropped whenever
+    the wrapped connector reports a new :meth:`BaseConnector.generation`,
+    i.e. when anything has been shelved since, which costs one small query.
+    Routes whose contexts have the same digest share one cached context;
+    each route's entry still counts its full size against the byte limit.
+    """
+
+    def __init__(self, connector):
+        BaseConnector.__init__(self, connector.app)
+        self.connector = connector
+        self.cache = ContextCache(self.app.config['SHELF_CACHE_ENTRIES'],
+                                  self.app.config['SHELF_CACHE_BYTES'])
+        self.cached_generation = None
+        # Contexts held by the cache, or in use, by digest.
+        self.contexts = weakref.WeakValueDictionary()
+
+    def get(self, site, rule):
+        return self.get_sized(site, rule)[0]
+
+    def get_sized(self, site, rule):
+        generation = self.connector.generation()
+        if generation != self.cached_generation:
+            self.cache.invalidate()
+            self.cached_generation = generation
+        key = (site, rule)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        context, size = self.connector.get_sized(site, rule)
+        digest = getattr(context, 'digest', None)
+        if digest is not None:
+            context = self.contexts.setdefault(digest, context)
+        self.cache.put(key, (context, size), size)
+        return context, size
+
+    def put(self, site, rule, context):
+        self.connector.put(site, rule, context)
+        self.cache.discard((site, rule))
+
+    def put_many(self, items):
+        items = list(items)
+        self.connector.put_many(items)
+        for site, rule, _ in items:
+            self.cache.discard((site, rule))
+
+    def get_response(self, site, rule, version=None):
+        return self.connector.get_response(site, rule, version)
+
+    def get_gzip_response(self, site, rule, version=None):
+        return self.connector.get_gzip_response(site, rule, version)
+
+    def get_version(self, site, rule):
+        return self.connector.get_version(site, rule)
+
+    def put_responses(self, items):
+        self.connector.put_responses(items)
+
+    def delete_responses(self, items):
+        self.connector.delete_responses(items)
+
+    def get_manifest(self):
+        return self.connector.get_manifest()
+
+    def put_manifest(self, items):
+        self.connector.put_manifest(items)
+
+    def prune(self, site, rules):
+        pruned = self.connector.prune(site, rules)
+        self.cache.invalidate()
+        return pruned
+
+    def compact(self):
+        return self.connector.compact()
+
+    def generation(self):
+        return self.connector.generation()
+
+    def stats(self):
+        "Cache hit, miss & eviction counters, as a dict."
+        return self.cache.stats()
+
+    def release(self):
+        self.connector.release()
+
+    def close(self):
+        self.cache.invalidate()
+        self.connector.close()
+
+
+def make_key(site, rule):
+    "Encode (site, rule) as a byte string key."
+    return u'{0}\0{1}'.format(site, rule).encode('utf-8')
+
+
+def hash_key(key):
+    "Hash a key to 64 bits, the same on every platform and process."
+    return struct.unpack('<Q', hashlib.md5(key).digest()[:8])[0]
+
+
+def digest_exports(exports):
+    """Digest a context's content, given as (name, codec, value) exports.
+
+    Exports are encoded values, so that equal contexts encoded alike have the
+    same digest, in any order.
+
+    >>> a = digest_exports([('title', 'json', '"Tango"'), ('n', 'json', '1')])
+    >>> b = digest_exports([('n', 'json', '1'), ('title', 'json', '"Tango"')])
+    >>> a == b, a == digest_exports([('title', 'json', '"Tango"')])
+    (True, False)
+    >>> len(a)
+    40
+    >>>
+    """
+    digest = hashlib.sha1()
+    for name, codec, value in sorted((repr(name), codec, str(value))
+                                     for name, codec, value in exports):
+        for part in (name, codec, value):
+            # Prefix lengths, so that no two exports digest the same.
+            digest.update('{0}:'.format(len(part)))
+            digest.update(part)
+    return digest.hexdigest()
+
+
+def gzip_body(body, level=9):
+    """Compress a response body in gzip format, as sent with Content-Encoding.
+
+    The gzip header carries no timestamp, so equal bodies compress alike.
+
+    >>> import gzip, StringIO
+    >>> body = 'Tango ' * 100
+    >>> compressed = gzip_body(body)
+    >>> len(compressed) < len(body), compressed == gzip_body(body)
+    (True, True)
+    >>> gzip.GzipFile(fileobj=StringIO.StringIO(compressed)).read() == body
+    True
+    >>>
+    """
+    # A window size of 16 + MAX_WBITS writes a gzip header and trailer.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
@@ -0,0 +1,190 @@
+"Timing of the phases of requests to stashed views, per request and route."
+
+import threading
+import time
+
+
+# Phases of a request to a stashed view, in the order they happen.
+PHASES = ('connect', 'fetch', 'decode', 'render', 'response')
+
+# Upper bounds of histogram buckets, in seconds; the last is unbounded.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, float('inf'))
+
+# Upper bounds of histogram buckets for sizes of shelved contexts, in bytes.
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304,
+                float('inf'))
+
+# Timer of the request in progress in each thread, if it is timed.
+_local = threading.local()
+
+
+class Timer(object):
+    """Accumulates the time spent in each phase of one request.
+
+    Phases nest, and each phase counts only its own time, not the time of the
+    phases nested in it, e.g. exports read as a template renders.
+
+    Test:
+    >>> timer = Timer()
+    >>> timer.start('render')
+    >>> with timer.phase('fetch'):
+    ...     time.sleep(0.01)
+    ...
+    >>> timer.stop()
+    >>> timer.times['render'] < 0.01 <= timer.times['fetch']
+    True
+    >>>
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.times = {}
+        self.stack = []
+
+    def start(self, phase):
+        self.stack.append([phase, time.time(), 0.0])
+
+    def stop(self):
+        phase, started, nested = self.stack.pop()
+        elapsed = time.time() - started
+        self.times[phase] = self.times.get(phase, 0.0) + elapsed - nested
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+    def phase(self, phase):
+        return TimedPhase(self, phase)
+
+    def finish(self):
+        "Record the total time since the timer was created, as 'total'."
+        self.times['total'] = time.time() - self.started
+
+    def header(self):
+        """Format times as a Server-Timing header value, in milliseconds.
+
+        >>> timer = Timer()
+        >>> timer.times = {'render': 0.0125, 'fetch': 0.0005, 'total': 0.02}
+        >>> timer.header()
+        'fetch;dur=0.500, render;dur=12.500, total;dur=20.000'
+        >>>
+        """
+        return ', '.join('{0};dur={1:.3f}'.format(phase,
+                                                  self.times[phase] * 1000)
+                         for phase in PHASES + ('total',)
+                         if phase in self.times)
+
+
+class TimedPhase(object):
+    "Context manager timing a phase with a timer."
+
+    __slots__ = ('timer', 'name')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.timer.start(self.name)
+
+    def __exit__(self, *exc_info):
+        self.timer.stop()
+
+
+class UntimedPhase(object):
+    "Context manager doing nothing, for phases outside of a timed request."
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+untimed = UntimedPhase()
+
+
+def start_timer():
+    "Start timing a request in this thread, and return its timer."
+    timer = _local.timer = Timer()
+    return timer
+
+
+def stop_timer():
+    "Stop timing the request in this thread."
+    _local.timer = None
+
+
+def timed(phase):
+    """Context manager timing a phase of the request in this thread, if any.
+
+    Shelf connectors time their own phases with this, e.g. decoding, without
+    knowing whether a request is timed; it costs little when none is.
+
+    Test:
+    >>> with timed('fetch'):
+    ...     pass
+    ...
+    >>> timer = start_timer()
+    >>> with timed('fetch'):
+    ...     pass
+    ...
+    >>> stop_timer()
+    >>> timer.times.keys()
+    ['fetch']
+    >>>
+    """
+    timer = getattr(_local, 'timer', None)
+    if timer is None:
+        return untimed
+    return TimedPhase(timer, phase)
+
+
+class Histograms(object):
+    """Histograms of phase times by route, in buckets bounded by BUCKETS.
+
+    Each histogram is a list of counts per bucket, along with the count and
+    the sum of its times, as kept by Prometheus.  Other buckets can be given,
+    e.g. SIZE_BUCKETS for histograms of sizes.
+
+    Test:
+    >>> histograms = Histograms()
+    >>> histograms.record('/', {'fetch': 0.0003, 'render': 0.002})
+    >>> histograms.record('/', {'fetch': 0.0004})
+    >>> counts, count, total = histograms.snapshot()['/']['fetch']
+    >>> counts[:4], count
+    ([0, 0, 2, 0], 2)
+    >>> sorted(histograms.snapshot()['/'])
+    ['fetch', 'render']
+    >>>
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # [counts, count, sum] by phase, by route rule.
+        self.routes = {}
+
+    def record(self, rule, times):
+        with self.lock:
+            phases = self.routes.get(rule)
+            if phases is None:
+                phases = self.routes[rule] = {}
+            for phase, seconds in times.iteritems():
+                histogram = phases.get(phase)
+                if histogram is None:
+                    histogram = phases[phase] = [[0] * len(self.buckets), 0,
+                                                 0.0]
+                index = 0
+                while seconds > self.buckets[index]:
+                    index += 1
+                histogram[0][index] += 1
+                histogram[1] += 1
+                histogram[2] += seconds
+
+    def snapshot(self):
+        "Copy the histograms, as {rule: {phase: (counts, count, sum)}}."
+        with self.lock:
+            return dict((rule, dict((phase, (list(counts), count, total))
+                                    for phase, (counts, count, total)
+                                    in phases.iteritems()))
+                        for rule, phases in self.routes.iteritems())
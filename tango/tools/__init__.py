@@ -1,7 +1,10 @@
-"Package of utilities for use by Tango sites external to core Tango framework."
+"Package of utilities for use by Tango sites, and by the framework itself."
 
+from contextlib import contextmanager
 import csv
+import os
 import re
+import tempfile
 from datetime import date
 from time import mktime, strptime
 
@@ -288,9 +291,70 @@ def url_parameter_match(route, parameter):
     return re.search('[<:]{0}>'.format(parameter), route) is not None
 
 
-# For testing:
-import os.path
+@contextmanager
+def atomic_write(filepath, mode=None):
+    """Write a file aside, then rename it into place, in a with block.
+
+    Readers, e.g. other processes, see either the old file or the new one,
+    never one partly written.  Yields a file open for binary writing in the
+    same directory, which is created if missing.  It is renamed over the
+    file if the block completes, and removed if it raises.  The file gets
+    the mode open would give a new file, 0666 less the umask, unless given
+    another, e.g. a narrower one.
+
+    Example:
+    >>> import shutil
+    >>> directory = tempfile.mkdtemp()
+    >>> filepath = os.path.join(directory, 'new', 'file.txt')
+    >>> with atomic_write(filepath, mode=0644) as fileobj:
+    ...     fileobj.write('written')
+    ...
+    >>> open(filepath).read(), oct(os.stat(filepath).st_mode & 0777)
+    ('written', '0644')
+    >>> with atomic_write(filepath) as fileobj:
+    ...     fileobj.write('partial')
+    ...     raise ValueError('Failed to write.')
+    ...
+    Traceback (most recent call last):
+       ...
+    ValueError: Failed to write.
+    >>> open(filepath).read(), os.listdir(os.path.dirname(filepath))
+    ('written', ['file.txt'])
+    >>> umask = os.umask(022)
+    >>> with atomic_write(filepath) as fileobj:
+    ...     fileobj.write('shared')
+    ...
+    >>> _ = os.umask(umask)
+    >>> oct(os.stat(filepath).st_mode & 0777)
+    '0644'
+    >>> shutil.rmtree(directory)
+    >>>
+    """
+    directory = os.path.dirname(os.path.abspath(filepath))
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Another process may have created it meanwhile.
+            if not os.path.isdir(directory):
+                raise
+    if mode is None:
+        # mkstemp creates the file private; open would apply the umask.
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0666 & ~umask
+    fd, temp_filepath = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fileobj:
+            yield fileobj
+        os.chmod(temp_filepath, mode)
+        os.rename(temp_filepath, filepath)
+    except:
+        os.unlink(temp_filepath)
+        raise
+
 
+# For testing:
 directory = os.path.dirname(os.path.abspath(__file__))
 tests_directory = os.path.abspath(os.path.join(directory, '../../tests/'))
 csv_test_file = tests_directory + '/csv.csv' # for the UnicodeDictReader test
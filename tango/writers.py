@@ -2,9 +2,15 @@
 
 import json
 import mimetypes
+import sys
 import types
+from collections import Mapping, Sequence
 
-from flask import render_template
+from flask import current_app, render_template, template_rendered
+from jinja2.environment import TemplateStream
+from jinja2.utils import concat
+
+from tango.shelf import ChunkedList
 
 
 class BaseWriter(object):
@@ -88,21 +94,213 @@ class JsonWriter(BaseWriter):
     >>> response # doctest:+NORMALIZE_WHITESPACE
     u'{"answer": 42, "count": ["one", "two"],
        "adict": {"second": 2, "first": 1}, "title": "Test Title"}'
+
+    Sequences other than lists and tuples are skipped, as json.dumps would:
+    >>> json({'x': xrange(3), 'y': 1})
+    u'{"y": 1}'
     >>>
     """
 
     mimetype = 'application/json'
 
     def write(self, context):
-        trimmed_context = {}
+        # Encode each value once, keeping the members which encode, by key so
+        # that they come out in the order json.dumps would give the dict.
+        members = {}
         for key, value in context.items():
+            encoded_key = encode_json_key(key)
+            if encoded_key is None:
+                continue
             try:
-                json.dumps({key: value})
-                trimmed_context[key] = value
+                members[key] = encoded_key + ': ' + encode_json(value)
             except TypeError:
                 # value is not json serializable
                 pass
-        return unicode(json.dumps(trimmed_context))
+        return u'{' + u', '.join(members.itervalues()) + u'}'
+
+
+class JsonStreamWriter(BaseWriter):
+    """Write a template context in JSON format, as chunks for streaming.
+
+    As JsonWriter, but sequence exports, e.g. lists and chunked lists, are
+    encoded an item at a time, so that a huge list export is never held in
+    memory as one string.  Items
+    which cannot be serialized are skipped, rather than their whole export.
+    Exports are read one at a time, so a lazy context is not read whole.
+
+    Test:
+    >>> stream = JsonStreamWriter()
+    >>> chunks = stream(test_context)
+    >>> json.loads(u''.join(chunks)) == json.loads(JsonWriter()(test_context))
+    True
+    >>> stream.chunk_size = 10
+    >>> chunks = list(stream({'items': range(100)}))
+    >>> len(chunks) > 1, max(len(chunk) for chunk in chunks) < 20
+    (True, True)
+    >>> json.loads(u''.join(chunks)) == {'items': range(100)}
+    True
+    >>>
+    """
+
+    mimetype = 'application/json'
+
+    # Chunks are iterables of unicode, not one unicode string.
+    require_unicode = False
+
+    # number of characters to buffer into each streamed chunk
+    chunk_size = 8192
+
+    def write(self, context):
+        return buffer_chunks(self.generate(context), self.chunk_size)
+
+    def generate(self, context):
+        yield '{'
+        separator = ''
+        for key in context:
+            encoded_key = encode_json_key(key)
+            if encoded_key is None:
+                continue
+            value = context[key]
+            if is_sequence(value):
+                pieces = encode_json_items(value)
+            else:
+                try:
+                    pieces = [encode_json(value)]
+                except TypeError:
+                    # value is not json serializable
+                    continue
+            yield separator + encoded_key + ': '
+            separator = ', '
+            for piece in pieces:
+                yield piece
+        yield '}'
+
+
+class NdjsonWriter(JsonStreamWriter):
+    """Write a template context as newline-delimited JSON, for streaming.
+
+    The first line is an object of the exports which are not sequences, e.g.
+    lists, as JsonWriter writes them.  Each following line is an item of a
+    sequence export, in order of export name.  Items which cannot be serialized
+    are skipped.
+
+    Test:
+    >>> ndjson = NdjsonWriter()
+    >>> print u''.join(ndjson({'title': 'Items', 'items': [1, {'two': 2}],
+    ...                        'more': (3,), 'skipped': [lambda x: x]})),
+    {"title": "Items"}
+    1
+    {"two": 2}
+    3
+    >>>
+    """
+
+    mimetype = 'application/x-ndjson'
+
+    def generate(self, context):
+        names = []
+        header = {}
+        for key in context:
+            value = context[key]
+            if is_sequence(value):
+                names.append(key)
+            else:
+                header[key] = value
+        yield JsonWriter().write(header) + '\n'
+        for name in sorted(names):
+            for item in context[name]:
+                try:
+                    yield encode_json(item) + '\n'
+                except TypeError:
+                    # item is not json serializable
+                    pass
+
+
+def encode_json(value):
+    """Encode a value as JSON, as json.dumps does, a ChunkedList as an array.
+
+    >>> items = ChunkedList(3, 2, lambda i: range(3)[i * 2:i * 2 + 2])
+    >>> encode_json({'items': items})
+    '{"items": [0, 1, 2]}'
+    >>> encode_json(set([1]))
+    Traceback (most recent call last):
+      ...
+    TypeError: set([1]) is not JSON serializable
+    >>> encode_json(xrange(3))
+    Traceback (most recent call last):
+      ...
+    TypeError: xrange(3) is not JSON serializable
+    >>>
+    """
+    return json_encoder.encode(value)
+
+
+def encode_chunked(value):
+    "Encode a ChunkedList as the list it stands for, and refuse all else."
+    if isinstance(value, ChunkedList):
+        return list(value)
+    raise TypeError(repr(value) + ' is not JSON serializable')
+
+
+# Encoder of writers, made once rather than per json.dumps with a default.
+json_encoder = json.JSONEncoder(default=encode_chunked)
+
+
+def is_sequence(value):
+    "Whether a value is encoded as a JSON array, a list, tuple or the like."
+    return isinstance(value, Sequence) and not isinstance(value, basestring)
+
+
+def encode_json_key(key):
+    """Encode a key as a JSON object key, as json.dumps does, or get None.
+
+    >>> encode_json_key('title'), encode_json_key(1), encode_json_key(None)
+    ('"title"', '"1"', '"null"')
+    >>> encode_json_key((1, 2)) is None
+    True
+    >>>
+    """
+    if isinstance(key, basestring):
+        return json.dumps(key)
+    if key is None or isinstance(key, (bool, int, long, float)):
+        # JSON keys are strings, e.g. "1" for 1, as json.dumps does.
+        return json.dumps(json.dumps(key))
+    return None
+
+
+def encode_json_items(values):
+    "Encode a sequence as a JSON array, piece by piece, skipping failures."
+    yield '['
+    separator = ''
+    for value in values:
+        try:
+            encoded = encode_json(value)
+        except TypeError:
+            # value is not json serializable
+            continue
+        yield separator + encoded
+        separator = ', '
+    yield ']'
+
+
+def buffer_chunks(pieces, size):
+    """Join pieces of text into unicode chunks of at least size characters.
+
+    >>> list(buffer_chunks(['a', 'bc', 'd', 'efg', 'h'], 3))
+    [u'abc', u'defg', u'h']
+    >>>
+    """
+    buffered = []
+    length = 0
+    for piece in pieces:
+        buffered.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield u''.join(buffered)
+            buffered = []
+            length = 0
+    if buffered:
+        yield u''.join(buffered)
 
 
 class TemplateWriter(BaseWriter):
@@ -124,6 +322,13 @@ class TemplateWriter(BaseWriter):
     'text/html'
     >>>
 
+    A streaming writer writes an iterable of unicode chunks as the template
+    renders, for a streamed response, instead of one string.
+    >>> stream_writer = TemplateWriter('index.html', stream=True)
+    >>> response = stream_writer(test_context)
+    >>> '<title>Test Title</title>' in u''.join(response)
+    True
+
     The template's mimetype is guessed based on the file extension.
     >>> text_template_writer = TemplateWriter('index.txt')
     >>> print text_template_writer(test_context)
@@ -142,15 +347,146 @@ class TemplateWriter(BaseWriter):
 
     mimetype = 'text/html'
 
-    def __init__(self, template_name):
+    # number of template output items to buffer into each streamed chunk
+    buffer_size = 20
+
+    def __init__(self, template_name, stream=False):
         self.template_name = template_name
+        self.stream = stream
+        if stream:
+            self.require_unicode = False
         basename = self.template_name.rsplit('/', 1)[-1]
         guessed_type, guessed_encoding = mimetypes.guess_type(basename)
         if guessed_type:
             self.mimetype = guessed_type
 
     def write(self, context):
-        return render_template(self.template_name, **context)
+        if self.stream:
+            return stream_template_mapping(self.template_name, context,
+                                           self.buffer_size)
+        if isinstance(context, dict):
+            return render_template(self.template_name, **context)
+        # A lazy context is read as the template needs it, not all at once.
+        return render_template_mapping(self.template_name, context)
+
+
+def render_template_mapping(template_name, context):
+    """Render a template with a context mapping, reading only the names used.
+
+    Flask's render_template copies its context into a dict, which reads every
+    item in the mapping.  Instead, lookups go to the mapping itself, layered
+    over context processors and template globals as in render_template.
+
+    Test:
+    >>> from tango.factory.app import build_app
+    >>> app = build_app('simplesite')
+    >>> ctx = app.test_request_context()
+    >>> ctx.push()
+    >>> class Context(Layers):
+    ...     def __getitem__(self, name):
+    ...         print 'Reading', name
+    ...         return Layers.__getitem__(self, name)
+    ...
+    >>> context = Context([{'title': 'Test Title', 'unused': 'Unused'}])
+
+    Both index.html and the base.html it extends look up the title.
+    >>> response = render_template_mapping('index.html', context)
+    Reading title
+    Reading title
+    >>> '<p>Test Title</p>' in response
+    True
+    >>> ctx.pop()
+    >>>
+    """
+    app, template, template_context = new_template_context(template_name,
+                                                           context)
+    try:
+        rendered = concat(template.root_render_func(template_context))
+    except Exception:
+        exc_info = sys.exc_info()
+        return template.environment.handle_exception(exc_info, True)
+    template_rendered.send(app, template=template, context=context)
+    return rendered
+
+
+def stream_template_mapping(template_name, context, buffer_size=5):
+    """Render a template with a context mapping, as it is iterated.
+
+    Returns an iterable of unicode chunks, of buffer_size template output
+    items each, so that a page need not be held in memory whole.  Iterate
+    it within the request context, e.g. with Flask's stream_with_context.
+
+    Test:
+    >>> from tango.factory.app import build_app
+    >>> app = build_app('simplesite')
+    >>> ctx = app.test_request_context()
+    >>> ctx.push()
+    >>> stream = stream_template_mapping('index.html', {'title': 'Streamed'})
+    >>> chunks = list(stream)
+    >>> len(chunks) > 1
+    True
+    >>> '<title>Streamed</title>' in u''.join(chunks)
+    True
+    >>> ctx.pop()
+    >>>
+    """
+    app, template, template_context = new_template_context(template_name,
+                                                           context)
+    def generate():
+        try:
+            for item in template.root_render_func(template_context):
+                yield item
+        except Exception:
+            exc_info = sys.exc_info()
+            yield template.environment.handle_exception(exc_info, True)
+    template_rendered.send(app, template=template, context=context)
+    stream = TemplateStream(generate())
+    stream.enable_buffering(buffer_size)
+    return stream
+
+
+def new_template_context(template_name, context):
+    """Get the current app, a template, and its context over a mapping.
+
+    Lookups go to the mapping itself, then to context processors, then to
+    template globals, as with Flask's render_template.
+    """
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_or_select_template(template_name)
+    processed = {}
+    app.update_template_context(processed)
+    layers = Layers([context, processed, template.globals])
+    return app, template, template.new_context(layers, shared=True)
+
+
+class Layers(Mapping):
+    "Read-only mapping over a list of mappings, the first to have a key wins."
+
+    def __init__(self, mappings):
+        self.mappings = mappings
+
+    def __getitem__(self, key):
+        for mapping in self.mappings:
+            if key in mapping:
+                return mapping[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        for mapping in self.mappings:
+            if key in mapping:
+                return True
+        return False
+
+    def __iter__(self):
+        seen = set()
+        for mapping in self.mappings:
+            for key in mapping:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+
+    def __len__(self):
+        return len(set(self))
 
 
 test_context = {'answer': 42, 'count': ['one', 'two'], 'title': 'Test Title',
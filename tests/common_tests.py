@@ -1,3 +1,12 @@
+import os
+import tempfile
+
+from flaskext.testing import TestCase
+
+from tango.factory.app import build_app
+from tango.factory.stash import shelve
+
+
 class ConnectorCommonTests(object):
     "Mixin for common tests in shelf connector implementations."
 
@@ -35,3 +44,38 @@ class ConnectorCommonTests(object):
         yetanother.update({7: 'seven'})
         self.connector.put('yet', 'another', yetanother)
         self.assertEqual(self.connector.get('site', 'another'), another)
+
+    def test_put_many(self):
+        items = [('site', 'one', {'count': 1}), ('site', 'two', {'count': 2}),
+                 ('site', 'one', {'count': 3})]
+        self.connector.put_many(iter(items))
+        self.assertEqual(self.connector.get('site', 'one'), {'count': 3})
+        self.assertEqual(self.connector.get('site', 'two'), {'count': 2})
+
+
+class ShelvedAppTestCase(TestCase):
+    "Base for tests of a site's app, shelved to a temporary sqlite file."
+
+    # Site whose app and stash to build.
+    site = 'testsite'
+
+    # Config to set on the app before it is shelved.
+    config = {}
+
+    # Whether to shelve pre-rendered responses too.
+    prerender = False
+
+    def create_app(self):
+        app = build_app(self.site, import_stash=True)
+        _, self.temp_filepath = tempfile.mkstemp(suffix='.db')
+        app.config['SQLITE_FILEPATH'] = self.temp_filepath
+        app.config.update(self.config)
+        return app
+
+    def setUp(self):
+        self.client = self.app.test_client()
+        shelve(self.app, prerender=self.prerender)
+
+    def tearDown(self):
+        self.app.close_connector()
+        os.unlink(self.temp_filepath)
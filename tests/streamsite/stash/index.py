@@ -0,0 +1,15 @@
+"""
+site: streamsite
+routes:
+ - stream:items.html: /items/
+ - template:items.html: /items.html
+ - template:pages.html: /items/pages/
+ - json: /items.json
+ - json-stream: /items/stream.json
+ - ndjson: /items.ndjson
+exports:
+ - title: Items
+ - items
+"""
+
+items = range(1000)
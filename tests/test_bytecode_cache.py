@@ -0,0 +1,66 @@
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+import jinja2.bccache
+
+from flaskext.testing import TestCase
+
+from tango.factory.app import build_app
+
+
+class BytecodeCacheTestCase(TestCase):
+
+    def create_app(self):
+        self.cache_dir = tempfile.mkdtemp()
+        return self.build_app()
+
+    def build_app(self):
+        app = build_app('simplesite', import_stash=True)
+        app.config['JINJA_BYTECODE_CACHE_DIR'] = self.cache_dir
+        return app
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_precompiled(self):
+        self.app.precompile_templates()
+        # A fresh app, as in a new worker, loads templates without compiling.
+        app = self.build_app()
+        def compile(*args, **kwargs):
+            raise AssertionError('Template compiled despite bytecode cache.')
+        app.jinja_env.compile = compile
+        with app.test_request_context():
+            for name in ('index.html', 'base.html', 'index.txt'):
+                app.jinja_env.get_template(name)
+
+    def test_readable(self):
+        self.app.precompile_templates()
+        for name in os.listdir(self.cache_dir):
+            mode = os.stat(os.path.join(self.cache_dir, name)).st_mode
+            self.assertEqual(mode & 0777, 0644)
+
+    def test_unreadable(self):
+        self.app.precompile_templates()
+        def open_if_exists(filename, mode='rb'):
+            raise IOError(errno.EACCES, 'Permission denied', filename)
+        original = jinja2.bccache.open_if_exists
+        jinja2.bccache.open_if_exists = open_if_exists
+        try:
+            # A cache file this worker may not read is compiled anew.
+            app = self.build_app()
+            with app.test_request_context():
+                app.jinja_env.get_template('index.html')
+        finally:
+            jinja2.bccache.open_if_exists = original
+
+    def test_no_templates(self):
+        app = build_app('simplest')
+        app.config['JINJA_BYTECODE_CACHE_DIR'] = self.cache_dir
+        self.assertEqual(app.precompile_templates(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import time
+import unittest
+
+from tango.factory.stash import shelve
+
+from common_tests import ShelvedAppTestCase
+
+
+class ConditionalTestCase(ShelvedAppTestCase):
+
+    config = {'SHELF_CONDITIONAL': True}
+
+    def refuse_reads(self):
+        def get(site, rule):
+            raise AssertionError('Context read for a conditional request.')
+        self.app.connector.get = get
+
+    def test_headers(self):
+        response = self.client.get('/')
+        self.assertTrue(response.headers.get('ETag'))
+        self.assertTrue(response.headers.get('Last-Modified'))
+
+    def test_if_none_match(self):
+        etag = self.client.get('/').headers['ETag']
+        response = self.client.get('/', headers={'If-None-Match': '"other"'})
+        self.assertEqual(response.status_code, 200)
+        self.refuse_reads()
+        response = self.client.get('/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, '')
+        self.assertEqual(response.headers['ETag'], etag)
+
+    def test_if_modified_since(self):
+        last_modified = self.client.get('/').headers['Last-Modified']
+        self.refuse_reads()
+        response = self.client.get(
+            '/', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+
+    def test_view_arguments(self):
+        etag = self.client.get('/argument/live/').headers['ETag']
+        response = self.client.get('/argument/live/',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_reshelve(self):
+        etag = self.client.get('/').headers['ETag']
+        shelve(self.app)
+        self.assertEqual(self.client.get('/').headers['ETag'], etag)
+        for route in self.app.routes:
+            if route.rule == '/':
+                route.context = dict(route.context, title='Changed')
+        shelve(self.app)
+        response = self.client.get('/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_template_changed(self):
+        response = self.client.get('/')
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        # The page extends base.html, which holds its title.
+        filepath = os.path.join(self.app.root_path, 'templates',
+                                'base.html')
+        with open(filepath) as fd:
+            source = fd.read()
+        mtime = os.stat(filepath).st_mtime
+        try:
+            with open(filepath, 'w') as fd:
+                fd.write(source.replace('<title>', '<title>Changed '))
+            # Edited after the shelf was written.
+            edited = time.time() + 10
+            os.utime(filepath, (edited, edited))
+            response = self.client.get('/', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue('Changed' in response.data)
+            self.assertNotEqual(response.headers['ETag'], etag)
+            response = self.client.get(
+                '/', headers={'If-Modified-Since': last_modified})
+            self.assertEqual(response.status_code, 200)
+        finally:
+            with open(filepath, 'w') as fd:
+                fd.write(source)
+            os.utime(filepath, (mtime, mtime))
+
+    def test_disabled(self):
+        self.app.config['SHELF_CONDITIONAL'] = False
+        response = self.client.get('/')
+        self.assertEqual(response.headers.get('ETag'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+
+from flask import abort
+
+import tango.app
+
+from common_tests import ShelvedAppTestCase
+
+
+class FastDispatchTestCase(ShelvedAppTestCase):
+
+    config = {'SHELF_CONDITIONAL': True}
+    prerender = True
+
+    def setUp(self):
+        ShelvedAppTestCase.setUp(self)
+        self.dispatched = []
+        self.app.before_request(lambda: self.dispatched.append(True))
+
+    def get_both(self, path, **kwargs):
+        "Get a path without then with fast dispatch, for both responses."
+        self.app.config['FAST_DISPATCH'] = False
+        slow = self.client.get(path, **kwargs)
+        self.app.config['FAST_DISPATCH'] = True
+        fast = self.client.get(path, **kwargs)
+        return slow, fast
+
+    def assertSameResponse(self, slow, fast):
+        self.assertEqual(fast.status_code, slow.status_code)
+        self.assertEqual(fast.data, slow.data)
+        self.assertEqual(sorted(fast.headers.items()),
+                         sorted(slow.headers.items()))
+
+    def test_same_responses(self):
+        for route in self.app.routes:
+            if not route.has_arguments:
+                self.assertSameResponse(*self.get_both(route.rule))
+        self.assertEqual(len(self.dispatched), len(self.app.fast_views))
+
+    def test_prerendered(self):
+        self.app.config['SHELF_PRERENDER'] = True
+        self.assertSameResponse(*self.get_both('/'))
+        self.assertSameResponse(
+            *self.get_both('/', headers={'Accept-Encoding': 'gzip'}))
+
+    def test_conditional(self):
+        etag = self.client.get('/').headers['ETag']
+        slow, fast = self.get_both('/', headers={'If-None-Match': etag})
+        self.assertEqual(fast.status_code, 304)
+        self.assertSameResponse(slow, fast)
+
+    def test_fall_through(self):
+        slow, fast = self.get_both('/argument/live/')
+        self.assertEqual(fast.data, 'argument: live')
+        self.assertSameResponse(slow, fast)
+        # Redirect to the rule with a trailing slash, and method checks.
+        self.assertSameResponse(*self.get_both('/argument/live'))
+        self.app.config['FAST_DISPATCH'] = True
+        self.assertEqual(self.client.post('/').status_code, 405)
+        self.assertEqual(self.client.get('/missing/').status_code, 404)
+
+    def test_error_handler(self):
+        @self.app.errorhandler(404)
+        def not_found(error):
+            return 'Handled', 404
+
+        def get(site, rule):
+            abort(404)
+        self.app.config['SHELF_PRERENDER'] = False
+        self.app.connector.get = self.app.connector.get_sized = get
+        slow, fast = self.get_both('/')
+        self.assertEqual(fast.status_code, 404)
+        self.assertEqual(fast.data, 'Handled')
+        self.assertSameResponse(slow, fast)
+
+    def test_request_finished(self):
+        finished = []
+        class Signal(object):
+            "Record responses sent, as blinker may not be installed."
+            def send(self, sender, response):
+                finished.append(response.status_code)
+        original = tango.app.request_finished
+        tango.app.request_finished = Signal()
+        try:
+            self.app.config['FAST_DISPATCH'] = True
+            self.client.get('/')
+        finally:
+            tango.app.request_finished = original
+        self.assertEqual(finished, [200])
+
+
+if __name__ == '__main__':
+    unittest.main()
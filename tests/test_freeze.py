@@ -0,0 +1,118 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tango.factory.freeze import MANIFEST, freeze
+from tango.factory.stash import shelve
+
+from common_tests import ShelvedAppTestCase
+
+
+class FreezeTestCase(ShelvedAppTestCase):
+
+    def create_app(self):
+        app = ShelvedAppTestCase.create_app(self)
+
+        @app.url_arguments('/argument/<argument>/')
+        def arguments():
+            return [{'argument': 'one'}, {'argument': 'two'}]
+
+        return app
+
+    def setUp(self):
+        ShelvedAppTestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        ShelvedAppTestCase.tearDown(self)
+        shutil.rmtree(self.directory)
+
+    def read(self, path):
+        with open(os.path.join(self.directory, path)) as fd:
+            return fd.read()
+
+    def test_files(self):
+        counts = freeze(self.app, self.directory, processes=1)
+        self.assertEqual(counts['failed'], 0)
+        self.assertTrue('<title>Tango</title>' in self.read('index.html'))
+        self.assertEqual(json.loads(self.read('index.json'))['project'],
+                         'tango')
+        self.assertTrue('multiple.py context' in self.read('route1.txt'))
+        self.assertEqual(self.read('argument/one/index.html'),
+                         'argument: one')
+        self.assertEqual(self.read('argument/two/index.html'),
+                         'argument: two')
+        manifest = json.loads(self.read(MANIFEST))
+        self.assertEqual(manifest['/']['path'], 'index.html')
+
+    def test_pool(self):
+        counts = freeze(self.app, self.directory, processes=2)
+        self.assertEqual(counts['failed'], 0)
+        manifest = json.loads(self.read(MANIFEST))
+        self.assertEqual(counts['written'], len(manifest))
+        self.assertEqual(self.read('argument/two/index.html'),
+                         'argument: two')
+
+    def test_incremental(self):
+        written = freeze(self.app, self.directory, processes=1)['written']
+        counts = freeze(self.app, self.directory, processes=1)
+        self.assertEqual(counts['skipped'], written)
+
+        # Change one context; only its route is rendered again.
+        for route in self.app.routes:
+            if route.rule == '/':
+                route.context = dict(route.context, title='Changed')
+        shelve(self.app)
+        counts = freeze(self.app, self.directory, processes=1)
+        self.assertEqual(counts['written'], 1)
+        self.assertEqual(counts['skipped'], written - 1)
+        self.assertTrue('<title>Changed</title>' in self.read('index.html'))
+
+        # Forced, routes are rendered, but unchanged files are not rewritten.
+        filepath = os.path.join(self.directory, 'index.html')
+        os.utime(filepath, (0, 0))
+        counts = freeze(self.app, self.directory, processes=1, force=True)
+        self.assertEqual(counts['unchanged'], written)
+        self.assertEqual(os.path.getmtime(filepath), 0)
+
+    def test_removed(self):
+        freeze(self.app, self.directory, processes=1)
+        self.app.url_argument_generators['/argument/<argument>/'] = \
+            lambda: [{'argument': 'one'}]
+        counts = freeze(self.app, self.directory, processes=1)
+        self.assertEqual(counts['removed'], 1)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.directory, 'argument/one/index.html')))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.directory, 'argument/two/index.html')))
+        manifest = json.loads(self.read(MANIFEST))
+        self.assertFalse('/argument/two/' in manifest)
+        self.assertTrue('/argument/one/' in manifest)
+        counts = freeze(self.app, self.directory, processes=1)
+        self.assertEqual(counts['removed'], 0)
+
+    def test_template_changed(self):
+        written = freeze(self.app, self.directory, processes=1)['written']
+        filepath = os.path.join(self.app.root_path, 'templates', 'base.html')
+        with open(filepath) as fd:
+            source = fd.read()
+        mtime = os.stat(filepath).st_mtime
+        try:
+            with open(filepath, 'w') as fd:
+                fd.write(source.replace('<title>', '<title>Changed '))
+            counts = freeze(self.app, self.directory, processes=1)
+        finally:
+            with open(filepath, 'w') as fd:
+                fd.write(source)
+            os.utime(filepath, (mtime, mtime))
+        # Routes rendered with the template are frozen again, others not.
+        self.assertTrue(counts['written'] > 0)
+        self.assertEqual(counts['written'] + counts['skipped'], written)
+        self.assertTrue('<title>Changed Tango</title>' in
+                        self.read('index.html'))
+
+
+if __name__ == '__main__':
+    unittest.main()
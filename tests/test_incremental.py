@@ -0,0 +1,176 @@
+from StringIO import StringIO
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from tango.factory.app import build_app
+from tango.factory.stash import shelve
+
+
+MODULES = {
+    'one.py': '''"""
+site: incsite
+routes:
+ - /one.txt
+exports:
+ - value
+depends:
+ - data.txt
+"""
+
+value = open(__file__[:__file__.rindex('/')] + '/data.txt').read()
+''',
+    'two.py': '''"""
+site: incsite
+routes:
+ - /two.txt
+exports:
+ - value: two
+"""
+''',
+    'first.py': '''"""
+site: incsite
+routes:
+ - /shared.txt
+exports:
+ - first: 1
+"""
+''',
+    'second.py': '''"""
+site: incsite
+routes:
+ - /shared.txt
+exports:
+ - second: 2
+"""
+''',
+}
+
+
+class IncrementalShelveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.stash = os.path.join(self.path, 'incsite', 'stash')
+        os.makedirs(self.stash)
+        open(os.path.join(self.path, 'incsite', '__init__.py'), 'w').close()
+        self.filepath = os.path.join(self.path, 'tango.db')
+        self.write('../config.py',
+                   'SQLITE_FILEPATH = {0!r}\n'.format(self.filepath))
+        self.write('__init__.py', '')
+        self.write('data.txt', 'one')
+        for name, source in MODULES.items():
+            self.write(name, source)
+        sys.path.insert(0, self.path)
+        self.dont_write_bytecode = sys.dont_write_bytecode
+        sys.dont_write_bytecode = True
+
+    def tearDown(self):
+        sys.dont_write_bytecode = self.dont_write_bytecode
+        sys.path.remove(self.path)
+        self.forget_modules()
+        shutil.rmtree(self.path)
+
+    def write(self, name, content):
+        with open(os.path.join(self.stash, name), 'w') as fd:
+            fd.write(content)
+
+    def forget_modules(self):
+        for name in list(sys.modules):
+            if name == 'incsite' or name.startswith('incsite.'):
+                del sys.modules[name]
+
+    def shelve(self, **options):
+        "Shelve the site as a new process would, returning modules loaded."
+        self.forget_modules()
+        logfile = StringIO()
+        shelve('incsite', logfile=logfile, **options)
+        lines = logfile.getvalue().splitlines()
+        loaded = [line.split(' ')[1] for line in lines
+                  if line.startswith('Loading ')]
+        return loaded, lines[-1]
+
+    def get(self, rule):
+        app = build_app('incsite')
+        try:
+            return dict(app.connector.get('incsite', rule))
+        finally:
+            app.close_connector()
+
+    def test_unchanged(self):
+        loaded, report = self.shelve()
+        self.assertEqual(len(loaded), 4)
+        self.assertEqual(report, 'Rebuilt 4 modules, skipped 0 unchanged.')
+        loaded, report = self.shelve()
+        self.assertEqual(loaded, [])
+        self.assertEqual(report, 'Rebuilt 0 modules, skipped 4 unchanged.')
+        self.assertEqual(self.get('/one.txt'), {'value': 'one'})
+
+    def test_source_changed(self):
+        self.shelve()
+        self.write('two.py', MODULES['two.py'].replace(': two', ': deux'))
+        loaded, report = self.shelve()
+        self.assertEqual(loaded, ['incsite.stash.two'])
+        self.assertEqual(report, 'Rebuilt 1 modules, skipped 3 unchanged.')
+        self.assertEqual(self.get('/two.txt'), {'value': 'deux'})
+
+    def test_depends_changed(self):
+        self.shelve()
+        self.write('data.txt', 'uno')
+        loaded, _ = self.shelve()
+        self.assertEqual(loaded, ['incsite.stash.one'])
+        self.assertEqual(self.get('/one.txt'), {'value': 'uno'})
+
+    def test_merged_route(self):
+        self.shelve()
+        self.write('second.py', MODULES['second.py'].replace('2', '3'))
+        loaded, _ = self.shelve()
+        # The route shared with first.py needs its context to merge.
+        self.assertEqual(loaded, ['incsite.stash.first',
+                                  'incsite.stash.second'])
+        self.assertEqual(self.get('/shared.txt'), {'first': 1, 'second': 3})
+
+    def test_missing_route(self):
+        self.shelve()
+        app = build_app('incsite')
+        app.connector.prune('incsite', ['/one.txt', '/shared.txt'])
+        app.close_connector()
+        loaded, _ = self.shelve()
+        self.assertEqual(loaded, ['incsite.stash.two'])
+        self.assertEqual(self.get('/two.txt'), {'value': 'two'})
+
+    def test_force(self):
+        self.shelve()
+        loaded, report = self.shelve(force=True)
+        self.assertEqual(len(loaded), 4)
+        self.assertEqual(report, 'Rebuilt 4 modules, skipped 0 unchanged.')
+
+    def test_prerender_skipped(self):
+        self.shelve()
+        loaded, _ = self.shelve(prerender=True)
+        self.assertEqual(loaded, [])
+        # Responses are rendered from the shelf, as templates may change.
+        app = build_app('incsite')
+        try:
+            body, mimetype = app.connector.get_response('incsite',
+                                                        '/one.txt')
+        finally:
+            app.close_connector()
+        self.assertEqual(body, "{'value': 'one'}")
+        self.assertEqual(mimetype, 'text/plain')
+
+    def test_app_object(self):
+        self.shelve()
+        # An app's contexts may not be its stash's, so it is shelved whole.
+        app = build_app('incsite', import_stash=True)
+        app.routes[0].context = {'value': 'changed'}
+        shelve(app)
+        app.close_connector()
+        loaded, _ = self.shelve()
+        self.assertEqual(len(loaded), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
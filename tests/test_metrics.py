@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tango.metrics import collect
+
+from common_tests import ShelvedAppTestCase
+
+
+class MetricsTestCase(ShelvedAppTestCase):
+
+    config = {'SHELF_CACHE': True, 'METRICS_PATH': '/metrics'}
+
+    def create_app(self):
+        app = ShelvedAppTestCase.create_app(self)
+        # As build_app does when METRICS_PATH is set in a site's config.
+        app.add_url_rule('/metrics', 'metrics', app.metrics_view)
+        return app
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        samples = {}
+        for line in response.data.splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_requests(self):
+        for x in range(3):
+            self.client.get('/')
+        samples = self.scrape()
+        self.assertEqual(samples['tango_request_seconds_count{route="/"}'], 3)
+        self.assertEqual(
+            samples['tango_request_seconds_bucket{route="/",le="+Inf"}'], 3)
+        self.assertEqual(samples['tango_phase_seconds_count'
+                                 '{route="/",phase="render"}'], 3)
+        self.assertEqual(samples['tango_context_bytes_count{route="/"}'], 3)
+        self.assertTrue(samples['tango_context_bytes_sum{route="/"}'] > 0)
+
+    def test_cache(self):
+        for x in range(3):
+            self.client.get('/')
+        samples = self.scrape()
+        self.assertEqual(samples['tango_shelf_cache_misses_total'], 1)
+        self.assertEqual(samples['tango_shelf_cache_hits_total'], 2)
+        self.assertEqual(samples['tango_shelf_cache_entries'], 1)
+
+    def test_templates_compiled(self):
+        self.client.get('/')
+        self.client.get('/')
+        compiled = self.scrape()['tango_templates_compiled_total']
+        self.assertTrue(compiled > 0)
+        self.client.get('/')
+        self.assertEqual(self.scrape()['tango_templates_compiled_total'],
+                         compiled)
+
+
+class ProcessMetricsTestCase(MetricsTestCase):
+
+    def create_app(self):
+        app = MetricsTestCase.create_app(self)
+        self.directory = tempfile.mkdtemp()
+        app.config['METRICS_DIR'] = self.directory
+        return app
+
+    def tearDown(self):
+        MetricsTestCase.tearDown(self)
+        shutil.rmtree(self.directory)
+
+    def dump_as(self, pid):
+        snapshot = collect(self.app)
+        filepath = os.path.join(self.directory, '{0}.json'.format(pid))
+        with open(filepath, 'w') as fd:
+            json.dump(snapshot, fd)
+        return filepath
+
+    def test_merged(self):
+        self.client.get('/')
+        # Another worker, as the parent process stands in for one.
+        self.dump_as(os.getppid())
+        self.client.get('/')
+        samples = self.scrape()
+        self.assertEqual(samples['tango_request_seconds_count{route="/"}'], 3)
+
+    def test_dead_process(self):
+        self.client.get('/')
+        # Pids are at most 2**22 on Linux.
+        filepath = self.dump_as(2 ** 22 + 1)
+        samples = self.scrape()
+        self.assertEqual(samples['tango_request_seconds_count{route="/"}'], 1)
+        self.assertFalse(os.path.exists(filepath))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+from tango.factory.stash import shelve
+
+from common_tests import ShelvedAppTestCase
+
+
+class PaginateTestCase(ShelvedAppTestCase):
+
+    site = 'streamsite'
+    config = {'SHELF_CHUNK_ITEMS': 100}
+
+    def items(self, response):
+        return [int(line.strip()[4:-5]) for line in response.data.splitlines()
+                if line.strip().startswith('<li>')]
+
+    def test_first_page(self):
+        response = self.client.get('/items/pages/')
+        self.assertEqual(self.items(response), range(50))
+        self.assertTrue('Page 1 of 20' in response.data)
+
+    def test_page(self):
+        response = self.client.get('/items/pages/?page=3')
+        self.assertEqual(self.items(response), range(100, 150))
+        self.assertTrue('Page 3 of 20' in response.data)
+
+    def test_offset_limit(self):
+        response = self.client.get('/items/pages/?offset=190&limit=20')
+        self.assertEqual(self.items(response), range(190, 210))
+        response = self.client.get('/items/pages/?offset=990&limit=20')
+        self.assertEqual(self.items(response), range(990, 1000))
+
+    def test_max_page_size(self):
+        self.app.config['MAX_PAGE_SIZE'] = 10
+        response = self.client.get('/items/pages/?limit=500')
+        self.assertEqual(self.items(response), range(10))
+
+    def test_invalid(self):
+        response = self.client.get('/items/pages/?page=spam&limit=-1')
+        self.assertEqual(self.items(response), range(50))
+
+    def test_reads_page_chunks(self):
+        context = self.app.connector.get('streamsite', '/items/pages/')
+        with self.app.test_request_context('/items/pages/?page=3'):
+            self.app.jinja_env.filters['paginate'](context['items'])
+        self.assertEqual(sorted(context['items'].chunks), [1])
+
+    def test_prerendered(self):
+        shelve(self.app, prerender=True)
+        response = self.client.get('/items/pages/')
+        self.assertEqual(self.items(response), range(50))
+        response = self.client.get('/items/pages/?page=2')
+        self.assertEqual(self.items(response), range(50, 100))
+
+
+if __name__ == '__main__':
+    unittest.main()
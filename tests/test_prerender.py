@@ -0,0 +1,128 @@
+from StringIO import StringIO
+import gzip
+import json
+import unittest
+
+from tango.factory.stash import shelve
+
+from common_tests import ShelvedAppTestCase
+
+
+class PrerenderTestCase(ShelvedAppTestCase):
+
+    config = {'SHELF_PRERENDER': True, 'SHELF_CONDITIONAL': True}
+    prerender = True
+
+    def test_prerendered(self):
+        body, mimetype = self.app.connector.get_response('test', '/index.json')
+        self.assertEqual(json.loads(body)['project'], 'tango')
+        self.assertEqual(mimetype, 'application/json')
+
+        # Views serve stored bodies, without rendering the context.
+        self.app.connector.put_responses([('test', '/index.json',
+                                           '{"stored": true}',
+                                           'application/json', None)])
+        response = self.client.get('/index.json')
+        self.assertEqual(response.data, '{"stored": true}')
+        self.assertEqual(response.mimetype, 'application/json')
+
+    def test_template(self):
+        body, mimetype = self.app.connector.get_response('test', '/')
+        self.assertTrue('<title>Tango</title>' in body)
+        self.assertEqual(mimetype, 'text/html')
+        self.assertEqual(self.client.get('/').data, body)
+
+    def test_template_version(self):
+        writer = self.app.get_writer('template:index.html')
+        checksum, _ = self.app.template_version(writer)
+        self.assertEqual(self.app.connector.get_response('test', '/', 'old'),
+                         None)
+        # A response rendered from since edited templates is rendered live,
+        # so that the body matches the tag of the current templates.
+        self.app.connector.put_responses([('test', '/', 'Stale', 'text/html',
+                                           'old')])
+        response = self.client.get('/')
+        self.assertTrue('<title>Tango</title>' in response.data)
+        etag = response.headers['ETag']
+        self.app.connector.put_responses([('test', '/', 'Current',
+                                           'text/html', checksum)])
+        response = self.client.get('/')
+        self.assertEqual(response.data, 'Current')
+        self.assertEqual(response.headers['ETag'], etag)
+
+    def test_gzip(self):
+        body, mimetype = self.app.connector.get_response('test', '/')
+        compressed, _ = self.app.connector.get_gzip_response('test', '/')
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(compressed)).read(),
+                         body)
+
+        response = self.client.get('/', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.data, compressed)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(response.mimetype, 'text/html')
+        etag = response.headers['ETag']
+        self.assertTrue(etag.endswith('-gzip"'))
+        response = self.client.get('/', headers={'Accept-Encoding': 'gzip',
+                                                 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get('/',
+                                   headers={'Accept-Encoding': 'gzip;q=0'})
+        self.assertEqual(response.data, body)
+        self.assertEqual(response.headers.get('Content-Encoding'), None)
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_gzip_disabled(self):
+        self.app.config['SHELF_GZIP'] = False
+        shelve(self.app, prerender=True)
+        self.assertEqual(self.app.connector.get_gzip_response('test', '/'),
+                         None)
+        response = self.client.get('/', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers.get('Content-Encoding'), None)
+        self.assertEqual(response.headers.get('Vary'), None)
+
+    def test_view_arguments(self):
+        self.assertEqual(self.app.connector.get_response(
+            'test', '/argument/<argument>/'), None)
+        response = self.client.get('/argument/live/')
+        self.assertEqual(response.data, 'argument: live')
+
+    def test_not_prerendered(self):
+        self.app.config['SHELF_PRERENDER'] = False
+        self.app.connector.put_responses([('test', '/index.json',
+                                           '{"stored": true}',
+                                           'application/json', None)])
+        response = self.client.get('/index.json')
+        self.assertEqual(json.loads(response.data)['project'], 'tango')
+
+    def test_reshelve_unchanged(self):
+        generation = self.app.connector.generation()
+        shelve(self.app, prerender=True)
+        self.assertEqual(self.app.connector.generation(), generation)
+
+    def test_stale_response(self):
+        # Shelving contexts without rendering drops previous responses.
+        shelve(self.app, prerender=False)
+        self.assertEqual(self.app.connector.get_response('test', '/'), None)
+        self.assertTrue('<title>Tango</title>' in self.client.get('/').data)
+
+    def test_prerender_json(self):
+        self.app.config['SHELF_PRERENDER'] = False
+        self.app.config['SHELF_PRERENDER_JSON'] = True
+        shelve(self.app)
+        self.assertEqual(self.app.connector.get_response('test', '/'), None)
+        body, mimetype = self.app.connector.get_response('test', '/index.json')
+        self.assertEqual(mimetype, 'application/json')
+        self.assertEqual(self.client.get('/index.json').data, body)
+
+        self.app.connector.put_responses([('test', '/index.json',
+                                           '{"stored": true}',
+                                           'application/json', None)])
+        response = self.client.get('/index.json')
+        self.assertEqual(response.data, '{"stored": true}')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,7 @@ import unittest
 from flaskext.testing import TestCase
 
 from tango.app import Tango
+from tango.factory.app import build_app
 from tango.shelf import BaseConnector
 
 
@@ -28,6 +29,28 @@ class BaseConnectorTestCase(TestCase):
     def test_put_notimplemented(self):
         self.assertRaises(NotImplementedError, self.connector.put, '', '', {})
 
+    def test_put_many_fallback(self):
+        puts = []
+        self.connector.put = lambda *args: puts.append(args)
+        self.connector.put_many([('site', 'one', {}), ('site', 'two', {})])
+        self.assertEqual(puts, [('site', 'one', {}), ('site', 'two', {})])
+
+    def test_minimal_connector(self):
+        class DictConnector(object):
+            "Connector with only get and put, not derived from BaseConnector."
+            def __init__(self, app):
+                self.contexts = {}
+            def get(self, site, rule):
+                return self.contexts.get((site, rule), {})
+            def put(self, site, rule, context):
+                self.contexts[(site, rule)] = context
+        app = build_app('testsite')
+        app.config['SHELF_CONNECTOR_CLASS'] = DictConnector
+        app.connector.put('test', '/', {'title': 'Minimal'})
+        response = app.test_client().get('/')
+        self.assertTrue('<title>Minimal</title>' in response.data)
+        app.close_connector()
+
 
 if __name__ == '__main__':
     unittest.main()
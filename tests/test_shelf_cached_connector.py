@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+
+from flaskext.testing import TestCase
+
+from tango.app import Tango
+from tango.shelf import CachedConnector, SqliteConnector
+
+from common_tests import ConnectorCommonTests
+
+
+class CachedConnectorTestCase(TestCase, ConnectorCommonTests):
+
+    def create_app(self):
+        return Tango(__name__)
+
+    def setUp(self):
+        _, self.temp_filepath = tempfile.mkstemp(suffix='.db')
+        self.app.config['SQLITE_FILEPATH'] = self.temp_filepath
+        self.app.config['SHELF_CACHE_ENTRIES'] = 2
+        self.connector = CachedConnector(SqliteConnector(self.app))
+
+    def tearDown(self):
+        self.connector.close()
+        os.unlink(self.temp_filepath)
+
+    def test_hit(self):
+        self.connector.put('site', 'rule', {'spam': 'eggs'})
+        first = self.connector.get('site', 'rule')
+        second = self.connector.get('site', 'rule')
+        self.assertTrue(first is second)
+        stats = self.connector.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['entries'], 1)
+        self.assertTrue(stats['bytes'] > 0)
+
+    def test_eviction_by_entries(self):
+        for rule in ('one', 'two', 'three'):
+            self.connector.get('site', rule)
+        stats = self.connector.stats()
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['evictions'], 1)
+
+    def test_eviction_by_bytes(self):
+        self.connector.put('site', 'big', {'sequence': range(1000)})
+        self.connector.cache.max_bytes = 100
+        self.connector.get('site', 'big')
+        self.assertEqual(self.connector.stats()['entries'], 0)
+
+    def test_shared_context(self):
+        context = {'spam': 'eggs'}
+        self.connector.put_many([('site', 'one', context),
+                                 ('site', 'two', context)])
+        self.assertTrue(self.connector.get('site', 'one') is
+                        self.connector.get('site', 'two'))
+        self.assertEqual(self.connector.stats()['entries'], 2)
+
+    def test_invalidation_by_shelve(self):
+        self.connector.put('site', 'rule', {'spam': 'eggs'})
+        self.connector.get('site', 'rule')
+        # Shelve through another connector, as another process would.
+        other = SqliteConnector(self.app)
+        other.put('site', 'rule', {'spam': 'ham'})
+        other.close()
+        self.assertEqual(self.connector.get('site', 'rule'), {'spam': 'ham'})
+        self.assertEqual(self.connector.stats()['invalidations'], 1)
+
+    def test_app_connector(self):
+        self.app.config['SHELF_CACHE'] = True
+        self.app.close_connector()
+        self.assertTrue(isinstance(self.app.connector, CachedConnector))
+        self.app.close_connector()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import os
+import tempfile
+import unittest
+
+from flaskext.testing import TestCase
+
+from tango.app import Tango
+from tango.factory.app import build_app
+from tango.factory.stash import pack, shelve
+from tango.shelf import MmapConnector, SqliteConnector
+
+
+class MmapConnectorTestCase(TestCase):
+
+    def create_app(self):
+        return Tango(__name__)
+
+    def setUp(self):
+        _, self.temp_filepath = tempfile.mkstemp(suffix='.shelf')
+        self.app.config['SHELF_FILEPATH'] = self.temp_filepath
+        self.connector = MmapConnector(self.app)
+
+    def tearDown(self):
+        self.connector.close()
+        os.unlink(self.temp_filepath)
+
+    def test_empty(self):
+        self.connector.build([])
+        self.assertEqual(self.connector.get('site', 'rule'), {})
+
+    def test_many(self):
+        items = [('site', '/{0}/'.format(x), {'x': x}) for x in range(1000)]
+        self.connector.build(iter(items))
+        for site, rule, context in items:
+            self.assertEqual(self.connector.get(site, rule), context)
+        self.assertEqual(self.connector.get('site', '/1000/'), {})
+        self.assertEqual(self.connector.get('other', '/1/'), {})
+
+    def test_last_wins(self):
+        self.connector.build([('site', 'rule', {'spam': 'eggs'}),
+                              ('site', 'rule', {'spam': 'ham'})])
+        self.assertEqual(self.connector.get('site', 'rule'), {'spam': 'ham'})
+
+    def test_shared_context(self):
+        context = {'sequence': range(1000)}
+        self.connector.build([('site', 'one', context)])
+        size = os.path.getsize(self.temp_filepath)
+        self.connector.build([('site', 'one', context),
+                              ('site', 'two', context),
+                              ('site', 'three', dict(context))])
+        # Each route adds a record, but the context is written only once.
+        self.assertTrue(os.path.getsize(self.temp_filepath) < size + 1000)
+        for rule in ('one', 'two', 'three'):
+            self.assertEqual(self.connector.get('site', rule), context)
+
+    def test_readable(self):
+        # Workers may run as another user than the one who packs the shelf.
+        self.connector.build([('site', 'rule', {'spam': 'eggs'})])
+        self.assertEqual(os.stat(self.temp_filepath).st_mode & 0777, 0644)
+
+    def test_unicode(self):
+        self.connector.build([(u'site', u'/caf\xe9/', {'title': u'Caf\xe9'})])
+        self.assertEqual(self.connector.get(u'site', u'/caf\xe9/'),
+                         {'title': u'Caf\xe9'})
+
+    def test_read_only(self):
+        self.assertTrue(self.connector.read_only)
+        self.assertRaises(NotImplementedError, self.connector.put,
+                          'site', 'rule', {})
+        self.assertRaises(NotImplementedError, self.connector.put_many,
+                          [('site', 'rule', {})])
+
+    def test_codec(self):
+        self.app.config['SHELF_CODEC'] = 'zlib+json'
+        MmapConnector(self.app).build([('site', 'rule', {'tuple': (1, 2)})])
+        self.assertEqual(self.connector.get('site', 'rule'), {'tuple': [1, 2]})
+
+    def test_not_a_shelf(self):
+        with open(self.temp_filepath, 'wb') as fd:
+            fd.write('Not a shelf file.')
+        self.assertRaises(ValueError, self.connector.get, 'site', 'rule')
+
+    def test_rebuild(self):
+        self.connector.build([('site', 'rule', {'spam': 'eggs'})])
+        self.assertEqual(self.connector.get('site', 'rule'), {'spam': 'eggs'})
+        # The mapped file is replaced, not modified, by a build.
+        MmapConnector(self.app).build([('site', 'rule', {'spam': 'ham'})])
+        self.assertEqual(self.connector.get('site', 'rule'), {'spam': 'eggs'})
+        self.connector.close()
+        self.assertEqual(self.connector.get('site', 'rule'), {'spam': 'ham'})
+
+
+class MmapShelveTestCase(TestCase):
+
+    def create_app(self):
+        app = build_app('testsite', import_stash=True)
+        _, self.temp_filepath = tempfile.mkstemp(suffix='.shelf')
+        _, self.temp_db_filepath = tempfile.mkstemp(suffix='.db')
+        app.config['SHELF_FILEPATH'] = self.temp_filepath
+        app.config['SQLITE_FILEPATH'] = self.temp_db_filepath
+        return app
+
+    def tearDown(self):
+        self.app.close_connector()
+        os.unlink(self.temp_filepath)
+        os.unlink(self.temp_db_filepath)
+
+    def test_shelve(self):
+        self.app.config['SHELF_CONNECTOR_CLASS'] = MmapConnector
+        shelve(self.app)
+        response = self.app.test_client().get('/route1.txt')
+        self.assertTrue('multiple.py context' in response.data)
+
+    def test_pack(self):
+        shelve(self.app)
+        self.assertEqual(pack(self.app), len(self.app.routes))
+        source = SqliteConnector(self.app)
+        packed = MmapConnector(self.app)
+        for route in self.app.routes:
+            self.assertEqual(packed.get(route.site, route.rule),
+                             source.get(route.site, route.rule))
+        source.close()
+        packed.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,38 @@
+import cPickle as pickle
+import gc
 import os
+import sqlite3
 import tempfile
+import threading
 import unittest
+import weakref
 
 from flaskext.testing import TestCase
 
 from tango.app import Tango
-from tango.shelf import SqliteConnector
+from tango.errors import StaleContextError
+from tango.factory.app import build_app
+from tango.shelf import ChunkedList, SqliteConnector
+from tango.writers import TemplateWriter
 
 from common_tests import ConnectorCommonTests
 
 
+class Barrier(object):
+    "Block threads until all of a number of them wait."
+
+    def __init__(self, count):
+        self.count = count
+        self.condition = threading.Condition()
+
+    def wait(self):
+        with self.condition:
+            self.count -= 1
+            self.condition.notify_all()
+            while self.count > 0:
+                self.condition.wait()
+
+
 class SqliteConnectorTestCase(TestCase, ConnectorCommonTests):
 
     def create_app(self):
@@ -21,6 +44,7 @@ class SqliteConnectorTestCase(TestCase, ConnectorCommonTests):
         self.connector = SqliteConnector(self.app)
 
     def tearDown(self):
+        self.connector.close()
         self.remove_tempfile()
 
     def remove_tempfile(self):
@@ -36,10 +60,369 @@ class SqliteConnectorTestCase(TestCase, ConnectorCommonTests):
         self.remove_tempfile()
         self.smoke_test('Test non-existent file.')
 
+        # Drop pooled connections, which would keep the removed file open.
+        self.connector.close()
         self.remove_tempfile()
         open(self.temp_filepath, 'w').close()
         self.smoke_test('Test empty file.')
 
+    def test_connection_reuse(self):
+        db = self.connector.connect()
+        self.connector.put('site', 'rule', {'spam': 'eggs'})
+        self.connector.get('site', 'rule')
+        self.assertTrue(self.connector.connect() is db)
+        self.assertEqual(self.connector.connections, [db])
+
+    def test_connection_per_thread(self):
+        db = self.connector.connect()
+        other = []
+        thread = threading.Thread(
+            target=lambda: other.append(self.connector.connect()))
+        thread.start()
+        thread.join()
+        self.assertFalse(other[0] is db)
+        self.assertEqual(len(self.connector.connections), 2)
+
+    def test_release(self):
+        db = self.connector.connect()
+        self.connector.release()
+        self.assertEqual(self.connector.idle, [db])
+        # Another thread checks out the released connection.
+        other = []
+        def request():
+            other.append(self.connector.connect())
+            self.connector.release()
+        thread = threading.Thread(target=request)
+        thread.start()
+        thread.join()
+        self.assertTrue(other[0] is db)
+        self.assertEqual(self.connector.connections, [db])
+        self.smoke_test('Test reconnect after release.')
+
+    def test_pool_size(self):
+        self.connector.pool_size = 1
+        connections = []
+        def request():
+            connections.append(self.connector.connect())
+            # Hold the connection until every thread has checked out one.
+            barrier.wait()
+            self.connector.release()
+        barrier = Barrier(3)
+        threads = [threading.Thread(target=request) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(connections)), 3)
+        # Connections beyond the pool size are closed on release.
+        self.assertEqual(len(self.connector.connections), 1)
+        self.assertEqual(self.connector.idle, self.connector.connections)
+
+    def test_release_after_close(self):
+        self.connector.connect()
+        self.connector.close()
+        self.connector.release()
+        self.assertEqual(self.connector.idle, [])
+
+    def test_initialize_once(self):
+        self.connector.connect()
+        self.assertTrue(self.connector.initialized)
+        # Drop the schema behind the connector's back; it must not recheck.
+        self.connector.connect().execute('DROP TABLE exports;')
+        self.assertRaises(Exception, self.connector.get, 'site', 'rule')
+
+    def test_close(self):
+        db = self.connector.connect()
+        self.connector.close()
+        self.assertEqual(self.connector.connections, [])
+        self.assertFalse(self.connector.initialized)
+        self.assertFalse(self.connector.connect() is db)
+        self.smoke_test('Test reconnect after close.')
+
+    def test_forked_pool(self):
+        db = self.connector.connect()
+        # Pretend this connector was created in a parent process.
+        self.connector.pid = -1
+        self.assertFalse(self.connector.connect() is db)
+        self.assertEqual(len(self.connector.connections), 1)
+        db.close()
+
+    def test_upsert(self):
+        self.connector.put('site', 'rule', {'spam': 'eggs'})
+        self.connector.put('site', 'rule', {'spam': 'ham'})
+        db = self.connector.connect()
+        count = db.execute("SELECT COUNT(*) FROM routes "
+                           "WHERE site = 'site' AND rule = 'rule';")
+        self.assertEqual(count.fetchone()[0], 1)
+        count = db.execute("SELECT COUNT(*) FROM exports WHERE context = "
+                           "(SELECT context FROM routes "
+                           "WHERE site = 'site' AND rule = 'rule');")
+        self.assertEqual(count.fetchone()[0], 1)
+
+    def test_schema_version(self):
+        db = self.connector.connect()
+        version = db.execute('PRAGMA user_version;').fetchone()[0]
+        self.assertEqual(version, SqliteConnector.schema_version)
+
+    def test_migrate_unversioned(self):
+        # Build a shelf as written before schema versioning, with duplicates.
+        db = sqlite3.connect(self.temp_filepath)
+        db.execute('CREATE TABLE contexts ('
+                   'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                   'site TEXT NOT NULL, rule TEXT NOT NULL, '
+                   'context BLOB NOT NULL);')
+        for value in ('old', 'new'):
+            db.execute('INSERT INTO contexts (site, rule, context) '
+                       'VALUES (?, ?, ?);',
+                       ('site', 'rule', pickle.dumps({'spam': value})))
+        db.execute('INSERT INTO contexts (site, rule, context) '
+                   'VALUES (?, ?, ?);',
+                   ('site', 'another', pickle.dumps({'foo': 'bar'})))
+        db.commit()
+        db.close()
+
+        self.assertEqual(self.connector.get('site', 'rule'), {'spam': 'new'})
+        self.assertEqual(self.connector.get('site', 'another'), {'foo': 'bar'})
+        db = self.connector.connect()
+        count = db.execute('SELECT COUNT(*) FROM routes;').fetchone()[0]
+        self.assertEqual(count, 2)
+        self.test_schema_version()
+        self.test_upsert()
+
+    def test_mixed_codecs(self):
+        self.connector.put('site', 'pickled', {'tuple': (1, 2)})
+        self.app.config['SHELF_CODEC'] = 'zlib+json'
+        other = SqliteConnector(self.app)
+        other.put('site', 'json', {'tuple': (1, 2)})
+        for connector in (self.connector, other):
+            self.assertEqual(connector.get('site', 'pickled'),
+                             {'tuple': (1, 2)})
+            self.assertEqual(connector.get('site', 'json'), {'tuple': [1, 2]})
+        other.close()
+
+    def test_shared_context(self):
+        context = {'spam': 'eggs', 'foo': 'bar'}
+        self.connector.put_many([('site', 'one', context),
+                                 ('site', 'two', context),
+                                 ('site', 'three', dict(context))])
+        db = self.connector.connect()
+        self.assertEqual(
+            db.execute('SELECT COUNT(*) FROM contexts;').fetchone()[0], 1)
+        self.assertEqual(
+            db.execute('SELECT COUNT(*) FROM exports;').fetchone()[0], 2)
+        for rule in ('one', 'two', 'three'):
+            self.assertEqual(self.connector.get('site', rule), context)
+
+        # Replacing the context of every route which shares it drops it.
+        self.connector.put('site', 'one', {'spam': 'ham'})
+        self.assertEqual(self.connector.get('site', 'two'), context)
+        self.connector.put_many([('site', 'two', {}), ('site', 'three', {})])
+        self.assertEqual(
+            db.execute('SELECT COUNT(*) FROM contexts;').fetchone()[0], 2)
+        self.assertEqual(
+            db.execute('SELECT COUNT(*) FROM exports;').fetchone()[0], 1)
+        self.assertEqual(self.connector.get('site', 'one'), {'spam': 'ham'})
+        self.assertEqual(self.connector.get('site', 'two'), {})
+
+    def test_unchanged(self):
+        self.connector.put('site', 'rule', {'spam': 'eggs'})
+        generation = self.connector.generation()
+        self.connector.put('site', 'rule', {'spam': 'eggs'})
+        self.assertEqual(self.connector.generation(), generation)
+        self.connector.put('site', 'rule', {'spam': 'ham'})
+        self.assertNotEqual(self.connector.generation(), generation)
+
+    def test_unchanged_response(self):
+        self.connector.put('site', 'rule', {'spam': 'eggs'})
+        response = ('site', 'rule', 'Eggs ' * 100, 'text/plain', None)
+        self.connector.put_responses([response])
+        generation = self.connector.generation()
+        # Shelving the same context and response again changes nothing.
+        self.connector.put('site', 'rule', {'spam': 'eggs'})
+        self.connector.put_responses([response])
+        self.assertEqual(self.connector.generation(), generation)
+        self.assertEqual(self.connector.get_response('site', 'rule'),
+                         ('Eggs ' * 100, 'text/plain'))
+        self.connector.put_responses([('site', 'rule', 'Ham', 'text/plain',
+                                       None)])
+        self.assertNotEqual(self.connector.generation(), generation)
+        # A new context drops the response rendered from the old one.
+        self.connector.put('site', 'rule', {'spam': 'ham'})
+        self.assertEqual(self.connector.get_response('site', 'rule'), None)
+
+    def test_response_version(self):
+        self.connector.put_responses([('site', 'rule', 'Eggs', 'text/html',
+                                       'v1')])
+        self.assertEqual(self.connector.get_response('site', 'rule', 'v1'),
+                         ('Eggs', 'text/html'))
+        self.assertEqual(self.connector.get_response('site', 'rule'),
+                         ('Eggs', 'text/html'))
+        self.assertEqual(self.connector.get_response('site', 'rule', 'v2'),
+                         None)
+        generation = self.connector.generation()
+        # The same body rendered from other templates is a change.
+        self.connector.put_responses([('site', 'rule', 'Eggs', 'text/html',
+                                       'v2')])
+        self.assertNotEqual(self.connector.generation(), generation)
+        self.assertEqual(self.connector.get_response('site', 'rule', 'v2'),
+                         ('Eggs', 'text/html'))
+
+    def test_delete_responses(self):
+        self.connector.put_responses([('site', 'rule', 'Eggs', 'text/plain',
+                                       None)])
+        generation = self.connector.generation()
+        self.connector.delete_responses([('site', 'other')])
+        self.assertEqual(self.connector.generation(), generation)
+        self.connector.delete_responses([('site', 'rule')])
+        self.assertNotEqual(self.connector.generation(), generation)
+        self.assertEqual(self.connector.get_response('site', 'rule'), None)
+
+    def test_prune(self):
+        self.connector.put_many([('site', 'keep', {'spam': 'eggs'}),
+                                 ('site', 'dead', {'spam': 'ham'}),
+                                 ('other', 'dead', {'spam': 'ham'})])
+        self.connector.put_responses([('site', 'dead', 'Dead', 'text/plain',
+                                       None)])
+        generation = self.connector.generation()
+        self.assertEqual(self.connector.prune('site', ['keep']), 1)
+        self.assertNotEqual(self.connector.generation(), generation)
+        self.assertEqual(self.connector.get('site', 'keep'), {'spam': 'eggs'})
+        self.assertEqual(self.connector.get('site', 'dead'), {})
+        self.assertEqual(self.connector.get_response('site', 'dead'), None)
+        # Other sites are left alone, along with the context they still use.
+        self.assertEqual(self.connector.get('other', 'dead'), {'spam': 'ham'})
+        self.assertEqual(self.connector.prune('site', ['keep']), 0)
+
+    def test_compact(self):
+        large = os.urandom(100000)
+        self.connector.put('site', 'rule', {'large': large})
+        self.connector.put('site', 'rule', {})
+        self.assertTrue(self.connector.compact() > len(large) / 2)
+        db = self.connector.connect()
+        self.assertEqual(
+            db.execute('PRAGMA freelist_count;').fetchone()[0], 0)
+        self.assertEqual(self.connector.get('site', 'rule'), {})
+        self.assertEqual(self.connector.compact(), 0)
+
+    def test_lazy_exports(self):
+        large = range(self.connector.eager_bytes)
+        self.connector.put('site', 'rule', {'title': 'Title', 'large': large})
+        context = self.connector.get('site', 'rule')
+        self.assertEqual(sorted(context), ['large', 'title'])
+        self.assertEqual(context.loaded, {'title': 'Title'})
+        self.assertEqual(set(type(name) for name in context), set([str]))
+        self.assertEqual(context['large'], large)
+        self.assertEqual(context.load(), {'title': 'Title', 'large': large})
+        self.assertEqual(set(type(name) for name in context.load()),
+                         set([str]))
+
+    def test_lazy_template(self):
+        # Random bytes, so that the export stays large if compressed.
+        large = os.urandom(self.connector.eager_bytes + 1)
+        self.connector.put('site', 'rule', {'title': 'Title', 'large': large})
+        context = self.connector.get('site', 'rule')
+        # Rendering reads only the exports which the template uses.
+        with build_app('simplesite').test_request_context():
+            response = TemplateWriter('index.html').write(context)
+        self.assertTrue('<title>Title</title>' in response)
+        self.assertFalse('large' in context.loaded)
+
+    def test_chunked_export(self):
+        self.app.config['SHELF_CHUNK_ITEMS'] = 100
+        items = range(1050)
+        self.connector.put('site', 'rule', {'items': items, 'few': [1, 2]})
+        db = self.connector.connect()
+        count = db.execute('SELECT COUNT(*) FROM chunks;').fetchone()[0]
+        self.assertEqual(count, 11)
+        context = self.connector.get('site', 'rule')
+        self.assertEqual(context['few'], [1, 2])
+        chunked = context['items']
+        self.assertTrue(isinstance(chunked, ChunkedList))
+        self.assertEqual(len(chunked), 1050)
+        # A page reads only the chunks of its items.
+        self.assertEqual(chunked[190:210], range(190, 210))
+        self.assertEqual(sorted(chunked.chunks), [1, 2])
+        self.assertEqual(chunked, items)
+        # Shelving it again, as read, stores the same context.
+        self.connector.put('site', 'rule', {'items': chunked, 'few': [1, 2]})
+        self.assertEqual(self.connector.get('site', 'rule')['items'], items)
+        count = db.execute('SELECT COUNT(*) FROM contexts;').fetchone()[0]
+        self.assertEqual(count, 1)
+
+    def test_replaced_while_read(self):
+        self.app.config['SHELF_CHUNK_ITEMS'] = 100
+        large = os.urandom(self.connector.eager_bytes + 1)
+        self.connector.put('site', 'rule', {'items': range(1000),
+                                            'large': large})
+        context = self.connector.get('site', 'rule')
+        items = context['items']
+        self.connector.put('site', 'rule', {})
+        self.assertRaises(StaleContextError, items.__getitem__, 500)
+        self.assertRaises(StaleContextError, context.__getitem__, 'large')
+
+    def test_chunks_compacted(self):
+        self.app.config['SHELF_CHUNK_ITEMS'] = 100
+        self.connector.put('site', 'rule', {'items': range(1000)})
+        self.connector.put('site', 'rule', {'items': []})
+        self.connector.compact()
+        db = self.connector.connect()
+        count = db.execute('SELECT COUNT(*) FROM chunks;').fetchone()[0]
+        self.assertEqual(count, 0)
+
+    def test_manifest(self):
+        self.assertEqual(self.connector.get_manifest(), {})
+        self.connector.put_manifest([('site.stash.one', 'abc', ['/one']),
+                                     ('site.stash.two', 'def', ['/a', '/b'])])
+        self.connector.put_manifest([('site.stash.one', 'ghi', ['/one'])])
+        self.assertEqual(self.connector.get_manifest(),
+                         {'site.stash.one': ('ghi', ['/one']),
+                          'site.stash.two': ('def', ['/a', '/b'])})
+        self.connector.put_manifest([('site.stash.two', None, None)])
+        self.assertEqual(sorted(self.connector.get_manifest()),
+                         ['site.stash.one'])
+
+    def test_app_releases_connection(self):
+        app = build_app('testsite', import_stash=True)
+        app.config['SQLITE_FILEPATH'] = self.temp_filepath
+        try:
+            app.test_client().get('/')
+            connector = app.connector
+            self.assertEqual(len(connector.connections), 1)
+            self.assertEqual(connector.idle, connector.connections)
+        finally:
+            app.close_connector()
+
+    def test_app_freed(self):
+        app = build_app('testsite')
+        app.config['SQLITE_FILEPATH'] = self.temp_filepath
+        app.connector.connect()
+        ref = weakref.ref(app)
+        del app
+        gc.collect()
+        self.assertTrue(ref() is None)
+
+    def test_app_connector(self):
+        self.app.config['SHELF_CONNECTOR_CLASS'] = SqliteConnector
+        connector = self.app.connector
+        self.assertTrue(isinstance(connector, SqliteConnector))
+        self.assertTrue(self.app.connector is connector)
+        self.app.close_connector()
+        self.assertFalse(self.app.connector is connector)
+        self.app.close_connector()
+
+
+class CompressedSqliteConnectorTestCase(SqliteConnectorTestCase):
+
+    def setUp(self):
+        self.app.config['SHELF_CODEC'] = 'zlib+pickle'
+        SqliteConnectorTestCase.setUp(self)
+
+    def test_codec(self):
+        self.connector.put('site', 'rule', {'spam': 'eggs'})
+        db = self.connector.connect()
+        codec = db.execute('SELECT codec FROM exports;').fetchone()[0]
+        self.assertEqual(codec, 'zlib+pickle')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,66 @@
+import json
+import unittest
+
+from tango.factory.stash import shelve
+from tango.writers import TemplateWriter
+
+from common_tests import ShelvedAppTestCase
+
+
+class StreamingTestCase(ShelvedAppTestCase):
+
+    site = 'streamsite'
+
+    def test_writer(self):
+        writer = self.app.get_writer('stream:items.html')
+        self.assertTrue(isinstance(writer, TemplateWriter))
+        self.assertTrue(writer.stream)
+        self.assertFalse(self.app.get_writer('template:items.html').stream)
+
+    def test_streamed(self):
+        with self.app.test_request_context('/items/'):
+            response = self.app.view_functions['/items/']()
+            self.assertTrue(response.is_streamed)
+            chunks = list(response.iter_encoded())
+        self.assertTrue(len(chunks) > 1)
+        self.assertTrue(max(len(chunk) for chunk in chunks) < 1000)
+
+    def test_same_body(self):
+        streamed = self.client.get('/items/')
+        rendered = self.client.get('/items.html')
+        self.assertEqual(streamed.data, rendered.data)
+        self.assertEqual(streamed.mimetype, 'text/html')
+        self.assertTrue('<li>999</li>' in streamed.data)
+
+    def test_prerendered(self):
+        shelve(self.app, prerender=True)
+        body, mimetype = self.app.connector.get_response('streamsite',
+                                                         '/items/')
+        self.assertEqual(body, self.client.get('/items.html').data)
+
+    def test_json_stream(self):
+        with self.app.test_request_context('/items/stream.json'):
+            response = self.app.view_functions['/items/stream.json']()
+            self.assertTrue(response.is_streamed)
+        streamed = self.client.get('/items/stream.json')
+        self.assertEqual(streamed.mimetype, 'application/json')
+        self.assertEqual(json.loads(streamed.data),
+                         json.loads(self.client.get('/items.json').data))
+
+    def test_ndjson(self):
+        response = self.client.get('/items.ndjson')
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.data.splitlines()
+        self.assertEqual(json.loads(lines[0]), {'title': 'Items'})
+        self.assertEqual([json.loads(line) for line in lines[1:]],
+                         range(1000))
+
+    def test_json_prerendered(self):
+        shelve(self.app, prerender=True)
+        body, mimetype = self.app.connector.get_response(
+            'streamsite', '/items/stream.json')
+        self.assertEqual(json.loads(body)['items'], range(1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
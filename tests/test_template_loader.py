@@ -0,0 +1,77 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from jinja2 import Environment, TemplateNotFound
+
+from tango.app import TemplateLoader
+
+
+class TemplateLoaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.templates = os.path.join(self.path, 'loadersite', 'templates')
+        os.makedirs(os.path.join(self.templates, 'default'))
+        open(os.path.join(self.path, 'loadersite', '__init__.py'), 'w').close()
+        sys.path.insert(0, self.path)
+        self.write('default/index.html', 'Default')
+        self.config = {}
+        self.loader = TemplateLoader('loadersite', config=self.config)
+        self.environment = Environment(loader=self.loader)
+
+    def tearDown(self):
+        sys.path.remove(self.path)
+        sys.modules.pop('loadersite', None)
+        shutil.rmtree(self.path)
+
+    def write(self, name, content):
+        filepath = os.path.join(self.templates, name)
+        directory = os.path.dirname(filepath)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        mtime = os.stat(directory).st_mtime
+        with open(filepath, 'w') as fd:
+            fd.write(content)
+        # Move the mtime on, in case the filesystem's resolution is coarse.
+        os.utime(directory, (mtime + 1, mtime + 1))
+
+    def render(self, name):
+        return self.environment.get_template(name).render()
+
+    def refuse_lookups(self):
+        def has_resource(path):
+            raise AssertionError('Template looked up again: ' + path)
+        self.loader.provider.has_resource = has_resource
+
+    def test_memoized(self):
+        self.assertEqual(self.render('index.html'), 'Default')
+        self.assertRaises(TemplateNotFound, self.render, 'nosuch.html')
+        self.refuse_lookups()
+        self.assertEqual(self.loader.resolve('index.html'),
+                         'default/index.html')
+        self.assertEqual(self.loader.resolve('nosuch.html'), None)
+
+    def test_invalidated(self):
+        self.assertEqual(self.render('index.html'), 'Default')
+        self.assertRaises(TemplateNotFound, self.render, 'nosuch.html')
+        self.write('index.html', 'Override')
+        self.write('nosuch.html', 'Found')
+        self.assertEqual(self.render('index.html'), 'Override')
+        self.assertEqual(self.render('nosuch.html'), 'Found')
+
+    def test_variants(self):
+        self.write('mobile/index.html', 'Mobile')
+        self.assertEqual(self.render('index.html'), 'Default')
+        self.config['TEMPLATE_VARIANTS'] = ['mobile', '', 'default']
+        self.assertEqual(self.loader.resolve('index.html'),
+                         'mobile/index.html')
+        self.config['TEMPLATE_VARIANTS'] = ['', 'default']
+        self.assertEqual(self.loader.resolve('index.html'),
+                         'default/index.html')
+
+
+if __name__ == '__main__':
+    unittest.main()
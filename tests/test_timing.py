@@ -0,0 +1,76 @@
+import unittest
+
+from tango import timing
+
+from common_tests import ShelvedAppTestCase
+
+
+class TimingTestCase(ShelvedAppTestCase):
+
+    config = {'SHELF_TIMING': True}
+
+    def create_app(self):
+        app = ShelvedAppTestCase.create_app(self)
+        app.debug = True
+        return app
+
+    def phases(self, response):
+        header = response.headers['Server-Timing']
+        return [item.split(';')[0] for item in header.split(', ')]
+
+    def test_header(self):
+        self.app.close_connector()
+        response = self.client.get('/')
+        self.assertEqual(self.phases(response),
+                         ['connect', 'fetch', 'decode', 'render', 'response',
+                          'total'])
+        # The connection is pooled, so it is not timed again.
+        response = self.client.get('/')
+        self.assertFalse('connect;' in response.headers['Server-Timing'])
+
+    def test_not_modified(self):
+        self.app.config['SHELF_CONDITIONAL'] = True
+        etag = self.client.get('/').headers['ETag']
+        response = self.client.get('/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.phases(response),
+                         ['fetch', 'response', 'total'])
+
+    def test_histograms(self):
+        for x in range(3):
+            self.client.get('/')
+        self.client.get('/argument/live/')
+        histograms = self.app.phase_timings.snapshot()
+        self.assertEqual(histograms['/']['render'][1], 3)
+        self.assertEqual(sum(histograms['/']['render'][0]), 3)
+        self.assertEqual(histograms['/argument/<argument>/']['fetch'][1], 1)
+
+    def test_error(self):
+        def get_sized(site, rule):
+            raise RuntimeError('Shelf is gone.')
+        self.app.connector.get_sized = get_sized
+        # Answer with an error page, rather than raise the error.
+        self.app.testing = self.app.debug = False
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 500)
+        # The failed request is recorded, and its timer cleared.
+        histograms = self.app.phase_timings.snapshot()
+        self.assertEqual(histograms['/']['total'][1], 1)
+        self.assertTrue(timing._local.timer is None)
+
+    def test_not_debug(self):
+        self.app.debug = False
+        response = self.client.get('/')
+        self.assertFalse('Server-Timing' in response.headers)
+        self.assertEqual(self.app.phase_timings.snapshot()['/']['fetch'][1],
+                         1)
+
+    def test_disabled(self):
+        self.app.config['SHELF_TIMING'] = False
+        response = self.client.get('/')
+        self.assertFalse('Server-Timing' in response.headers)
+        self.assertEqual(self.app.phase_timings.snapshot(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
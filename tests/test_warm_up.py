@@ -0,0 +1,37 @@
+import unittest
+
+from common_tests import ShelvedAppTestCase
+
+
+class WarmUpTestCase(ShelvedAppTestCase):
+
+    config = {'SHELF_CACHE': True}
+
+    def test_report(self):
+        report = self.app.warm_up(contexts=3)
+        self.assertEqual([phase for phase, _, _ in report],
+                         ['writers', 'templates', 'contexts'])
+        counts = dict((phase, count) for phase, count, _ in report)
+        self.assertEqual(counts['contexts'], 3)
+        self.assertTrue(counts['templates'] > 0)
+
+    def test_templates(self):
+        self.app.warm_up()
+        def compile(*args, **kwargs):
+            raise AssertionError('Template compiled after warm-up.')
+        self.app.jinja_env.compile = compile
+        client = self.app.test_client()
+        for route in self.app.routes:
+            if not route.has_arguments:
+                client.get(route.rule)
+
+    def test_contexts(self):
+        self.app.warm_up(contexts=len(self.app.routes))
+        stats = self.app.connector.stats()
+        self.assertEqual(stats['misses'], len(self.app.routes))
+        self.app.test_client().get('/')
+        self.assertEqual(self.app.connector.stats()['hits'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -30,6 +30,20 @@ class FactoryWarningTestCase(TestCase):
             assert 'duplicate context' in str(w[0].message)
 
 
+    def test_duplicate_context_warning_jobs(self):
+        with warnings.catch_warnings(record=True) as w:
+            routes = context.build_module_routes('warningsite.stash.context',
+                                                 import_stash=True, jobs=2)
+            assert len(w) == 1
+            assert issubclass(w[0].category, DuplicateContextWarning)
+            assert 'duplicate context' in str(w[0].message)
+        # Contexts are merged as pulled in this process, in module order.
+        sequential = context.build_module_routes('warningsite.stash.context',
+                                                 import_stash=True)
+        assert [route.context for route in routes] == \
+               [route.context for route in sequential]
+
+
     def test_duplicate_route_warning(self):
         with warnings.catch_warnings(record=True) as w:
             context.build_module_routes('warningsite.stash.route')
@@ -52,6 +66,12 @@ class FactoryWarningTestCase(TestCase):
                                         import_stash=True)
             assert len(w) == 3
 
+    def test_duplicate_multiple_warnings_jobs(self):
+        with warnings.catch_warnings(record=True) as w:
+            context.build_module_routes('warningsite.stash',
+                                        import_stash=True, jobs=2)
+            assert len(w) == 3
+
 
 if __name__ == '__main__':
     unittest.main()